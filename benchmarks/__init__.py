@@ -0,0 +1,4 @@
+'''
+Offline benchmarks for the security group generators, run from the
+repository root with python -m benchmarks.run_benchmarks
+'''
@@ -0,0 +1,122 @@
+'''
+Times the group name normalisation done for every row of the ingress
+and egress sheets, with the cached functions in sgautomation.names
+against the same work done from scratch on each call, e.g.
+  python -m benchmarks.bench_names --rules 100000 --groups 1000
+Each row needs the short code and logical name of its group, the
+logical name of a group peer and the resolver key of both names.
+'''
+
+import argparse
+import json
+import re
+import time
+
+from benchmarks.estate import SyntheticEstate
+from sgautomation import names
+
+
+# the normalisation as it was done before sgautomation.names, kept here
+# as the baseline
+def uncached_group_name(raw_name):
+    if 'temp' in raw_name.lower():
+        return raw_name
+    elif 'SSM' in raw_name:
+        return raw_name
+    clean_name = raw_name.lower().title()
+    clean_name = re.sub(r"[^a-zA-Z0-9]", '', clean_name)
+    return clean_name
+
+
+def uncached_short_code(raw_name):
+    split_name = raw_name.split('_')[0].split(' ')
+    return split_name[0].lower()
+
+
+def uncached_group_key(name):
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+
+def sheet_names(estate):
+    '''
+    Returns (group, peer or None) for each ingress and egress row
+    '''
+    rows = []
+    for row in list(estate.ingress_rows()) + list(estate.egress_rows()):
+        rows.append((row[1], row[5] if row[6] == 'Group' else None))
+    return rows
+
+
+def normalise_rows(rows, group_name, short_code, group_key):
+    results = []
+    for group, peer in rows:
+        logical_name = group_name(group)
+        result = (short_code(group), logical_name, group_key(logical_name))
+        if peer is not None:
+            peer_name = group_name(peer)
+            result += (peer_name, group_key(peer_name))
+        results.append(result)
+    return results
+
+
+def time_rows(rows, group_name, short_code, group_key, repeat):
+    best = None
+    results = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = normalise_rows(rows, group_name, short_code, group_key)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+def process_args():
+    parser = argparse.ArgumentParser(
+        description='Times cached against uncached group name normalisation'
+    )
+    parser.add_argument('--rules', type=int, default=100000,
+                        help='rules in each of the ingress and egress sheets')
+    parser.add_argument('--groups', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of each variant, the fastest is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the results as JSON')
+    return parser.parse_args()
+
+
+def main():
+    args = process_args()
+    rows = sheet_names(SyntheticEstate(args.rules, args.groups, seed=args.seed))
+    uncached, expected = time_rows(rows, uncached_group_name, uncached_short_code,
+                                   uncached_group_key, args.repeat)
+    # the first cached run pays for filling the caches
+    names.clear_caches()
+    start = time.perf_counter()
+    cold_results = normalise_rows(rows, names.generate_group_name,
+                                  names.generate_short_code, names.group_key)
+    cold = time.perf_counter() - start
+    warm, results = time_rows(rows, names.generate_group_name, names.generate_short_code,
+                              names.group_key, args.repeat)
+    if results != expected or cold_results != expected:
+        raise SystemExit('Cached names differ from the uncached ones')
+    result = {
+        'rows': len(rows),
+        'groups': args.groups,
+        'uncached_seconds': uncached,
+        'cached_cold_seconds': cold,
+        'cached_warm_seconds': warm,
+        'speedup_cold': uncached / cold,
+        'speedup_warm': uncached / warm,
+        'cache': names.cache_info(),
+    }
+    print('{} rows: uncached {:.3f}s, cached {:.3f}s cold ({:.1f}x), {:.3f}s warm ({:.1f}x)'.format(
+        len(rows), uncached, cold, result['speedup_cold'], warm, result['speedup_warm']
+    ))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(result, output, indent=1, sort_keys=True)
+        print('Results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+'''
+Synthetic estates: creation, ingress and egress sheets of a chosen size
+with a matching EC2 inventory
+'''
+
+import csv
+import os
+import random
+import re
+
+from benchmarks.stub_client import StubEC2Client
+
+REGION = 'eu-west-2'
+# (vpc_code in the creation sheet, group name prefix, CIDR)
+VPCS = (
+    ('Mgmt', 'Mgt', '172.23.64.0/19'),
+    ('DMZ', 'dmz', '172.23.0.0/19'),
+    ('Appdata', 'AppD', '172.23.32.0/19'),
+)
+CREATION_HEADER = ['SECURITY GROUP NAME', 'SECURITY GROUP DESCRIPTION', 'vpc_code']
+INGRESS_HEADER = [
+    'RULE ID', 'SECURITY GROUP NAME', 'FROM PORT', 'TO PORT', 'PROTOCOL',
+    'FROM REFERENCE', 'FROM TYPE', 'DESCRIPTION', 'DIRECTION', 'Notes',
+]
+EGRESS_HEADER = [
+    'RULE ID', 'SECURITY GROUP NAME', 'FROM PORT', 'TO PORT', 'PROTOCOL',
+    'TO SECURITY GROUP', 'FROM TYPE', 'DESCRIPTION', 'DIRECTION', 'Notes',
+]
+COMMON_PORTS = (22, 53, 80, 88, 135, 389, 443, 445, 636, 1433, 3128, 3389, 5432, 8080, 8443)
+# share of rules naming a group that does not exist, to exercise skips
+UNKNOWN_GROUP_RATE = 0.02
+
+
+def logical_name(name):
+    return re.sub(r'[^a-zA-Z0-9]', '', name.lower().title())
+
+
+class SyntheticEstate(object):
+    '''
+    A reproducible estate of group_count groups spread over the mgmt,
+    dmz and appdata VPCs of env_name, with rule_count ingress and
+    rule_count egress rules between them. Rules use group, VPC, CIDR
+    and load balancer peers in roughly the mix of the example sheets.
+    '''
+    def __init__(self, rule_count, group_count, env_name='bench', seed=0):
+        self.rule_count = rule_count
+        self.group_count = group_count
+        self.env_name = env_name
+        self.random = random.Random(seed)
+        self.groups = [
+            ('{}_Group_{:05d}'.format(VPCS[i % len(VPCS)][1], i), VPCS[i % len(VPCS)][0])
+            for i in range(group_count)
+        ]
+        self.load_balancers = [
+            '{}-BenchNLB-{:02d}'.format(('dmz', 'mgmt')[i % 2], i)
+            for i in range(max(2, group_count // 100))
+        ]
+
+    def vpc_id(self, vpc_code):
+        return 'vpc-{}'.format(vpc_code.lower())
+
+    def vpcs(self):
+        vpcs = []
+        for vpc_code, _, cidr in VPCS:
+            name = '{}-{}'.format(vpc_code.lower(), self.env_name)
+            vpcs.append({
+                'VpcId': self.vpc_id(vpc_code),
+                'CidrBlock': cidr,
+                'Tags': [
+                    {'Key': 'Name', 'Value': name},
+                    {'Key': 'VPC_Short_Code', 'Value': name},
+                ],
+            })
+        vpcs.append({'VpcId': 'vpc-other', 'CidrBlock': '10.0.0.0/16',
+                     'Tags': [{'Key': 'Name', 'Value': 'other'}]})
+        return vpcs
+
+    def security_groups(self):
+        groups = []
+        for i, (name, vpc_code) in enumerate(self.groups):
+            groups.append({
+                'GroupName': '{}-{}-SecurityGroup-{}'.format(
+                    vpc_code.lower(), self.env_name, logical_name(name)
+                ),
+                'GroupId': 'sg-{:08x}'.format(i),
+                'VpcId': self.vpc_id(vpc_code),
+                'IpPermissions': [],
+                'IpPermissionsEgress': [{
+                    'IpProtocol': '-1', 'IpRanges': [{'CidrIp': '0.0.0.0/0'}],
+                    'UserIdGroupPairs': [], 'Ipv6Ranges': [], 'PrefixListIds': [],
+                }],
+            })
+        groups.append({'GroupName': 'd-0000000000_controllers', 'GroupId': 'sg-dc',
+                       'VpcId': self.vpc_id('Mgmt'), 'IpPermissions': [],
+                       'IpPermissionsEgress': []})
+        return groups
+
+    def network_interfaces(self):
+        interfaces = [{
+            'NetworkInterfaceId': 'eni-dc', 'InterfaceType': 'interface',
+            'Description': 'AWS created network interface for directory d-0000000000',
+            'AvailabilityZone': REGION + 'a', 'PrivateIpAddress': '172.23.64.5',
+            'VpcId': self.vpc_id('Mgmt'),
+            'Groups': [{'GroupId': 'sg-dc', 'GroupName': 'd-0000000000_controllers'}],
+        }]
+        for i, lb in enumerate(self.load_balancers):
+            vpc_code, suffix = lb.split('-', 1)
+            for j, az in enumerate('abc'):
+                interfaces.append({
+                    'NetworkInterfaceId': 'eni-{:06x}{}'.format(i, az),
+                    'InterfaceType': 'network_load_balancer',
+                    'Description': 'ELB net/{}-{}-{}/{:016x}'.format(
+                        vpc_code, self.env_name, suffix, i
+                    ),
+                    'AvailabilityZone': REGION + az,
+                    'PrivateIpAddress': '172.23.{}.{}'.format(i // 80, (i % 80) * 3 + j + 1),
+                    'VpcId': self.vpc_id(vpc_code), 'Groups': [],
+                })
+        return interfaces
+
+    def client(self, page_size=1000):
+        return StubEC2Client(self.vpcs(), self.security_groups(),
+                             self.network_interfaces(), page_size=page_size)
+
+    def group_name(self):
+        if self.random.random() < UNKNOWN_GROUP_RATE:
+            return 'Missing_Group_{}'.format(self.random.randrange(1000))
+        return self.random.choice(self.groups)[0]
+
+    def ports(self):
+        choice = self.random.random()
+        if choice < 0.05:
+            return 'icmp', '-1', '-1'
+        protocol = 'udp' if choice < 0.15 else 'tcp'
+        if choice > 0.9:
+            start = self.random.randrange(1024, 60000)
+            return protocol, str(start), str(start + self.random.randrange(1, 1000))
+        port = str(self.random.choice(COMMON_PORTS))
+        return protocol, port, port
+
+    def cidr(self):
+        return '10.{}.{}.0/24'.format(self.random.randrange(256), self.random.randrange(256))
+
+    def ingress_rows(self):
+        for rule_id in range(1, self.rule_count + 1):
+            group = self.group_name()
+            protocol, from_port, to_port = self.ports()
+            kind = self.random.random()
+            if kind < 0.6:
+                peer, peer_type = self.group_name(), 'Group'
+            elif kind < 0.75:
+                peer, peer_type = self.random.choice(VPCS)[0].lower(), 'VPC'
+            else:
+                peer, peer_type = self.cidr(), 'CIDR'
+            yield [rule_id, group, from_port, to_port, protocol, peer, peer_type,
+                   '{} to {}'.format(peer, group), 'Ingress', '']
+
+    def egress_rows(self):
+        for rule_id in range(1, self.rule_count + 1):
+            group = self.group_name()
+            protocol, from_port, to_port = self.ports()
+            kind = self.random.random()
+            if kind < 0.6:
+                peer, peer_type = self.group_name(), 'Group'
+            elif kind < 0.85:
+                peer, peer_type = self.cidr(), 'CIDR'
+            else:
+                peer = self.random.choice(self.load_balancers)
+                peer_type = 'LB_' + self.random.choice('ABC')
+            yield [rule_id, group, from_port, to_port, protocol, peer, peer_type,
+                   '{} to {}'.format(group, peer), 'Egress', '']
+
+    def write_sheets(self, directory):
+        '''
+        Writes the three sheets to directory and returns their paths
+        '''
+        paths = {
+            'creation': os.path.join(directory, 'creation.csv'),
+            'ingress': os.path.join(directory, 'ingress.csv'),
+            'egress': os.path.join(directory, 'egress.csv'),
+        }
+        sheets = (
+            ('creation', CREATION_HEADER, (
+                [name, 'Control flow to and from {}'.format(name), vpc_code]
+                for name, vpc_code in self.groups
+            )),
+            ('ingress', INGRESS_HEADER, self.ingress_rows()),
+            ('egress', EGRESS_HEADER, self.egress_rows()),
+        )
+        for kind, header, rows in sheets:
+            with open(paths[kind], 'w', newline='') as sheet:
+                writer = csv.writer(sheet)
+                writer.writerow(header)
+                writer.writerows(rows)
+        return paths
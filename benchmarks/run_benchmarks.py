@@ -0,0 +1,201 @@
+'''
+Times the three generator pipelines against synthetic estates, fully
+offline, and writes the results as JSON, e.g.
+  python -m benchmarks.run_benchmarks --sizes 100:50,1000:500 --output bench.json
+Each size is RULES:GROUPS; the ingress and egress sheets each get RULES
+rules and the creation sheet GROUPS groups.
+'''
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+from contextlib import contextmanager
+
+from benchmarks.estate import SyntheticEstate
+from sgautomation.egress import EgressGenerator
+from sgautomation.emitter import TEMPLATE_FORMATS, YAML_FORMAT
+from sgautomation.groups import DEFAULT_VPCSHORTCODE_TAG, GroupGenerator
+from sgautomation.ingress import IngressGenerator
+from sgautomation.inventory import AwsInventory, env_vpc_names
+from sgautomation.rules import EgressRule, GroupDefinition, IngressRule, RuleSheetReader
+
+DEFAULT_SIZES = '100:50,1000:200,10000:1000'
+LOG_FILE = '/tmp/securitygroupsbenchmarks.log'
+PHASES = ('csv_parse', 'inventory_load', 'group_resolution', 'structure_build', 'yaml_emit')
+
+
+class PhaseTimer(object):
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def total(self):
+        return sum(self.phases.values())
+
+
+def parse_sizes(sizes):
+    '''
+    Parses RULES:GROUPS[,RULES:GROUPS...]
+    '''
+    parsed = []
+    for size in sizes.split(','):
+        rules, _, groups = size.partition(':')
+        parsed.append((int(rules), int(groups or max(1, int(rules) // 20))))
+    return parsed
+
+
+def bench_basic(estate, paths, output_dir, output_format):
+    timer = PhaseTimer()
+    with timer.phase('csv_parse'):
+        data = list(RuleSheetReader(paths['creation'], GroupDefinition))
+    client = estate.client()
+    with timer.phase('inventory_load'):
+        inventory = AwsInventory.load(client, security_groups=False,
+                                      network_interfaces=False)
+    with timer.phase('group_resolution'):
+        generator = GroupGenerator(data, inventory=inventory,
+                                   output_format=output_format)
+    with timer.phase('structure_build'):
+        generator.generate_security_group_structure(
+            vpc_short_code_part2=estate.env_name, vpc_tag=DEFAULT_VPCSHORTCODE_TAG
+        )
+    with timer.phase('yaml_emit'):
+        generator.generate_templates(template_path=output_dir)
+    return timer, len(data), len(generator.resources), client
+
+
+def bench_rules(generator_class, record_type, sheet, estate, paths, output_dir, workers,
+                output_format):
+    timer = PhaseTimer()
+    with timer.phase('csv_parse'):
+        data = list(RuleSheetReader(paths[sheet], record_type))
+    client = estate.client()
+    with timer.phase('inventory_load'):
+        inventory = AwsInventory.load(client, vpc_names=env_vpc_names(estate.env_name))
+    with timer.phase('group_resolution'):
+        generator = generator_class(
+            data, env_name=estate.env_name, inventory=inventory,
+            output_format=output_format
+        )
+        names = set()
+        for rule in data:
+            names.add(rule.group)
+            if rule.peer_type == 'Group':
+                names.add(rule.peer)
+        for name in names:
+            generator.get_security_group_id(generator.generate_group_name(name))
+    with timer.phase('structure_build'):
+        generator.generate_security_group_structure(workers=workers)
+    with timer.phase('yaml_emit'):
+        generator.write_to_file(template_path=output_dir)
+    return timer, len(data), len(generator.compiled_rules), client
+
+
+def run_size(rule_count, group_count, workdir, repeat, workers, seed, output_format):
+    estate = SyntheticEstate(rule_count, group_count, seed=seed)
+    sheet_dir = os.path.join(workdir, 'sheets-{}-{}'.format(rule_count, group_count))
+    os.makedirs(sheet_dir, exist_ok=True)
+    paths = estate.write_sheets(sheet_dir)
+    pipelines = (
+        ('basic', lambda output_dir: bench_basic(estate, paths, output_dir, output_format)),
+        ('ingress', lambda output_dir: bench_rules(
+            IngressGenerator, IngressRule, 'ingress', estate, paths, output_dir, workers,
+            output_format)),
+        ('egress', lambda output_dir: bench_rules(
+            EgressGenerator, EgressRule, 'egress', estate, paths, output_dir, workers,
+            output_format)),
+    )
+    results = []
+    for pipeline, bench in pipelines:
+        runs = []
+        for run in range(repeat):
+            output_dir = tempfile.mkdtemp(dir=workdir)
+            timer, rows_in, resources_out, client = bench(output_dir)
+            runs.append(timer)
+            shutil.rmtree(output_dir)
+        best = min(runs, key=lambda timer: timer.total())
+        results.append({
+            'pipeline': pipeline,
+            'rules': rule_count,
+            'groups': group_count,
+            'rows_in': rows_in,
+            'resources_out': resources_out,
+            'aws_calls': client.calls,
+            'repeat': repeat,
+            'phases': {phase: round(best.phases.get(phase, 0.0), 6) for phase in PHASES},
+            'total': round(best.total(), 6),
+        })
+        print('{:>8} rules {:>6} groups {:<8} {:8.3f}s  {}'.format(
+            rule_count, group_count, pipeline, best.total(),
+            ' '.join('{}={:.3f}'.format(phase, best.phases.get(phase, 0.0)) for phase in PHASES)
+        ))
+    return results
+
+
+def process_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the generators against synthetic estates'
+    )
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help='comma separated RULES:GROUPS sizes (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per size; the fastest is kept (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='--workers passed to the rule generators (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--format', choices=TEMPLATE_FORMATS, default=YAML_FORMAT,
+                        dest='output_format',
+                        help='template format written (default: %(default)s)')
+    parser.add_argument('--output', default='benchmark-results.json',
+                        help='JSON results file (default: %(default)s)')
+    parser.add_argument('--workdir', help='keep the generated sheets here')
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(
+        format='%(levelname)s: %(asctime)s %(message)s',
+        filename=LOG_FILE,
+        level=logging.WARNING
+    )
+    args = process_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix='sg-benchmarks-')
+    results = []
+    try:
+        for rule_count, group_count in parse_sizes(args.sizes):
+            results.extend(run_size(rule_count, group_count, workdir,
+                                    args.repeat, args.workers, args.seed,
+                                    args.output_format))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir)
+    with open(args.output, 'w') as output:
+        json.dump({
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'workers': args.workers,
+            'seed': args.seed,
+            'format': args.output_format,
+            'results': results,
+        }, output, indent=1, sort_keys=True)
+    print('Results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
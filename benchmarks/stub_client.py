@@ -0,0 +1,98 @@
+'''
+An in-memory stand-in for the boto3 EC2 client, serving a synthetic
+estate through the same paginated describe calls the generators make
+'''
+
+import copy
+import fnmatch
+import time
+
+from sgautomation.metrics import METRICS
+
+RESULT_KEYS = {
+    'describe_vpcs': 'Vpcs',
+    'describe_security_groups': 'SecurityGroups',
+    'describe_network_interfaces': 'NetworkInterfaces',
+    'describe_instances': 'Reservations',
+}
+FILTER_FIELDS = {
+    'vpc-id': 'VpcId',
+    'group-id': 'GroupId',
+    'group-name': 'GroupName',
+    'interface-type': 'InterfaceType',
+    'description': 'Description',
+}
+
+
+def matches(item, filters):
+    for query_filter in filters or []:
+        name = query_filter['Name']
+        if name.startswith('tag:'):
+            tags = {tag['Key']: tag['Value'] for tag in item.get('Tags', [])}
+            value = tags.get(name[4:])
+        else:
+            value = item.get(FILTER_FIELDS[name])
+        if not any(fnmatch.fnmatchcase(value or '', pattern)
+                   for pattern in query_filter['Values']):
+            return False
+    return True
+
+
+class StubPaginator(object):
+
+    def __init__(self, client, operation):
+        self.client = client
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        items = self.client.query(self.operation, kwargs.get('Filters'))
+        key = RESULT_KEYS[self.operation]
+        page_size = self.client.page_size
+        for start in range(0, max(len(items), 1), page_size):
+            yield {key: items[start:start + page_size]}
+
+
+class StubEC2Client(object):
+    '''
+    Serves describe_* calls (directly or through get_paginator) from
+    lists of items, honouring the filters the generators use, and
+    counts the calls made. Items are deep copied, as boto3 would return
+    fresh objects.
+    '''
+    def __init__(self, vpcs=(), security_groups=(), network_interfaces=(),
+                 reservations=(), page_size=1000):
+        self.items = {
+            'describe_vpcs': list(vpcs),
+            'describe_security_groups': list(security_groups),
+            'describe_network_interfaces': list(network_interfaces),
+            'describe_instances': list(reservations),
+        }
+        self.page_size = page_size
+        self.calls = {}
+
+    def query(self, operation, filters=None):
+        start = time.perf_counter()
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+        items = copy.deepcopy([
+            item for item in self.items[operation] if matches(item, filters)
+        ])
+        METRICS.aws_call(operation, time.perf_counter() - start)
+        return items
+
+    def get_paginator(self, operation):
+        return StubPaginator(self, operation)
+
+    def can_paginate(self, operation):
+        return operation in RESULT_KEYS
+
+    def describe_vpcs(self, **kwargs):
+        return {'Vpcs': self.query('describe_vpcs', kwargs.get('Filters'))}
+
+    def describe_security_groups(self, **kwargs):
+        return {'SecurityGroups': self.query('describe_security_groups', kwargs.get('Filters'))}
+
+    def describe_network_interfaces(self, **kwargs):
+        return {'NetworkInterfaces': self.query('describe_network_interfaces', kwargs.get('Filters'))}
+
+    def describe_instances(self, **kwargs):
+        return {'Reservations': self.query('describe_instances', kwargs.get('Filters'))}
@@ -0,0 +1,103 @@
+'''
+Version 0.1
+Generates the security group, ingress and egress templates in a single
+run, sharing one AWS inventory. Rules refer to the groups defined in the
+creation sheet through Fn::ImportValue, so the group stacks do not have
+to be deployed before the rule templates are generated.
+'''
+
+import argparse
+import logging
+import os
+import sys
+
+from sgautomation.cli import (
+    add_apply_arguments, add_generation_arguments, add_inventory_arguments,
+    add_metrics_arguments, add_quota_arguments, add_report_arguments,
+    apply_client, check_apply_arguments, finish_metrics, load_inventory,
+    start_metrics
+)
+from sgautomation.inventory import UnresolvedVpcError
+from sgautomation.pipeline import generate_all
+from sgautomation.quota import QuotaExceededError
+from sgautomation.rules import (
+    EgressRule, GroupDefinition, IngressRule, RuleSheetReader
+)
+
+LOG_FILE = '/tmp/securitygroupsall.log'
+
+def process_args():
+    '''
+    Args as follows:
+    1. creation_file - the security group creation csv
+    2. ingress_file  - the ingress rules csv
+    3. egress_file   - the egress rules csv
+    4. env_name      - the vpc suffix - e.g for the vpc mgmt-nonprod,
+                       the env_name would be nonprod
+    5. awsprofile    - the boto profile to be used
+    6. template_path - the output path for all generated templates
+    Followed by the optional inventory, generation, report, quota and
+    apply flags.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Generate security group, ingress and egress templates'
+    )
+    parser.add_argument('creation_file')
+    parser.add_argument('ingress_file')
+    parser.add_argument('egress_file')
+    parser.add_argument('env_name')
+    parser.add_argument('awsprofile')
+    parser.add_argument('template_path')
+    add_inventory_arguments(parser)
+    add_generation_arguments(parser)
+    add_report_arguments(parser)
+    add_quota_arguments(parser)
+    add_apply_arguments(parser)
+    add_metrics_arguments(parser)
+    return check_apply_arguments(parser, parser.parse_args())
+
+def main():
+    if not os.path.exists(LOG_FILE):
+        log_file = open(LOG_FILE, 'w+')
+        log_file.close()
+    logging.basicConfig(
+        format='%(levelname)s: %(asctime)s %(message)s',
+        datefmt='%d/%m/%Y %I:%M:%S %p',
+        filename=LOG_FILE,
+        level=logging.INFO
+    )
+    args = process_args()
+    start_metrics(args)
+    inventory = load_inventory(args, args.awsprofile, args.region, args.env_name)
+    try:
+        generate_all(
+            RuleSheetReader(args.creation_file, GroupDefinition).read(),
+            RuleSheetReader(args.ingress_file, IngressRule).read(),
+            RuleSheetReader(args.egress_file, EgressRule).read(),
+            args.env_name,
+            inventory,
+            args.template_path,
+            region=args.region,
+            workers=args.workers,
+            optimise=args.optimise,
+            pack=args.pack,
+            incremental=args.incremental,
+            output_format=args.output_format,
+            drift_report=args.drift_report,
+            max_ingress_rules=args.max_ingress_rules,
+            max_egress_rules=args.max_egress_rules,
+            quota_report=args.quota_report,
+            strict_quotas=args.strict_quotas,
+            apply=args.apply,
+            client=apply_client(args, inventory, args.awsprofile, args.region),
+            dry_run=args.dry_run,
+            prune=args.prune,
+            apply_workers=args.apply_workers
+        )
+    except (QuotaExceededError, UnresolvedVpcError) as error:
+        logging.error(error)
+        sys.exit(str(error))
+    finish_metrics(args)
+
+if __name__ == '__main__':
+    main()
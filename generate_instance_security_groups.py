@@ -0,0 +1,81 @@
+'''
+Version 0.1
+Attaches security groups to instances according to the instance role
+mapping csv, matching instances on their instance_role tag. Writes the
+changes needed to a JSON plan and, with --apply, makes them.
+'''
+
+import argparse
+import logging
+import os
+
+from sgautomation.cli import (
+    add_apply_arguments, add_inventory_arguments, add_metrics_arguments,
+    apply_client, check_apply_arguments, finish_metrics, load_inventory,
+    start_metrics
+)
+from sgautomation.instances import InstanceGenerator
+from sgautomation.rules import RoleMapping, RuleSheetReader
+
+LOG_FILE = '/tmp/securitygroupsinstances.log'
+# the generator lives in sgautomation.instances; kept here for older imports
+SecurityGroupGenerator = InstanceGenerator
+
+def process_args():
+    '''
+    Args as follows:
+    1. file_name     - the instance role mapping csv
+    2. env_name      - the vpc suffix - e.g for the vpc mgmt-nonprod,
+                       the env_name would be nonprod
+    3. awsprofile    - the boto profile to be used
+    4. plan_file     - where the JSON plan of group changes is written
+    Followed by the optional inventory, apply and metrics flags. With
+    --prune, groups not mapped to an instance's role are removed from it.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Attach security groups to instances by instance_role tag'
+    )
+    parser.add_argument('file_name')
+    parser.add_argument('env_name')
+    parser.add_argument('awsprofile')
+    parser.add_argument('plan_file')
+    add_inventory_arguments(parser)
+    add_apply_arguments(parser)
+    add_metrics_arguments(parser)
+    return check_apply_arguments(parser, parser.parse_args())
+
+def main():
+    if not os.path.exists(LOG_FILE):
+        log_file = open(LOG_FILE, 'w+')
+        log_file.close()
+    logging.basicConfig(
+        format='%(levelname)s: %(asctime)s %(message)s',
+        datefmt='%d/%m/%Y %I:%M:%S %p',
+        filename=LOG_FILE,
+        level=logging.INFO
+    )
+    args = process_args()
+    start_metrics(args)
+    mappings = RuleSheetReader(args.file_name, RoleMapping).read()
+    inventory = load_inventory(args, args.awsprofile, args.region, args.env_name,
+                               instances=InstanceGenerator.load_instances,
+                               network_interfaces=InstanceGenerator.load_network_interfaces)
+    sg_generator = InstanceGenerator(mappings, env_name=args.env_name,
+                                     inventory=inventory)
+    client = None
+    if args.apply:
+        client = apply_client(args, inventory, args.awsprofile, args.region)
+    plan, result = sg_generator.assign_groups(
+        client, dry_run=not args.apply or args.dry_run, prune=args.prune,
+        workers=args.apply_workers
+    )
+    plan.write(args.plan_file)
+    print(plan.summary())
+    if args.dry_run:
+        print('\n'.join(plan.describe()))
+    elif result is not None:
+        print(result.summary())
+    finish_metrics(args)
+
+if __name__ == '__main__':
+    main()
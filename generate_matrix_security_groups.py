@@ -0,0 +1,114 @@
+'''
+Version 0.1
+Generates the security group, ingress and egress templates for every
+combination of AWS profile, region and environment in one run, e.g.
+  generate_matrix_security_groups.py create.csv in.csv out.csv nonprod,prod scotgov,scotgov-dr templates --region eu-west-1,eu-west-2
+writes templates/<profile>/<region>/<env_name>/. The inventories are
+collected concurrently, so the run takes about as long as the slowest
+target.
+'''
+
+import argparse
+import logging
+import os
+import sys
+
+from sgautomation.cli import (
+    add_generation_arguments, add_inventory_arguments, add_metrics_arguments,
+    add_quota_arguments, finish_metrics, read_inventory, start_metrics
+)
+from sgautomation.fanout import DEFAULT_TARGET_WORKERS, FanOut, target_matrix, target_path
+from sgautomation.metrics import METRICS
+from sgautomation.pipeline import generate_all
+from sgautomation.rules import (
+    EgressRule, GroupDefinition, IngressRule, RuleSheetReader
+)
+
+LOG_FILE = '/tmp/securitygroupsmatrix.log'
+
+def split_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+def process_args():
+    '''
+    Args as follows:
+    1. creation_file - the security group creation csv
+    2. ingress_file  - the ingress rules csv
+    3. egress_file   - the egress rules csv
+    4. env_names     - comma separated vpc suffixes, e.g. nonprod,prod
+    5. awsprofiles   - comma separated boto profiles
+    6. template_path - the output path; each target gets a
+                       profile/region/env_name directory below it
+    Followed by the optional inventory, generation and quota flags.
+    --region takes a comma separated list of regions here, and a
+    --quota-report file is written to each target's directory.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Generate templates for several profiles, regions and environments'
+    )
+    parser.add_argument('creation_file')
+    parser.add_argument('ingress_file')
+    parser.add_argument('egress_file')
+    parser.add_argument('env_names', type=split_list)
+    parser.add_argument('awsprofiles', type=split_list)
+    parser.add_argument('template_path')
+    add_inventory_arguments(parser)
+    add_generation_arguments(parser)
+    add_quota_arguments(parser)
+    parser.add_argument('--target-workers', type=int, default=DEFAULT_TARGET_WORKERS,
+                        help='number of inventories collected at once '
+                             '(default: %(default)s)')
+    add_metrics_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    if not os.path.exists(LOG_FILE):
+        log_file = open(LOG_FILE, 'w+')
+        log_file.close()
+    logging.basicConfig(
+        format='%(levelname)s: %(asctime)s %(threadName)s %(message)s',
+        datefmt='%d/%m/%Y %I:%M:%S %p',
+        filename=LOG_FILE,
+        level=logging.INFO
+    )
+    args = process_args()
+    start_metrics(args)
+    targets = target_matrix(args.awsprofiles, split_list(args.region), args.env_names)
+    # read once and shared by every target
+    creation_data = list(RuleSheetReader(args.creation_file, GroupDefinition))
+    ingress_data = list(RuleSheetReader(args.ingress_file, IngressRule))
+    egress_data = list(RuleSheetReader(args.egress_file, EgressRule))
+
+    def load(target):
+        with METRICS.phase('inventory_load', profile=target.profile,
+                           region=target.region, env_name=target.env_name):
+            return read_inventory(args, target.profile, target.region, target.env_name)
+
+    def generate_target(target, inventory):
+        path = target_path(args.template_path, target)
+        os.makedirs(path, exist_ok=True)
+        print('== {}'.format(path))
+        generate_all(
+            creation_data, ingress_data, egress_data, target.env_name,
+            inventory, path,
+            region=target.region,
+            workers=args.workers,
+            optimise=args.optimise,
+            pack=args.pack,
+            incremental=args.incremental,
+            output_format=args.output_format,
+            max_ingress_rules=args.max_ingress_rules,
+            max_egress_rules=args.max_egress_rules,
+            quota_report=os.path.join(path, os.path.basename(args.quota_report))
+                if args.quota_report else None,
+            strict_quotas=args.strict_quotas
+        )
+
+    results = FanOut(load, generate_target, args.target_workers).run(targets)
+    print('\n'.join(result.summary() for result in results))
+    finish_metrics(args)
+    if not all(result.ok for result in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+'''
+Version 0.1
+Checks the creation, ingress and egress sheets without generating
+anything and reports every problem found at once, e.g.
+  lint_security_group_sheets.py --creation groups.csv --ingress in.csv --egress out.csv
+  lint_security_group_sheets.py --ingress in.csv --env-name nonprod --offline --report lint.json
+With --env-name the groups, VPCs and load balancers the rules refer to
+are also looked up in the inventory. Exits non-zero when errors are
+found, or any findings at all with --strict.
+'''
+
+import argparse
+import logging
+import os
+import sys
+
+from sgautomation.cli import add_inventory_arguments, load_inventory
+from sgautomation.generator import DEFAULT_PROFILE
+from sgautomation.lint import lint_sheets
+
+LOG_FILE = '/tmp/securitygroupslint.log'
+
+def process_args():
+    '''
+    Args as follows:
+    1. --creation   - the security group creation csv
+    2. --ingress    - the ingress rules csv
+    3. --egress     - the egress rules csv
+    4. --env-name   - the vpc suffix, checks references against the
+                      inventory of that environment when given
+    5. --awsprofile - the boto profile to be used
+    6. --report     - write the findings to this file as JSON
+    7. --strict     - fail on warnings as well as errors
+    Followed by the optional inventory flags.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Check the security group sheets for problems'
+    )
+    parser.add_argument('--creation', help='the security group creation csv')
+    parser.add_argument('--ingress', help='the ingress rules csv')
+    parser.add_argument('--egress', help='the egress rules csv')
+    parser.add_argument('--env-name', help='check references against the '
+                                           'inventory of this environment')
+    parser.add_argument('--awsprofile', default=DEFAULT_PROFILE)
+    parser.add_argument('--report', metavar='FILE',
+                        help='write the findings to FILE as JSON')
+    parser.add_argument('--strict', action='store_true',
+                        help='exit non-zero on warnings as well as errors')
+    add_inventory_arguments(parser)
+    args = parser.parse_args()
+    if not (args.creation or args.ingress or args.egress):
+        parser.error('give at least one of --creation, --ingress and --egress')
+    return args
+
+def main():
+    if not os.path.exists(LOG_FILE):
+        log_file = open(LOG_FILE, 'w+')
+        log_file.close()
+    logging.basicConfig(
+        format='%(levelname)s: %(asctime)s %(message)s',
+        datefmt='%d/%m/%Y %I:%M:%S %p',
+        filename=LOG_FILE,
+        level=logging.INFO
+    )
+    args = process_args()
+    inventory = None
+    if args.env_name:
+        inventory = load_inventory(args, args.awsprofile, args.region, args.env_name)
+    report = lint_sheets(args.creation, args.ingress, args.egress, inventory=inventory,
+                         env_name=args.env_name or '', region=args.region)
+    lines = report.describe()
+    for line in lines:
+        logging.warning(line)
+    if lines:
+        print('\n'.join(lines))
+    print(report.summary())
+    if args.report:
+        report.write(args.report)
+    if report.failed(args.strict):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+'''
+Version 0.1
+Answers questions about the ingress and egress sheets without going to
+AWS, e.g.
+  query_security_groups.py --ingress in.csv --egress out.csv reach AppD_RHEL_Instances "Active Directory" 389/tcp
+  query_security_groups.py --ingress in.csv exposed 0.0.0.0/0 --port 22
+  query_security_groups.py --ingress in.csv --egress out.csv exposure --format csv --output exposure.csv
+With no command, queries are read one per line from stdin so the sheets
+are only indexed once.
+'''
+
+import argparse
+import logging
+import os
+import shlex
+import sys
+
+from sgautomation.exposure import DEFAULT_BROAD_PREFIX, FORMATS, JSON_FORMAT, analyse_exposure
+from sgautomation.query import EGRESS, INGRESS, RuleIndex
+from sgautomation.rules import (
+    EgressRule, IngressRule, RowValidationError, RuleSheetReader, parse_ports
+)
+
+LOG_FILE = '/tmp/querysecuritygroups.log'
+
+def parse_port_spec(spec, protocol='tcp'):
+    '''
+    Parses 389, 389/tcp or 1000-2000/udp into (from_port, to_port, protocol)
+    '''
+    ports, _, spec_protocol = spec.partition('/')
+    protocol = spec_protocol or protocol
+    from_port, to_port = parse_ports(ports, '', protocol.lower())
+    return from_port, to_port, protocol
+
+def query_parser():
+    '''
+    Commands:
+    1. reach SOURCE DESTINATION PORT - can SOURCE (a group or an IP
+                                       address) reach DESTINATION on PORT
+    2. exposed CIDR                  - rules open to CIDR, optionally on --port
+    3. rules GROUP                   - the rules on GROUP, optionally on --port
+    4. exposure                      - overlapping and shadowed CIDR rules,
+                                       rules open to public or broad ranges
+                                       and the ports each group is open on
+    '''
+    parser = argparse.ArgumentParser(
+        description='Query the security group rule sheets'
+    )
+    parser.add_argument('--ingress', help='the ingress rules csv')
+    parser.add_argument('--egress', help='the egress rules csv')
+    commands = parser.add_subparsers(dest='command')
+    reach = commands.add_parser('reach', help='can SOURCE reach DESTINATION on PORT')
+    reach.add_argument('source')
+    reach.add_argument('destination')
+    reach.add_argument('port', help='e.g. 389, 389/tcp or 1000-2000/udp')
+    exposed = commands.add_parser('exposed', help='rules open to a CIDR')
+    exposed.add_argument('cidr')
+    exposed.add_argument('--port', help='e.g. 22, 22/tcp or 1000-2000/udp')
+    exposed.add_argument('--direction', choices=(INGRESS, EGRESS), default=INGRESS)
+    exposed.add_argument('--within', action='store_true',
+                         help='rules open to networks inside CIDR rather '
+                              'than containing it')
+    rules = commands.add_parser('rules', help='rules on a group')
+    rules.add_argument('group')
+    rules.add_argument('--port', help='e.g. 443, 443/tcp or 0/icmp')
+    rules.add_argument('--direction', choices=(INGRESS, EGRESS), default=INGRESS)
+    exposure = commands.add_parser('exposure', help='overlapping, shadowed and '
+                                                    'exposed CIDR rules')
+    exposure.add_argument('--format', choices=FORMATS, default=JSON_FORMAT,
+                          dest='output_format')
+    exposure.add_argument('--output', metavar='FILE',
+                          help='write the report to FILE instead of printing it')
+    exposure.add_argument('--broad-prefix', type=int, default=DEFAULT_BROAD_PREFIX,
+                          help='also report internal IPv4 ranges this wide or '
+                               'wider (default: /%(default)s)')
+    return parser
+
+def format_rule(rule):
+    return '{:>5} {} {} {}-{} {} {} ({})'.format(
+        rule.rule_id, rule.group, rule.protocol, rule.from_port,
+        rule.to_port, rule.peer_type, rule.peer, rule.description
+    )
+
+def run_query(index, args):
+    '''
+    Runs one parsed command against the index and returns the lines to print
+    '''
+    if args.command == 'reach':
+        from_port, to_port, protocol = parse_port_spec(args.port)
+        result = index.can_reach(args.source, args.destination, from_port, protocol, to_port)
+        lines = ['{} {} reach {} on {}'.format(
+            args.source, 'can' if result.allowed else 'cannot',
+            args.destination, args.port
+        )]
+        lines.extend('  ingress ' + format_rule(rule) for rule in result.ingress)
+        lines.extend('  egress  ' + format_rule(rule) for rule in result.egress)
+        return lines
+    if args.command == 'exposure':
+        report = analyse_exposure(index.records[INGRESS], index.records[EGRESS],
+                                  args.broad_prefix)
+        if args.output:
+            report.write(args.output, args.output_format)
+            return [report.summary()]
+        return [report.dumps(args.output_format).rstrip('\n')]
+    port, to_port, protocol = None, None, 'tcp'
+    if args.port:
+        port, to_port, protocol = parse_port_spec(args.port)
+    if args.command == 'exposed':
+        found = index.exposed(args.cidr, port, protocol, args.direction, args.within, to_port)
+    else:
+        found = index.rules(args.group, port, protocol, args.direction, to_port)
+    return [format_rule(rule) for rule in found] or ['No matching rules']
+
+def main():
+    if not os.path.exists(LOG_FILE):
+        log_file = open(LOG_FILE, 'w+')
+        log_file.close()
+    logging.basicConfig(
+        format='%(levelname)s: %(asctime)s %(message)s',
+        datefmt='%d/%m/%Y %I:%M:%S %p',
+        filename=LOG_FILE,
+        level=logging.INFO
+    )
+    parser = query_parser()
+    args = parser.parse_args()
+    if not args.ingress and not args.egress:
+        parser.error('give at least one of --ingress and --egress')
+    index = RuleIndex(
+        RuleSheetReader(args.ingress, IngressRule) if args.ingress else (),
+        RuleSheetReader(args.egress, EgressRule) if args.egress else (),
+    )
+    if args.command:
+        print('\n'.join(run_query(index, args)))
+        return
+    interactive = sys.stdin.isatty()
+    while True:
+        if interactive:
+            sys.stdout.write('> ')
+            sys.stdout.flush()
+        line = sys.stdin.readline()
+        if not line:
+            break
+        if not line.strip():
+            continue
+        try:
+            query = parser.parse_args(shlex.split(line))
+            if query.command is None:
+                continue
+            print('\n'.join(run_query(index, query)))
+        except SystemExit:
+            continue
+        except (RowValidationError, ValueError) as error:
+            print('Invalid query: {}'.format(error))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,3 @@
+'''
+Shared components used by the security group generator scripts
+'''
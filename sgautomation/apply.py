@@ -0,0 +1,330 @@
+'''
+Applies generated rules directly through the EC2 API, bypassing
+CloudFormation, for changes that cannot wait for a stack update
+'''
+
+import logging
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from sgautomation.drift import (
+    EGRESS, INGRESS, PEER_CIDR, PEER_CIDR_V6, PEER_GROUP, PEER_PREFIX_LIST,
+    desired_permissions, live_permissions
+)
+from sgautomation.inventory import SECURITY_GROUPS_KEY, describe_all
+
+DEFAULT_APPLY_WORKERS = 4
+MAX_PEERS_PER_CALL = 100
+MAX_GROUPS_PER_DESCRIBE = 200
+THROTTLE_CODES = ('RequestLimitExceeded', 'Throttling', 'ThrottlingException')
+ALREADY_APPLIED_CODES = {
+    'authorize': 'InvalidPermission.Duplicate',
+    'revoke': 'InvalidPermission.NotFound',
+}
+OPERATIONS = {
+    ('authorize', INGRESS): 'authorize_security_group_ingress',
+    ('authorize', EGRESS): 'authorize_security_group_egress',
+    ('revoke', INGRESS): 'revoke_security_group_ingress',
+    ('revoke', EGRESS): 'revoke_security_group_egress',
+}
+PEER_LISTS = {
+    PEER_GROUP: ('UserIdGroupPairs', 'GroupId'),
+    PEER_CIDR: ('IpRanges', 'CidrIp'),
+    PEER_CIDR_V6: ('Ipv6Ranges', 'CidrIpv6'),
+    PEER_PREFIX_LIST: ('PrefixListIds', 'PrefixListId'),
+}
+PEER_LIST_NAMES = tuple(list_name for list_name, _ in PEER_LISTS.values())
+
+ApiCall = namedtuple('ApiCall', ('action', 'group_id', 'direction', 'permissions', 'peers'))
+
+
+def ip_permissions(keys, descriptions=None):
+    '''
+    Returns the IpPermissions list for a set of PermissionKeys on one
+    group, with the peers of rules sharing a protocol and port range
+    combined into a single permission
+    '''
+    descriptions = descriptions or {}
+    permissions = {}
+    for key in sorted(keys):
+        permission = permissions.get((key.protocol, key.from_port, key.to_port))
+        if permission is None:
+            permission = {'IpProtocol': key.protocol}
+            if key.protocol != '-1':
+                permission['FromPort'] = key.from_port
+                permission['ToPort'] = key.to_port
+            permissions[(key.protocol, key.from_port, key.to_port)] = permission
+        list_name, peer_name = PEER_LISTS[key.peer_kind]
+        peer = {peer_name: key.peer}
+        if descriptions.get(key):
+            peer['Description'] = descriptions[key]
+        permission.setdefault(list_name, []).append(peer)
+    return list(permissions.values())
+
+
+def batch_calls(action, group_id, direction, keys, descriptions=None,
+                max_peers=MAX_PEERS_PER_CALL):
+    '''
+    Splits the keys for one group into API calls of at most max_peers
+    rules each
+    '''
+    keys = sorted(keys)
+    return [
+        ApiCall(action, group_id, direction,
+                ip_permissions(keys[start:start + max_peers], descriptions),
+                len(keys[start:start + max_peers]))
+        for start in range(0, len(keys), max_peers)
+    ]
+
+
+def error_code(error):
+    return error.response.get('Error', {}).get('Code')
+
+
+class AdaptiveBackoff(object):
+    '''
+    A delay shared by all workers that doubles each time EC2 throttles
+    a call and halves after each success, so the pool settles at the
+    rate the account's API limits allow
+    '''
+    def __init__(self, base_delay=0.5, max_delay=20.0, max_attempts=8, sleep=time.sleep):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.sleep = sleep
+        self.delay = 0.0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def on_throttle(self):
+        with self.lock:
+            self.throttled += 1
+            self.delay = min(self.max_delay, max(self.base_delay, self.delay * 2))
+
+    def on_success(self):
+        with self.lock:
+            self.delay = self.delay / 2 if self.delay >= self.base_delay / 2 else 0.0
+
+    def call(self, function, **kwargs):
+        for attempt in range(self.max_attempts):
+            delay = self.delay
+            if delay:
+                self.sleep(random.uniform(delay / 2, delay))
+            try:
+                response = function(**kwargs)
+            except ClientError as error:
+                if error_code(error) not in THROTTLE_CODES or attempt == self.max_attempts - 1:
+                    raise
+                logging.warning('Throttled, backing off: {}'.format(error))
+                self.on_throttle()
+                continue
+            self.on_success()
+            return response
+
+
+class ApplyPlan(object):
+    '''
+    The authorize and revoke calls needed to bring live groups in line
+    with the generated rules
+    '''
+    def __init__(self, calls=(), skipped=0):
+        self.calls = list(calls)
+        self.skipped = skipped
+
+    def count(self, action):
+        return sum(call.peers for call in self.calls if call.action == action)
+
+    def summary(self):
+        return '{} rules to authorize, {} to revoke in {} API calls across {} groups{}'.format(
+            self.count('authorize'), self.count('revoke'), len(self.calls),
+            len(set(call.group_id for call in self.calls)),
+            ' ({} rules on groups not yet deployed left out)'.format(self.skipped)
+            if self.skipped else ''
+        )
+
+    def describe(self):
+        '''
+        Returns one line per API call, for dry runs
+        '''
+        return [
+            '{} {} {} rules'.format(
+                OPERATIONS[(call.action, call.direction)], call.group_id, call.peers
+            )
+            for call in self.calls
+        ]
+
+
+class ApplyResult(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.authorized = 0
+        self.revoked = 0
+        self.failures = []
+        self.lock = threading.Lock()
+
+    def record(self, call, calls=1):
+        with self.lock:
+            self.calls += calls
+            if call.action == 'authorize':
+                self.authorized += call.peers
+            else:
+                self.revoked += call.peers
+
+    def fail(self, call, error):
+        with self.lock:
+            self.failures.append((call, error))
+
+    def summary(self):
+        return '{} rules authorized, {} revoked in {} API calls, {} calls failed'.format(
+            self.authorized, self.revoked, self.calls, len(self.failures)
+        )
+
+
+class ApplyEngine(object):
+    '''
+    Computes the difference between CompiledRules and the current state
+    of the groups they belong to and applies it with batched
+    authorize/revoke calls. Groups are worked on in parallel by a
+    bounded thread pool; the calls for one group run in order, new
+    rules being authorized before stale ones are revoked. Stale rules
+    are only revoked when prune is set.
+    '''
+    def __init__(self, client, workers=DEFAULT_APPLY_WORKERS, prune=False,
+                 backoff=None, max_peers=MAX_PEERS_PER_CALL):
+        self.client = client
+        self.workers = workers
+        self.prune = prune
+        self.backoff = backoff or AdaptiveBackoff()
+        self.max_peers = max_peers
+
+    def live_groups(self, group_ids):
+        '''
+        Reads the current permissions of the groups rather than relying
+        on a cached inventory
+        '''
+        group_ids = sorted(group_ids)
+        groups = []
+        for start in range(0, len(group_ids), MAX_GROUPS_PER_DESCRIBE):
+            groups.extend(describe_all(
+                self.client, 'describe_security_groups', SECURITY_GROUPS_KEY,
+                Filters=[{
+                    'Name': 'group-id',
+                    'Values': group_ids[start:start + MAX_GROUPS_PER_DESCRIBE],
+                }]
+            ))
+        return groups
+
+    def plan(self, compiled_rules, direction, security_groups=None):
+        '''
+        Returns the ApplyPlan for the rules of one direction. The live
+        state is read from EC2 unless security_groups is given.
+        '''
+        desired, skipped = desired_permissions(compiled_rules)
+        group_ids = set(key.group_id for key in desired)
+        if security_groups is None:
+            security_groups = self.live_groups(group_ids)
+        live = live_permissions(security_groups, group_ids, direction)
+        descriptions = {
+            key: result.resource['Properties'].get('Description')
+            for key, result in desired.items()
+        }
+        authorize = {}
+        for key in set(desired).difference(live):
+            authorize.setdefault(key.group_id, []).append(key)
+        revoke = {}
+        if self.prune:
+            for key in live.difference(desired):
+                revoke.setdefault(key.group_id, []).append(key)
+        calls = []
+        for group_id in sorted(set(authorize).union(revoke)):
+            calls.extend(batch_calls('authorize', group_id, direction,
+                                     authorize.get(group_id, []), descriptions,
+                                     self.max_peers))
+            calls.extend(batch_calls('revoke', group_id, direction,
+                                     revoke.get(group_id, []),
+                                     max_peers=self.max_peers))
+        return ApplyPlan(calls, skipped)
+
+    def apply(self, plan):
+        '''
+        Makes the calls in an ApplyPlan and returns an ApplyResult
+        '''
+        result = ApplyResult()
+        by_group = {}
+        for call in plan.calls:
+            by_group.setdefault(call.group_id, []).append(call)
+        if self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(lambda calls: self.apply_group(calls, result),
+                                  by_group.values()))
+        else:
+            for calls in by_group.values():
+                self.apply_group(calls, result)
+        logging.info('Apply: {}'.format(result.summary()))
+        return result
+
+    def apply_group(self, calls, result):
+        for call in calls:
+            try:
+                self.make_call(call, result)
+            except ClientError as error:
+                self.fail(call, error, result)
+
+    def fail(self, call, error, result):
+        logging.error('{} on {} failed: {}'.format(
+            OPERATIONS[(call.action, call.direction)], call.group_id, error
+        ))
+        result.fail(call, error)
+
+    def make_call(self, call, result):
+        operation = getattr(self.client, OPERATIONS[(call.action, call.direction)])
+        if call.peers == 1:
+            self.make_single_call(operation, call, result)
+            return
+        try:
+            self.backoff.call(operation, GroupId=call.group_id,
+                              IpPermissions=call.permissions)
+        except ClientError as error:
+            if error_code(error) != ALREADY_APPLIED_CODES[call.action]:
+                raise
+            # One rule in the batch already exists (or is already gone),
+            # which fails the whole call; retry the rules one at a time
+            result.record(call._replace(peers=0))
+            for single in self.split(call):
+                self.make_single_call(operation, single, result)
+            return
+        result.record(call)
+
+    def make_single_call(self, operation, call, result):
+        '''
+        Makes a call for one rule. A rule already applied counts as done;
+        any other error fails just this rule, so the rest of the group's
+        calls still go ahead.
+        '''
+        try:
+            self.backoff.call(operation, GroupId=call.group_id,
+                              IpPermissions=call.permissions)
+        except ClientError as error:
+            if error_code(error) != ALREADY_APPLIED_CODES[call.action]:
+                self.fail(call, error, result)
+                return
+            result.record(call._replace(peers=0))
+            return
+        result.record(call)
+
+    def split(self, call):
+        for permission in call.permissions:
+            for list_name in PEER_LIST_NAMES:
+                for peer in permission.get(list_name, []):
+                    single = {
+                        name: value for name, value in permission.items()
+                        if name not in PEER_LIST_NAMES
+                    }
+                    single[list_name] = [peer]
+                    yield call._replace(permissions=[single], peers=1)
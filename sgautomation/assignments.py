@@ -0,0 +1,300 @@
+'''
+Attaches security groups to instances by their instance_role tag
+'''
+
+import json
+import logging
+import threading
+
+from botocore.exceptions import ClientError
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from sgautomation.apply import DEFAULT_APPLY_WORKERS, AdaptiveBackoff
+from sgautomation.inventory import LIVE_INSTANCE_STATES, describe_instances, tag_dict
+
+INSTANCE_ROLE_TAG = 'instance_role'
+# the default VPC quota; accounts can raise it to 16
+MAX_GROUPS_PER_INTERFACE = 5
+MAX_FILTER_VALUES = 200
+PRIMARY_DEVICE_INDEX = 0
+
+Assignment = namedtuple('Assignment', (
+    'instance_id', 'interface_id', 'role', 'current', 'desired', 'mappings',
+))
+SkippedMapping = namedtuple('SkippedMapping', ('mapping', 'instance_id', 'reason', 'message'))
+
+
+def role_key(role):
+    return role.strip().lower()
+
+
+def role_index(instances, tag=INSTANCE_ROLE_TAG):
+    '''
+    Returns a dict of role to the instances carrying it, built in one
+    pass over the instances
+    '''
+    index = {}
+    for instance in instances:
+        role = tag_dict(instance).get(tag)
+        if role:
+            index.setdefault(role_key(role), []).append(instance)
+    return index
+
+
+def primary_interface(instance):
+    '''
+    Returns the instance's primary network interface, or None
+    '''
+    for interface in instance.get('NetworkInterfaces', []):
+        if interface.get('Attachment', {}).get('DeviceIndex') == PRIMARY_DEVICE_INDEX:
+            return interface
+    return None
+
+
+def instance_groups(instance):
+    '''
+    Returns the ids of the groups on an instance's primary interface
+    '''
+    interface = primary_interface(instance)
+    groups = interface.get('Groups', []) if interface else instance.get('SecurityGroups', [])
+    return [group['GroupId'] for group in groups]
+
+
+class AssignmentPlan(object):
+    '''
+    The group changes needed to bring instances in line with the role
+    mapping sheet, one Assignment per instance that needs a change
+    '''
+    def __init__(self, assignments=(), skipped=(), unchanged=0):
+        self.assignments = list(assignments)
+        self.skipped = list(skipped)
+        self.unchanged = unchanged
+
+    def summary(self):
+        reasons = {}
+        for skipped in self.skipped:
+            reasons[skipped.reason] = reasons.get(skipped.reason, 0) + 1
+        return '{} instances to update, {} already correct{}'.format(
+            len(self.assignments), self.unchanged,
+            ''.join(', {} skipped ({})'.format(count, reason)
+                    for reason, count in sorted(reasons.items()))
+        )
+
+    def describe(self):
+        '''
+        Returns one line per API call, for dry runs
+        '''
+        return [
+            '{} {} {} -> {}'.format(
+                'modify_network_interface_attribute' if assignment.interface_id
+                else 'modify_instance_attribute',
+                assignment.interface_id or assignment.instance_id,
+                ','.join(assignment.current), ','.join(assignment.desired)
+            )
+            for assignment in self.assignments
+        ]
+
+    def to_dict(self):
+        return {
+            'summary': self.summary(),
+            'assignments': [
+                dict(assignment._asdict(),
+                     added=sorted(set(assignment.desired) - set(assignment.current)),
+                     removed=sorted(set(assignment.current) - set(assignment.desired)))
+                for assignment in self.assignments
+            ],
+            'skipped': [
+                {
+                    'mapping_id': skipped.mapping.mapping_id if skipped.mapping else None,
+                    'instance_id': skipped.instance_id,
+                    'reason': skipped.reason,
+                    'message': skipped.message,
+                }
+                for skipped in self.skipped
+            ],
+        }
+
+    def write(self, path):
+        with open(path, 'w') as plan_file:
+            json.dump(self.to_dict(), plan_file, indent=1, sort_keys=True)
+
+
+class AssignmentResult(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.updated = 0
+        self.failures = []
+        self.lock = threading.Lock()
+
+    def record(self, assignment):
+        with self.lock:
+            self.calls += 1
+            self.updated += 1
+
+    def fail(self, assignment, error):
+        with self.lock:
+            self.calls += 1
+            self.failures.append((assignment, error))
+
+    def summary(self):
+        return '{} instances updated in {} API calls, {} calls failed'.format(
+            self.updated, self.calls, len(self.failures)
+        )
+
+
+class AssignmentEngine(object):
+    '''
+    Joins RoleMapping rows against instances through a role index and
+    works out the groups each instance should have. Mapped groups are
+    added to the groups an instance already has; with prune the groups
+    that are not mapped to its role are removed.
+
+    resolve turns a sheet group name into a group id, the same way the
+    rule generators do, and group_vpcs maps group ids to their VPC so
+    groups from another VPC are not attached. Instances with a single
+    interface are changed with modify_instance_attribute and others on
+    their primary interface with modify_network_interface_attribute.
+    Instances are updated in parallel by a bounded thread pool sharing
+    one AdaptiveBackoff.
+    '''
+    def __init__(self, client, resolve, group_vpcs, workers=DEFAULT_APPLY_WORKERS,
+                 prune=False, backoff=None, max_groups=MAX_GROUPS_PER_INTERFACE,
+                 tag=INSTANCE_ROLE_TAG):
+        self.client = client
+        self.resolve = resolve
+        self.group_vpcs = group_vpcs
+        self.workers = workers
+        self.prune = prune
+        self.backoff = backoff or AdaptiveBackoff()
+        self.max_groups = max_groups
+        self.tag = tag
+
+    def live_instances(self, roles, vpc_ids):
+        '''
+        Reads the current groups of the instances with the given roles,
+        filtered on the server by tag, VPC and state
+        '''
+        roles = sorted(roles)
+        filters = [{'Name': 'instance-state-name', 'Values': list(LIVE_INSTANCE_STATES)}]
+        if vpc_ids:
+            filters.append({'Name': 'vpc-id', 'Values': list(vpc_ids)})
+        instances = []
+        for start in range(0, len(roles), MAX_FILTER_VALUES):
+            instances.extend(describe_instances(self.client, Filters=filters + [
+                {'Name': 'tag:' + self.tag, 'Values': roles[start:start + MAX_FILTER_VALUES]},
+            ]))
+        return instances
+
+    def plan(self, mappings, instances=None, vpc_ids=()):
+        '''
+        Returns the AssignmentPlan for the mapping rows. The instances
+        are read from EC2 unless given.
+        '''
+        by_role = {}
+        for mapping in mappings:
+            by_role.setdefault(role_key(mapping.role), []).append(mapping)
+        if instances is None:
+            instances = self.live_instances(
+                set(mapping.role for rows in by_role.values() for mapping in rows), vpc_ids
+            )
+        index = role_index(instances, self.tag)
+        skipped = []
+        group_ids = {}
+        for role, rows in sorted(by_role.items()):
+            if role not in index:
+                skipped.extend(
+                    SkippedMapping(mapping, None, 'no_instances',
+                                   'No instances tagged {}={}'.format(self.tag, mapping.role))
+                    for mapping in rows
+                )
+                continue
+            for mapping in rows:
+                group_id = self.resolve(mapping.group)
+                if group_id is None or isinstance(group_id, dict):
+                    skipped.append(SkippedMapping(
+                        mapping, None, 'group_not_found',
+                        'Unable to find group {}'.format(mapping.group)
+                    ))
+                    continue
+                group_ids.setdefault(role, []).append((mapping, group_id))
+        assignments = []
+        unchanged = 0
+        for role, mapped in sorted(group_ids.items()):
+            for instance in index[role]:
+                assignment = self.assign(instance, role, mapped, skipped)
+                if assignment is None:
+                    continue
+                if assignment.desired == assignment.current:
+                    unchanged += 1
+                else:
+                    assignments.append(assignment)
+        return AssignmentPlan(assignments, skipped, unchanged)
+
+    def assign(self, instance, role, mapped, skipped):
+        instance_id = instance['InstanceId']
+        vpc_id = instance.get('VpcId')
+        current = sorted(instance_groups(instance))
+        wanted = set()
+        mapping_ids = []
+        for mapping, group_id in mapped:
+            if self.group_vpcs.get(group_id) != vpc_id:
+                skipped.append(SkippedMapping(
+                    mapping, instance_id, 'vpc_mismatch',
+                    'Group {} is not in {}'.format(mapping.group, vpc_id)
+                ))
+                continue
+            wanted.add(group_id)
+            mapping_ids.append(mapping.mapping_id)
+        if not wanted:
+            return None
+        desired = sorted(wanted if self.prune else wanted.union(current))
+        if len(desired) > self.max_groups:
+            skipped.append(SkippedMapping(
+                None, instance_id, 'too_many_groups',
+                '{} would have {} groups, the limit is {}'.format(
+                    instance_id, len(desired), self.max_groups
+                )
+            ))
+            return None
+        interfaces = instance.get('NetworkInterfaces', [])
+        interface = primary_interface(instance) if len(interfaces) > 1 else None
+        return Assignment(
+            instance_id, interface['NetworkInterfaceId'] if interface else None,
+            role, current, desired, sorted(mapping_ids)
+        )
+
+    def apply(self, plan):
+        '''
+        Makes the calls in an AssignmentPlan and returns an
+        AssignmentResult
+        '''
+        result = AssignmentResult()
+        if self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(lambda assignment: self.make_call(assignment, result),
+                                  plan.assignments))
+        else:
+            for assignment in plan.assignments:
+                self.make_call(assignment, result)
+        logging.info('Assignments: {}'.format(result.summary()))
+        return result
+
+    def make_call(self, assignment, result):
+        try:
+            if assignment.interface_id:
+                self.backoff.call(self.client.modify_network_interface_attribute,
+                                  NetworkInterfaceId=assignment.interface_id,
+                                  Groups=assignment.desired)
+            else:
+                self.backoff.call(self.client.modify_instance_attribute,
+                                  InstanceId=assignment.instance_id,
+                                  Groups=assignment.desired)
+        except ClientError as error:
+            logging.error('Updating groups on {} failed: {}'.format(
+                assignment.instance_id, error
+            ))
+            result.fail(assignment, error)
+            return
+        result.record(assignment)
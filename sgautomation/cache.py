@@ -0,0 +1,149 @@
+'''
+On-disk cache of inventory snapshots
+'''
+
+import json
+import logging
+import os
+import re
+import time
+
+from sgautomation.inventory import (
+    AwsInventory, INSTANCES_KEY, NETWORK_INTERFACES_KEY, SECURITY_GROUPS_KEY, VPCS_KEY,
+    inventory_kinds
+)
+
+DEFAULT_CACHE_DIR = os.path.join('~', '.cache', 'aws-security-group-automation')
+DEFAULT_CACHE_TTL = 3600
+CACHE_FILE_NAME = 'inventory-{profile}-{region}-{env_name}.jsonl'
+CACHE_VERSION = 1
+BASE_KINDS = (VPCS_KEY, SECURITY_GROUPS_KEY, NETWORK_INTERFACES_KEY)
+CACHED_KINDS = BASE_KINDS + (INSTANCES_KEY,)
+
+
+class CacheMissError(Exception):
+    '''
+    Raised when an offline run finds no cached snapshot to work from
+    '''
+
+
+class InventoryCache(object):
+    '''
+    Stores inventory snapshots as JSON lines, one file per profile,
+    region and env_name. The first line is a header recording when the
+    snapshot was taken and what it holds; every other line is a single
+    VPC, security group, network interface or instance, so the file can
+    be streamed back in. Only the kinds the inventory was loaded with
+    are kept, and a snapshot is only used for a run needing no others.
+    '''
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_CACHE_TTL):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.ttl = ttl
+
+    def path(self, profile, region, env_name):
+        '''
+        Returns the cache file used for a profile, region and env_name
+        '''
+        parts = {
+            'profile': profile or 'default',
+            'region': region,
+            'env_name': env_name or 'all',
+        }
+        parts = {k: re.sub(r'[^a-zA-Z0-9_.-]', '_', v) for k, v in parts.items()}
+        return os.path.join(self.cache_dir, CACHE_FILE_NAME.format(**parts))
+
+    def load(self, profile, region, env_name, vpc_names=None, offline=False,
+             instances=False, security_groups=True, network_interfaces=True):
+        '''
+        Returns the cached inventory, or None if there is no snapshot, it
+        is older than the TTL or it lacks a kind of resource wanted.
+        Offline runs accept stale snapshots (with a warning) and raise
+        CacheMissError when there is none.
+        '''
+        path = self.path(profile, region, env_name)
+        if not os.path.exists(path):
+            if offline:
+                raise CacheMissError('No cached inventory at {}'.format(path))
+            return None
+        items = {kind: [] for kind in CACHED_KINDS}
+        with open(path) as cache_file:
+            header = json.loads(cache_file.readline() or '{}')
+            if header.get('version') != CACHE_VERSION:
+                if offline:
+                    raise CacheMissError('Unreadable cached inventory at {}'.format(path))
+                return None
+            kinds = header.get('kinds', BASE_KINDS)
+            missing = [
+                kind for kind in inventory_kinds(security_groups, network_interfaces, instances)
+                if kind not in kinds
+            ]
+            if missing:
+                if offline:
+                    raise CacheMissError('Cached inventory at {} has no {}'.format(
+                        path, ', '.join(missing)
+                    ))
+                logging.info('Cached inventory {} has no {}'.format(path, ', '.join(missing)))
+                return None
+            age = time.time() - header.get('created', 0)
+            if age > self.ttl:
+                if not offline:
+                    logging.info('Cached inventory {} expired ({:.0f}s old)'.format(path, age))
+                    return None
+                logging.warning('Using cached inventory {} which is {:.0f}s old'.format(path, age))
+            for line in cache_file:
+                record = json.loads(line)
+                items[record['kind']].append(record['item'])
+        logging.info('Loaded inventory from {}'.format(path))
+        return AwsInventory(
+            vpcs=items[VPCS_KEY],
+            security_groups=items[SECURITY_GROUPS_KEY],
+            network_interfaces=items[NETWORK_INTERFACES_KEY],
+            vpc_names=vpc_names,
+            instances=items[INSTANCES_KEY] if INSTANCES_KEY in kinds else None,
+            kinds=kinds,
+        )
+
+    def save(self, inventory, profile, region, env_name):
+        '''
+        Writes an inventory snapshot to the cache
+        '''
+        path = self.path(profile, region, env_name)
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        tmp_path = path + '.tmp'
+        items = {
+            VPCS_KEY: inventory.vpcs,
+            SECURITY_GROUPS_KEY: inventory.security_groups,
+            NETWORK_INTERFACES_KEY: inventory.network_interfaces,
+            INSTANCES_KEY: inventory.instances,
+        }
+        kinds = [
+            (kind, items[kind]) for kind in CACHED_KINDS
+            if kind in inventory.kinds and items[kind] is not None
+        ]
+        with open(tmp_path, 'w') as cache_file:
+            cache_file.write(self.dumps({
+                'version': CACHE_VERSION,
+                'created': time.time(),
+                'profile': profile,
+                'region': region,
+                'env_name': env_name,
+                'kinds': [kind for kind, _ in kinds],
+            }))
+            for kind, items in kinds:
+                for item in items:
+                    cache_file.write(self.dumps({'kind': kind, 'item': item}))
+        os.rename(tmp_path, path)
+        logging.info('Saved inventory to {}'.format(path))
+
+    def invalidate(self, profile, region, env_name):
+        '''
+        Removes the cached snapshot for a profile, region and env_name
+        '''
+        path = self.path(profile, region, env_name)
+        if os.path.exists(path):
+            os.remove(path)
+            logging.info('Removed cached inventory {}'.format(path))
+
+    def dumps(self, record):
+        return json.dumps(record, separators=(',', ':'), default=str) + '\n'
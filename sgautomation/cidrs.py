@@ -0,0 +1,53 @@
+'''
+IPv4 CIDR parsing shared by the drift, quota, lint and exposure checks
+'''
+
+import functools
+import ipaddress
+import re
+
+IPV4_BITS = 32
+NETWORK_MASKS = tuple(
+    (0xffffffff << (IPV4_BITS - prefix)) & 0xffffffff for prefix in range(IPV4_BITS + 1)
+)
+# almost every CIDR in a sheet is a plain IPv4 network, which is parsed
+# without building an ipaddress network, several times slower; anything
+# else goes to ipaddress
+OCTET = r'(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])'
+IPV4_CIDR = re.compile(r'(?:{0}\.){{3}}{0}/(?:3[0-2]|[12]?[0-9])'.format(OCTET))
+
+
+def parse_ipv4(cidr):
+    '''
+    Returns (address as an int, prefix length) for a plain IPv4 CIDR,
+    host bits and all, or None for anything else
+    '''
+    if not IPV4_CIDR.fullmatch(cidr):
+        return None
+    address, _, prefix = cidr.partition('/')
+    value = 0
+    for octet in address.split('.'):
+        value = value << 8 | int(octet)
+    return value, int(prefix)
+
+
+def format_ipv4(value, prefix):
+    return '{}.{}.{}.{}/{}'.format(
+        value >> 24, value >> 16 & 255, value >> 8 & 255, value & 255, prefix
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def canonical_cidr(cidr):
+    '''
+    Returns cidr with any host bits cleared, or unchanged when it is not
+    a CIDR at all
+    '''
+    network = parse_ipv4(cidr)
+    if network is not None:
+        value, prefix = network
+        return format_ipv4(value & NETWORK_MASKS[prefix], prefix)
+    try:
+        return str(ipaddress.ip_network(cidr, strict=False))
+    except ValueError:
+        return cidr
@@ -0,0 +1,259 @@
+'''
+Command line options shared by the generator scripts, and the run flow
+of the ingress and egress scripts
+'''
+
+import logging
+
+from sgautomation.apply import DEFAULT_APPLY_WORKERS
+from sgautomation.cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_TTL, InventoryCache
+from sgautomation.emitter import TEMPLATE_FORMATS, YAML_FORMAT
+from sgautomation.inventory import DEFAULT_REGION, AwsInventory, create_client, env_vpc_names
+from sgautomation.metrics import FORMATS, JSON_FORMAT, METRICS
+from sgautomation.quota import DEFAULT_RULE_QUOTA, QuotaExceededError
+
+
+def add_inventory_arguments(parser):
+    '''
+    Adds the options controlling where the EC2 inventory comes from
+    '''
+    group = parser.add_argument_group('inventory')
+    group.add_argument('--region', default=DEFAULT_REGION,
+                       help='AWS region to generate for (default: %(default)s)')
+    group.add_argument('--cache', action='store_true',
+                       help='reuse a cached inventory snapshot if one is fresh, '
+                            'and save one after querying AWS')
+    group.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                       help='directory holding cached snapshots (default: %(default)s)')
+    group.add_argument('--cache-ttl', type=int, default=DEFAULT_CACHE_TTL,
+                       help='seconds a cached snapshot stays fresh (default: %(default)s)')
+    source = group.add_mutually_exclusive_group()
+    source.add_argument('--refresh-cache', action='store_true',
+                        help='discard the cached snapshot and query AWS again')
+    source.add_argument('--offline', action='store_true',
+                        help='generate entirely from the cached snapshot without '
+                             'calling AWS')
+    return group
+
+
+def load_inventory(args, aws_profile, region, env_name, instances=False,
+                   security_groups=True, network_interfaces=True):
+    '''
+    Returns the inventory for a run, honouring the cache options.
+    Only the kinds of resource asked for are read besides the VPCs, and
+    instances only when asked for.
+    '''
+    with METRICS.phase('inventory_load'):
+        return read_inventory(args, aws_profile, region, env_name, instances,
+                              security_groups, network_interfaces)
+
+
+def read_inventory(args, aws_profile, region, env_name, instances=False,
+                   security_groups=True, network_interfaces=True):
+    vpc_names = env_vpc_names(env_name)
+    cache = None
+    if args.cache or args.offline or args.refresh_cache:
+        cache = InventoryCache(args.cache_dir, args.cache_ttl)
+    if cache is not None and args.refresh_cache:
+        cache.invalidate(aws_profile, region, env_name)
+    elif cache is not None:
+        inventory = cache.load(aws_profile, region, env_name, vpc_names=vpc_names,
+                               offline=args.offline, instances=instances,
+                               security_groups=security_groups,
+                               network_interfaces=network_interfaces)
+        if inventory is not None:
+            METRICS.count('inventory_cache_total', result='hit')
+            return inventory
+        METRICS.count('inventory_cache_total', result='miss')
+    client = create_client(aws_profile, region)
+    logging.info('Querying AWS inventory for {} in {}'.format(env_name, region))
+    inventory = AwsInventory.load(client, vpc_names=vpc_names, instances=instances,
+                                  security_groups=security_groups,
+                                  network_interfaces=network_interfaces)
+    if cache is not None:
+        cache.save(inventory, aws_profile, region, env_name)
+    return inventory
+
+
+def add_generation_arguments(parser):
+    '''
+    Adds the options controlling how rules are turned into templates
+    '''
+    group = parser.add_argument_group('generation')
+    group.add_argument('--workers', type=int, default=1,
+                       help='number of processes used to compile rules '
+                            '(default: %(default)s)')
+    group.add_argument('--optimise', action='store_true',
+                       help='drop duplicate rules and merge overlapping port '
+                            'ranges and CIDRs before writing templates')
+    group.add_argument('--pack', action='store_true',
+                       help='pack resources into as few numbered templates as '
+                            'the CloudFormation limits allow, keeping each '
+                            'resource in the template it used last time')
+    group.add_argument('--incremental', action='store_true',
+                       help='only rewrite templates whose content changed '
+                            'since the last run and print what changed')
+    add_format_argument(group)
+    return group
+
+
+def add_format_argument(parser):
+    parser.add_argument('--format', choices=TEMPLATE_FORMATS, default=YAML_FORMAT,
+                        dest='output_format',
+                        help='template format; json templates are written with '
+                             'a .json extension (default: %(default)s)')
+
+
+def add_report_arguments(parser):
+    '''
+    Adds the options that report on the rules instead of writing templates
+    '''
+    group = parser.add_argument_group('reports')
+    group.add_argument('--drift-report', metavar='FILE',
+                       help='compare the generated rules with the live '
+                            'security groups and write the differences to '
+                            'FILE as JSON instead of writing templates')
+    return group
+
+
+def add_quota_arguments(parser):
+    '''
+    Adds the options for checking generated rules against the rules per
+    security group quota before templates are written
+    '''
+    group = parser.add_argument_group('quotas')
+    group.add_argument('--max-ingress-rules', type=int, default=DEFAULT_RULE_QUOTA,
+                       help='inbound rules allowed per group (default: %(default)s)')
+    group.add_argument('--max-egress-rules', type=int, default=DEFAULT_RULE_QUOTA,
+                       help='outbound rules allowed per group (default: %(default)s)')
+    group.add_argument('--quota-report', metavar='FILE',
+                       help='write the groups over quota, and how to bring '
+                            'them within it, to FILE as JSON')
+    group.add_argument('--strict-quotas', action='store_true',
+                       help='stop without writing templates or applying rules '
+                            'when a group is over quota')
+    return group
+
+
+def report_quotas(report, path=None, strict=False):
+    '''
+    Prints the groups over quota and writes the report to path. Raises
+    QuotaExceededError when strict and any group is over.
+    '''
+    if report.violations:
+        print(report.summary())
+        print('\n'.join(report.describe()))
+        for line in report.describe():
+            logging.warning('Over quota: {}'.format(line))
+    if path:
+        report.write(path)
+    if strict and report.violations:
+        raise QuotaExceededError(report.summary())
+
+
+def add_apply_arguments(parser):
+    '''
+    Adds the options for applying rules through the EC2 API instead of
+    writing templates
+    '''
+    group = parser.add_argument_group('apply')
+    group.add_argument('--apply', action='store_true',
+                       help='authorize missing rules directly on the live '
+                            'groups instead of writing templates')
+    group.add_argument('--dry-run', action='store_true',
+                       help='with --apply, print the calls that would be made '
+                            'without making them')
+    group.add_argument('--prune', action='store_true',
+                       help='with --apply, also revoke live rules that were '
+                            'not generated')
+    group.add_argument('--apply-workers', type=int, default=DEFAULT_APPLY_WORKERS,
+                       help='number of groups updated at once (default: %(default)s)')
+    return group
+
+
+def check_apply_arguments(parser, args):
+    '''
+    Rejects apply options that cannot work together
+    '''
+    if (args.dry_run or args.prune) and not args.apply:
+        parser.error('--dry-run and --prune only apply with --apply')
+    if args.apply and args.offline and not args.dry_run:
+        parser.error('--apply needs AWS access; use --dry-run with --offline')
+    return args
+
+
+def apply_client(args, inventory, aws_profile, region):
+    '''
+    Returns the EC2 client used to read live groups and apply rules, or
+    None when working offline
+    '''
+    if args.offline:
+        return None
+    return inventory.client or create_client(aws_profile, region)
+
+
+def add_metrics_arguments(parser):
+    '''
+    Adds the options for writing a run report
+    '''
+    group = parser.add_argument_group('metrics')
+    group.add_argument('--metrics', metavar='FILE',
+                       help='write phase timings, AWS call counts and row '
+                            'counts for the run to FILE')
+    group.add_argument('--metrics-format', choices=FORMATS, default=JSON_FORMAT,
+                       help='format of the --metrics file (default: %(default)s)')
+    return group
+
+
+def start_metrics(args):
+    if args.metrics:
+        METRICS.enable()
+
+
+def finish_metrics(args):
+    if args.metrics:
+        METRICS.write(args.metrics, args.metrics_format)
+
+
+def run_rule_generator(args, sg_generator, max_rules):
+    '''
+    Builds an ingress or egress generator's rules and checks them against
+    max_rules, then writes a drift report, applies the rules or writes
+    their templates as the options ask. Raises QuotaExceededError when
+    --strict-quotas is set and a group is over quota.
+    '''
+    sg_generator.generate_security_group_structure(workers=args.workers,
+                                                   optimise=args.optimise)
+    if sg_generator.optimisation_report:
+        print('{} rules optimised: {}'.format(
+            sg_generator.generator_name.title(), sg_generator.optimisation_report.summary()
+        ))
+    skipped = sg_generator.skipped_report()
+    if skipped:
+        print('\n'.join(skipped))
+    logging.info("Finished generating SG structure")
+    if args.drift_report:
+        report = sg_generator.drift_report()
+        report.write(args.drift_report)
+        print(report.summary())
+        return
+    report_quotas(sg_generator.quota_report(max_rules), args.quota_report,
+                  args.strict_quotas)
+    if args.apply:
+        client = apply_client(args, sg_generator.inventory, args.awsprofile, args.region)
+        plan, result = sg_generator.apply_rules(
+            client, dry_run=args.dry_run, prune=args.prune,
+            workers=args.apply_workers
+        )
+        print(plan.summary())
+        if result is None:
+            print('\n'.join(plan.describe()))
+        else:
+            print(result.summary())
+        return
+    if args.pack:
+        sg_generator.pack_templates(args.template_path)
+    sg_generator.write_to_file(template_path=args.template_path,
+                               incremental=args.incremental)
+    if sg_generator.changeset:
+        print(sg_generator.changeset.summary())
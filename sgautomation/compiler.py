@@ -0,0 +1,58 @@
+'''
+Serial and multiprocess translation of rule records into resources
+'''
+
+import itertools
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_CHUNK_SIZE = 500
+
+CompiledRule = namedtuple('CompiledRule', ('rule', 'key', 'resource_name', 'resource'))
+SkippedRule = namedtuple('SkippedRule', ('rule', 'reason', 'message'))
+
+_worker_compiler = None
+
+
+def _init_worker(compiler):
+    global _worker_compiler
+    _worker_compiler = compiler
+
+
+def _compile_chunk(rules):
+    return [_worker_compiler(rule) for rule in rules]
+
+
+def chunked(iterable, size):
+    '''
+    Yields lists of up to size items from iterable
+    '''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def compile_rules(compiler, rules, workers=1, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Applies compiler, a callable returning a CompiledRule or SkippedRule,
+    to every rule and yields the results in input order.
+
+    With more than one worker the rules are sent in chunks to a process
+    pool. compiler is pickled once per worker, so it must only hold
+    read-only lookup state (the generators drop their AWS client and raw
+    inventory when pickled). Results come back in submission order,
+    which keeps the output identical to a serial run.
+    '''
+    if workers <= 1:
+        for rule in rules:
+            yield compiler(rule)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(compiler,)) as executor:
+        for results in executor.map(_compile_chunk, chunked(rules, chunk_size)):
+            for result in results:
+                yield result
@@ -0,0 +1,235 @@
+'''
+Compares generated rules with the permissions live on EC2 security groups
+'''
+
+import json
+
+from collections import namedtuple
+
+from sgautomation.cidrs import canonical_cidr
+from sgautomation.rules import normalise_protocol
+
+INGRESS = 'ingress'
+EGRESS = 'egress'
+PERMISSIONS_KEY = {
+    INGRESS: 'IpPermissions',
+    EGRESS: 'IpPermissionsEgress',
+}
+RESOURCE_DIRECTION = {
+    'AWS::EC2::SecurityGroupIngress': INGRESS,
+    'AWS::EC2::SecurityGroupEgress': EGRESS,
+}
+PEER_GROUP = 'group'
+PEER_CIDR = 'cidr'
+PEER_CIDR_V6 = 'cidr6'
+PEER_PREFIX_LIST = 'prefix_list'
+RESOURCE_PEERS = (
+    ('SourceSecurityGroupId', PEER_GROUP),
+    ('DestinationSecurityGroupId', PEER_GROUP),
+    ('CidrIp', PEER_CIDR),
+    ('CidrIpv6', PEER_CIDR_V6),
+    ('SourcePrefixListId', PEER_PREFIX_LIST),
+    ('DestinationPrefixListId', PEER_PREFIX_LIST),
+)
+LIVE_PEERS = (
+    ('UserIdGroupPairs', 'GroupId', PEER_GROUP),
+    ('IpRanges', 'CidrIp', PEER_CIDR),
+    ('Ipv6Ranges', 'CidrIpv6', PEER_CIDR_V6),
+    ('PrefixListIds', 'PrefixListId', PEER_PREFIX_LIST),
+)
+PORT_PROTOCOLS = ('tcp', 'udp')
+
+PermissionKey = namedtuple('PermissionKey', (
+    'group_id', 'direction', 'protocol', 'from_port', 'to_port',
+    'peer_kind', 'peer',
+))
+
+
+def canonical_ports(protocol, from_port, to_port):
+    '''
+    Returns the port range EC2 reports for a rule: nothing for protocol
+    -1 and the full range for tcp/udp rules written as all ports
+    '''
+    if protocol == '-1':
+        return -1, -1
+    if from_port is None or from_port == -1:
+        if protocol in PORT_PROTOCOLS:
+            return 0, 65535
+        return -1, -1
+    if to_port is None:
+        to_port = from_port
+    return from_port, to_port
+
+
+def permission_key(group_id, direction, protocol, from_port, to_port,
+                   peer_kind, peer, canonical_peer=False):
+    '''
+    Returns a PermissionKey. CIDRs from EC2 are already in canonical
+    form; others are normalised unless canonical_peer is set.
+    '''
+    protocol = normalise_protocol(str(protocol))
+    from_port, to_port = canonical_ports(protocol, from_port, to_port)
+    if not canonical_peer and peer_kind in (PEER_CIDR, PEER_CIDR_V6):
+        peer = canonical_cidr(peer)
+    return PermissionKey(group_id, direction, protocol, from_port, to_port, peer_kind, peer)
+
+
+def resource_key(resource):
+    '''
+    Returns the PermissionKey of a SecurityGroupIngress/Egress resource,
+    or None when the group or peer is only known as a reference to a
+    group that has not been deployed yet
+    '''
+    properties = resource['Properties']
+    group_id = properties['GroupId']
+    if isinstance(group_id, dict):
+        return None
+    for name, peer_kind in RESOURCE_PEERS:
+        if name in properties:
+            peer = properties[name]
+            break
+    else:
+        return None
+    if isinstance(peer, dict):
+        return None
+    return permission_key(
+        group_id, RESOURCE_DIRECTION[resource['Type']],
+        properties['IpProtocol'], properties.get('FromPort'),
+        properties.get('ToPort'), peer_kind, peer
+    )
+
+
+def live_keys(group, direction):
+    '''
+    Yields a PermissionKey for every peer of every permission in a
+    describe_security_groups group
+    '''
+    for permission in group.get(PERMISSIONS_KEY[direction], []):
+        for list_name, peer_name, peer_kind in LIVE_PEERS:
+            for peer in permission.get(list_name, []):
+                yield permission_key(
+                    group['GroupId'], direction, permission['IpProtocol'],
+                    permission.get('FromPort'), permission.get('ToPort'),
+                    peer_kind, peer[peer_name], canonical_peer=True
+                )
+
+
+def key_dict(key, resource_name=None):
+    rule = key._asdict()
+    del rule['group_id']
+    if resource_name:
+        rule['resource_name'] = resource_name
+    return rule
+
+
+class DriftReport(object):
+    '''
+    Per group and direction, the generated rules that are missing from
+    EC2, the live rules that were not generated, and the rules whose
+    peer and protocol match but whose ports differ
+    '''
+    def __init__(self):
+        self.groups = {}
+        self.skipped = 0
+
+    def group(self, group_id, direction):
+        return self.groups.setdefault(group_id, {}).setdefault(direction, {
+            'missing': [], 'extra': [], 'mismatched': [],
+        })
+
+    def counts(self):
+        counts = {'missing': 0, 'extra': 0, 'mismatched': 0}
+        for directions in self.groups.values():
+            for drift in directions.values():
+                for kind in counts:
+                    counts[kind] += len(drift[kind])
+        return counts
+
+    def update(self, other):
+        for group_id, directions in other.groups.items():
+            self.groups.setdefault(group_id, {}).update(directions)
+        self.skipped += other.skipped
+
+    def summary(self):
+        counts = self.counts()
+        return (
+            '{} groups drifted: {} rules missing, {} extra, {} mismatched '
+            '({} rules on groups not yet deployed not compared)'.format(
+                len(self.groups), counts['missing'], counts['extra'],
+                counts['mismatched'], self.skipped
+            )
+        )
+
+    def to_dict(self):
+        return {
+            'summary': self.counts(),
+            'skipped': self.skipped,
+            'groups': self.groups,
+        }
+
+    def write(self, path):
+        with open(path, 'w') as report_file:
+            json.dump(self.to_dict(), report_file, indent=1, sort_keys=True)
+
+
+def desired_permissions(compiled_rules):
+    '''
+    Returns ({PermissionKey: CompiledRule}, number of rules skipped
+    because they reference groups that are not deployed yet)
+    '''
+    desired = {}
+    skipped = 0
+    for result in compiled_rules:
+        key = resource_key(result.resource)
+        if key is None:
+            skipped += 1
+            continue
+        desired.setdefault(key, result)
+    return desired, skipped
+
+
+def live_permissions(security_groups, group_ids, direction):
+    '''
+    Returns the set of PermissionKeys live on the given groups
+    '''
+    live = set()
+    for group in security_groups:
+        if group['GroupId'] in group_ids:
+            live.update(live_keys(group, direction))
+    return live
+
+
+def detect_drift(compiled_rules, security_groups, direction):
+    '''
+    Compares the CompiledRules of one direction with the live groups
+    from describe_security_groups. Only groups that rules were generated
+    for are compared.
+    '''
+    report = DriftReport()
+    desired, report.skipped = desired_permissions(compiled_rules)
+    live = live_permissions(
+        security_groups, set(key.group_id for key in desired), direction
+    )
+    missing = set(desired).difference(live)
+    extra = live.difference(desired)
+
+    unmatched = {}
+    for key in sorted(extra):
+        shape = key._replace(from_port=None, to_port=None)
+        unmatched.setdefault(shape, []).append(key)
+    for key in sorted(missing):
+        drift = report.group(key.group_id, direction)
+        resource_name = desired[key].resource_name
+        candidates = unmatched.get(key._replace(from_port=None, to_port=None))
+        if candidates:
+            live_key = candidates.pop(0)
+            extra.discard(live_key)
+            drift['mismatched'].append({
+                'expected': key_dict(key, resource_name),
+                'actual': key_dict(live_key),
+            })
+        else:
+            drift['missing'].append(key_dict(key, resource_name))
+    for key in sorted(extra):
+        report.group(key.group_id, direction)['extra'].append(key_dict(key))
+    return report
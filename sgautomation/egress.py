@@ -0,0 +1,178 @@
+'''
+Generates SecurityGroupEgress resources from the egress rule sheet
+'''
+
+import logging
+
+from sgautomation.compiler import CompiledRule, SkippedRule
+from sgautomation.drift import EGRESS
+from sgautomation.generator import PROCESS_LOCAL_STATE, RuleGenerator
+from sgautomation.interfaces import InterfaceIndex
+
+GENERATOR_NAME  = 'egress'
+TEMPLATE_PREFIX = 'GeneratedSecurityGroupsEgress'
+TEMPLATE_NAME   = TEMPLATE_PREFIX + '{}.template.yaml'
+TEMPLATE_HEADER = {
+    'AWSTemplateFormatVersion': '2010-09-09',
+    'Description': 'Security Group Egress definitions',
+}
+LB_NOT_FOUND    = 'load_balancer_not_found'
+
+
+class EgressGenerator(RuleGenerator):
+    '''
+    Rules allowing traffic out of a sheet group to another group, a
+    CIDR, or a network load balancer's address in one availability zone
+    '''
+    generator_name = GENERATOR_NAME
+    direction = EGRESS
+    template_prefix = TEMPLATE_PREFIX
+    template_name = TEMPLATE_NAME
+    template_header = TEMPLATE_HEADER
+    load_network_interfaces = True
+    process_local_state = PROCESS_LOCAL_STATE + ('network_interfaces', 'interfaces',)
+
+    def index_inventory(self):
+        self.network_interfaces = self.get_network_interfaces()
+        self.interfaces = InterfaceIndex(self.network_interfaces)
+        self.nlb_cidrs = self.get_nlb_cidrs()
+        self.missing_load_balancers = {}
+        logging.info('NLB CIDRS found: \n{}'.format(self.nlb_cidrs))
+
+    def get_network_interfaces(self):
+        '''
+        Returns a list of network interfaces associated with the environment
+        '''
+        return self.inventory.network_interfaces
+
+    def get_nlb_cidrs(self):
+        '''
+        Returns a dict of load balancer names to availability zones and
+        private ip addresses
+        '''
+        return self.interfaces.load_balancers
+
+    def get_domain_controller_group_id(self):
+        '''
+        Gets the domain controller group id
+        '''
+        return self.interfaces.directory_group()
+
+    def get_load_balancer_reference(self, rule):
+        '''
+        Returns the (load balancer name, availability zone) an LB rule
+        points at, e.g. peer mgmt-ToolingNLB with peer type LB_A becomes
+        mgmt-nonprod-ToolingNLB in eu-west-2a
+        '''
+        vpc_prefix = rule.peer.split('-')[0]
+        lb_suffix = rule.peer.split(vpc_prefix)[1]
+        az = '{region}{az}'.format(
+            region=self.region,
+            az=rule.peer_type.split('_')[1].lower()
+        )
+        return vpc_prefix + '-' + self.env_name + lb_suffix, az
+
+    def compile_rule(self, rule):
+        '''
+        Translates a single rule into a CompiledRule holding its template
+        resource, or a SkippedRule explaining why it cannot be generated
+        '''
+        rule_id = format(rule.rule_id, '03')
+        source_short_code = self.generate_short_code(rule.group)
+
+        destination_group_name = None
+        destination_lb = None
+        if rule.peer_type == 'Group':
+            destination_group_name = self.generate_group_name(rule.peer)
+            destination_group_id = self.get_security_group_id(destination_group_name)
+            destination_cidr = None
+        elif 'LB' in rule.peer_type:
+            destination_lb, az = self.get_load_balancer_reference(rule)
+            destination_cidr = self.nlb_cidrs.get(destination_lb, {}).get(az)
+            destination_group_id = None
+        elif rule.peer_type == 'CIDR':
+            destination_cidr = rule.peer
+            destination_group_id = None
+        source_group_name = self.generate_group_name(rule.group)
+        source_group_id = self.get_security_group_id(source_group_name)
+        resource_name = 'r' + source_group_name + 'Rule' + rule_id
+        from_port = rule.from_port
+        to_port = rule.to_port
+        protocol = rule.protocol
+        if source_group_id is None and destination_group_id is None:
+            return SkippedRule(
+                rule, 'groups_not_found',
+                'Source and Destination groups not found. Skipping rule number {}:\nUnable to find destination group {} and source group {}'.format(rule_id, destination_group_name, source_group_name)
+            )
+        elif source_group_id is None:
+            return SkippedRule(
+                rule, 'group_not_found',
+                'Primary group not found. Skipping rule number {}:\nUnable to find source group {}'.format(rule_id, source_group_name)
+            )
+        elif destination_lb is not None and destination_cidr is None:
+            return SkippedRule(
+                rule, LB_NOT_FOUND,
+                'Load balancer not found. Skipping rule number {}:\nNo interface for load balancer {} in {}'.format(rule_id, destination_lb, az)
+            )
+        elif destination_group_id is None and destination_cidr is None:
+            return SkippedRule(
+                rule, 'peer_not_found',
+                'Inbound group/CIDR not found. Skipping rule number {}:\nUnable to find destination group {}'.format(rule_id, destination_group_name or rule.peer)
+            )
+        if rule.peer_type == 'Group':
+            egress_rule = {
+                'Type': 'AWS::EC2::SecurityGroupEgress',
+                'Properties': {
+                    'GroupId': source_group_id,
+                    'DestinationSecurityGroupId': destination_group_id,
+                    'Description': 'Rule ID {}'.format(rule_id),
+                    'IpProtocol': protocol,
+                    'FromPort': from_port,
+                    'ToPort': to_port,
+                }
+            }
+        else:
+            egress_rule = {
+                'Type': 'AWS::EC2::SecurityGroupEgress',
+                'Properties': {
+                    'GroupId': source_group_id,
+                    'CidrIp': destination_cidr,
+                    'Description': 'Rule ID {}'.format(rule_id),
+                    'IpProtocol': protocol,
+                    'FromPort': from_port,
+                    'ToPort': to_port,
+                }
+            }
+        return CompiledRule(rule, source_short_code, resource_name, egress_rule)
+
+    def record_skipped(self, result):
+        # missing load balancers are reported together by skipped_report
+        if result.reason == LB_NOT_FOUND:
+            self.missing_load_balancers.setdefault(
+                self.get_load_balancer_reference(result.rule), []
+            ).append(format(result.rule.rule_id, '03'))
+        else:
+            logging.warning(result.message)
+
+    def skipped_report(self):
+        if not self.missing_load_balancers:
+            return []
+        return self.missing_load_balancer_report()
+
+    def missing_load_balancer_report(self):
+        '''
+        Returns lines listing the load balancers and availability zones
+        that rules point at but no interface was found for, with the
+        rules skipped because of each
+        '''
+        lines = ['{} egress rules skipped, no interface found for {} load balancer references:'.format(
+            sum(len(rule_ids) for rule_ids in self.missing_load_balancers.values()),
+            len(self.missing_load_balancers)
+        )]
+        for (name, az), rule_ids in sorted(self.missing_load_balancers.items()):
+            known = sorted(self.nlb_cidrs.get(name, {}))
+            lines.append('  {} in {}: rules {}{}'.format(
+                name, az, ', '.join(rule_ids),
+                ' (found in {})'.format(', '.join(known)) if known else ''
+            ))
+        return lines
@@ -0,0 +1,98 @@
+'''
+Serialization of templates to YAML or JSON, and the byte counts the
+template size checks are based on
+'''
+
+import json
+import os
+
+import yaml
+
+YAML_FORMAT = 'yaml'
+JSON_FORMAT = 'json'
+TEMPLATE_FORMATS = (YAML_FORMAT, JSON_FORMAT)
+# the libyaml bindings emit the same text as the pure Python dumper
+# several times faster; PyYAML only has them when built against libyaml
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+JSON_SEPARATORS = (',', ':')
+
+
+class YamlEmitter(object):
+    '''
+    Block style YAML with sorted keys, the layout the templates have
+    always been written in
+    '''
+    name = YAML_FORMAT
+    extension = '.yaml'
+
+    def dump(self, template, stream=None):
+        '''
+        Writes template to stream, or returns it as a string when no
+        stream is given
+        '''
+        return yaml.dump(template, stream, Dumper=YAML_DUMPER,
+                         default_flow_style=False, sort_keys=True)
+
+    def overhead(self, header, sections):
+        '''
+        Returns the bytes a template with the given header and empty
+        sections takes before any entries are added
+        '''
+        size = len(self.dump(header)) if header else 0
+        return size + sum(len(section + ':\n') for section in sections)
+
+    def entry_size(self, section, name, value):
+        '''
+        Returns the bytes one entry adds to a section. Block style YAML
+        serializes each mapping entry independently, so section sizes
+        are the sum of these.
+        '''
+        return len(self.dump({section: {name: value}})) - len(section + ':\n')
+
+    def file_name(self, template_name):
+        return os.path.splitext(template_name)[0] + self.extension
+
+
+class JsonEmitter(YamlEmitter):
+    '''
+    Compact JSON with sorted keys. CloudFormation reads it directly and
+    the standard library encodes it in C, so it is the quickest format
+    to write and the smallest to upload.
+    '''
+    name = JSON_FORMAT
+    extension = '.json'
+
+    def dump(self, template, stream=None):
+        # json.dump encodes in pure Python chunk by chunk; encoding in
+        # one go and writing the result is several times faster
+        text = json.dumps(template, sort_keys=True, separators=JSON_SEPARATORS)
+        if stream is None:
+            return text
+        stream.write(text)
+
+    def overhead(self, header, sections):
+        # each section costs "name":{} plus a separating comma
+        size = len(self.dump(header or {}))
+        return size + sum(len(json.dumps(section)) + 4 for section in sections)
+
+    def entry_size(self, section, name, value):
+        # "name":value plus a separating comma
+        return len(json.dumps(name)) + len(self.dump(value)) + 2
+
+
+EMITTERS = {
+    YAML_FORMAT: YamlEmitter(),
+    JSON_FORMAT: JsonEmitter(),
+}
+
+
+def get_emitter(output_format=YAML_FORMAT):
+    '''
+    Returns the emitter for an output format name, yaml or json
+    '''
+    try:
+        return EMITTERS[output_format]
+    except KeyError:
+        raise ValueError('Unknown template format {}, expected one of {}'.format(
+            output_format, ', '.join(TEMPLATE_FORMATS)
+        ))
@@ -0,0 +1,329 @@
+'''
+Exposure analysis of the ingress and egress sheets: CIDR rules that
+overlap or are shadowed by another rule on the same group, rules open
+to public or broad ranges, and the ports each group is open on
+'''
+
+import csv
+import io
+import ipaddress
+import json
+
+from collections import namedtuple
+
+from sgautomation.cidrs import IPV4_BITS, NETWORK_MASKS, parse_ipv4
+from sgautomation.names import group_key
+from sgautomation.query import (
+    ALL_PROTOCOLS, CIDR_PEER_TYPE, EGRESS, INGRESS, CidrTrie, port_range
+)
+from sgautomation.rules import MAX_PORT, MIN_PORT
+
+JSON_FORMAT = 'json'
+CSV_FORMAT = 'csv'
+FORMATS = (JSON_FORMAT, CSV_FORMAT)
+PUBLIC = 'public'
+BROAD = 'broad'
+# IPv4 networks this wide are reported even when they are internal
+DEFAULT_BROAD_PREFIX = 16
+# address space that cannot be reached from the internet; a CIDR peer
+# outside all of these is public
+INTERNAL_NETWORKS = tuple(ipaddress.ip_network(network) for network in (
+    '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16', '100.64.0.0/10',
+    '127.0.0.0/8', '169.254.0.0/16', 'fc00::/7', 'fe80::/10', '::1/128',
+))
+INTERNAL_PREFIXES = tuple(CidrTrie.prefix(network) for network in INTERNAL_NETWORKS)
+# a CIDR rule with its ports and its CidrTrie prefix worked out
+CidrRule = namedtuple('CidrRule', ['rule', 'low', 'high', 'prefix'])
+CSV_FIELDS = (
+    'section', 'direction', 'group', 'rule_id', 'peer', 'protocol', 'ports',
+    'related_rule_id', 'related_peer', 'related_ports', 'detail',
+)
+
+
+def rule_order(rule):
+    # rule ids can repeat, the sheet line cannot
+    return rule.rule_id, rule.line
+
+
+def protocols_overlap(protocol, other):
+    return protocol == other or ALL_PROTOCOLS in (protocol, other)
+
+
+def covers(outer, inner):
+    '''
+    True if outer allows all the traffic inner does. Both are CidrRule
+    entries on the same group and outer's CIDR is known to contain inner's.
+    '''
+    if outer.rule.protocol not in (inner.rule.protocol, ALL_PROTOCOLS):
+        return False
+    if outer.prefix[2] > inner.prefix[2]:
+        return False
+    return outer.low <= inner.low and inner.high <= outer.high
+
+
+def is_internal(prefix):
+    '''
+    True if the CidrTrie prefix is inside one of INTERNAL_NETWORKS
+    '''
+    version, address, length, width = prefix
+    for internal_version, internal_address, internal_length, _ in INTERNAL_PREFIXES:
+        if version == internal_version and length >= internal_length and \
+                address >> (width - internal_length) == internal_address >> (width - internal_length):
+            return True
+    return False
+
+
+def merge_ranges(ranges):
+    '''
+    Returns the port ranges with overlapping and adjacent ones merged
+    '''
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], high)
+        else:
+            merged.append([low, high])
+    return [(low, high) for low, high in merged]
+
+
+def format_ports(ranges):
+    '''
+    Formats port ranges as e.g. 22,80-90, or all
+    '''
+    if ranges == [(MIN_PORT, MAX_PORT)]:
+        return 'all'
+    return ','.join(
+        str(low) if low == high else '{}-{}'.format(low, high) for low, high in ranges
+    )
+
+
+def port_count(ranges):
+    return sum(high - low + 1 for low, high in ranges)
+
+
+def rule_ports(rule):
+    return format_ports([port_range(rule)])
+
+
+class ExposureReport(object):
+    '''
+    The findings of analyse_exposure, one list per section:
+    shadowed - CIDR rules allowing nothing another rule on the group
+               does not already allow
+    overlaps - CIDR rules inside another rule's CIDR on the same group
+               whose ports and protocol partly overlap it
+    exposure - rules open to public addresses, or to internal ranges as
+               wide as the broad prefix or wider
+    surface  - the ports each group is open on per direction and
+               protocol, from any peer and from public addresses
+    '''
+    def __init__(self):
+        self.shadowed = []
+        self.overlaps = []
+        self.exposure = []
+        self.surface = []
+
+    def summary(self):
+        public = sum(1 for finding in self.exposure if finding['scope'] == PUBLIC)
+        return '{} shadowed and {} overlapping CIDR rules, {} rules open to public and {} to broad ranges, {} group port surfaces'.format(
+            len(self.shadowed), len(self.overlaps), public, len(self.exposure) - public,
+            len(self.surface)
+        )
+
+    def to_dict(self):
+        return {
+            'summary': self.summary(),
+            'shadowed': self.shadowed,
+            'overlaps': self.overlaps,
+            'exposure': self.exposure,
+            'surface': self.surface,
+        }
+
+    def csv_rows(self):
+        '''
+        Yields every finding as a row of CSV_FIELDS, the section column
+        saying which list it came from
+        '''
+        for finding in self.shadowed:
+            yield dict(finding, section='shadowed',
+                       detail='allowed by rule {}'.format(finding['related_rule_id']))
+        for finding in self.overlaps:
+            yield dict(finding, section='overlap',
+                       detail='{} is within {}'.format(finding['peer'], finding['related_peer']))
+        for finding in self.exposure:
+            yield dict(
+                {field: value for field, value in finding.items() if field not in ('scope', 'addresses')},
+                section=finding['scope'], detail='{} addresses'.format(finding['addresses'])
+            )
+        for finding in self.surface:
+            yield {
+                'section': 'surface',
+                'direction': finding['direction'],
+                'group': finding['group'],
+                'protocol': finding['protocol'],
+                'ports': finding['ports'],
+                'related_ports': finding['public_ports'],
+                'detail': '{} ports, {} from public addresses'.format(
+                    finding['port_count'], finding['public_port_count']
+                ),
+            }
+
+    def dumps(self, output_format=JSON_FORMAT):
+        if output_format == JSON_FORMAT:
+            return json.dumps(self.to_dict(), indent=1, sort_keys=True)
+        output = io.StringIO()
+        writer = csv.DictWriter(output, CSV_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(self.csv_rows())
+        return output.getvalue()
+
+    def write(self, path, output_format=JSON_FORMAT):
+        with open(path, 'w', newline='') as report_file:
+            report_file.write(self.dumps(output_format))
+
+
+class ExposureAnalyser(object):
+    '''
+    Analyses the rules of one direction. The CIDR peers of each group go
+    into a CidrTrie, so the rules whose CIDR contains a rule's CIDR are
+    found by walking at most one node per prefix bit rather than by
+    comparing every pair of rules; the work grows with the number of
+    rules and the overlaps found, not with its square.
+    '''
+    def __init__(self, direction, broad_prefix=DEFAULT_BROAD_PREFIX, networks=None):
+        self.direction = direction
+        self.broad_prefix = broad_prefix
+        # peer to (CidrTrie prefix, address count) or None, shared between
+        # directions; the same CIDRs recur across many rules
+        self.networks = {} if networks is None else networks
+        self.names = {}
+        self.tries = {}
+        self.cidr_rules = []
+        self.ranges = {}
+
+    def network(self, peer):
+        try:
+            return self.networks[peer]
+        except KeyError:
+            pass
+        network = parse_ipv4(peer)
+        if network is not None:
+            address, length = network
+            parsed = (4, address & NETWORK_MASKS[length], length, IPV4_BITS), 1 << (IPV4_BITS - length)
+        else:
+            try:
+                network = ipaddress.ip_network(peer, strict=False)
+            except ValueError:
+                parsed = None
+            else:
+                parsed = CidrTrie.prefix(network), network.num_addresses
+        self.networks[peer] = parsed
+        return parsed
+
+    def scope(self, prefix):
+        if not is_internal(prefix):
+            return PUBLIC
+        if prefix[0] == 4 and prefix[2] <= self.broad_prefix:
+            return BROAD
+        return None
+
+    def finding(self, rule, **fields):
+        finding = {
+            'direction': self.direction,
+            'group': rule.group,
+            'rule_id': rule.rule_id,
+            'peer': rule.peer,
+            'protocol': rule.protocol,
+            'ports': rule_ports(rule),
+        }
+        finding.update(fields)
+        return finding
+
+    def related(self, rule, other, **fields):
+        return self.finding(
+            rule, related_rule_id=other.rule_id, related_peer=other.peer,
+            related_ports=rule_ports(other), **fields
+        )
+
+    def add(self, rule, report):
+        key = group_key(rule.group)
+        self.names.setdefault(key, rule.group)
+        ranges = self.ranges.get((key, rule.protocol))
+        if ranges is None:
+            ranges = self.ranges[key, rule.protocol] = (set(), set())
+        ports = port_range(rule)
+        ranges[0].add(ports)
+        if rule.peer_type != CIDR_PEER_TYPE:
+            return
+        parsed = self.network(rule.peer)
+        if parsed is None:
+            return
+        prefix, addresses = parsed
+        cidr_rule = CidrRule(rule, ports[0], ports[1], prefix)
+        trie = self.tries.get(key)
+        if trie is None:
+            trie = self.tries[key] = CidrTrie()
+        trie.insert_prefix(prefix, cidr_rule)
+        self.cidr_rules.append((key, cidr_rule))
+        scope = self.scope(prefix)
+        if scope is not None:
+            report.exposure.append(self.finding(rule, scope=scope, addresses=addresses))
+        if scope == PUBLIC:
+            ranges[1].add(ports)
+
+    def compare(self, report):
+        '''
+        Compares each CIDR rule with the rules on its group whose CIDR
+        contains it. Where two rules allow exactly the same traffic the
+        later one in the sheet is the shadowed one, and pairs with the
+        same CIDR are reported once.
+        '''
+        for key, entry in self.cidr_rules:
+            rule = entry.rule
+            shadowing = None
+            for other_entry in self.tries[key].containing_prefix(entry.prefix):
+                other = other_entry.rule
+                if other is rule or not protocols_overlap(rule.protocol, other.protocol) \
+                        or other_entry.high < entry.low or entry.high < other_entry.low:
+                    continue
+                if covers(other_entry, entry):
+                    if covers(entry, other_entry) and rule_order(other) > rule_order(rule):
+                        continue
+                    if shadowing is None or rule_order(other) < rule_order(shadowing):
+                        shadowing = other
+                elif other_entry.prefix == entry.prefix and (
+                        covers(entry, other_entry) or rule_order(other) > rule_order(rule)):
+                    continue
+                else:
+                    report.overlaps.append(self.related(rule, other))
+            if shadowing is not None:
+                report.shadowed.append(self.related(rule, shadowing))
+
+    def port_surface(self, report):
+        for (key, protocol), (ranges, public_ranges) in sorted(self.ranges.items()):
+            ranges = merge_ranges(ranges)
+            public_ranges = merge_ranges(public_ranges)
+            report.surface.append({
+                'direction': self.direction,
+                'group': self.names[key],
+                'protocol': protocol,
+                'ports': format_ports(ranges),
+                'port_count': port_count(ranges),
+                'public_ports': format_ports(public_ranges),
+                'public_port_count': port_count(public_ranges),
+            })
+
+
+def analyse_exposure(ingress_rules=(), egress_rules=(), broad_prefix=DEFAULT_BROAD_PREFIX):
+    '''
+    Returns an ExposureReport for IngressRule and EgressRule records
+    '''
+    report = ExposureReport()
+    networks = {}
+    for direction, rules in ((INGRESS, ingress_rules), (EGRESS, egress_rules)):
+        analyser = ExposureAnalyser(direction, broad_prefix, networks)
+        for rule in rules:
+            analyser.add(rule, report)
+        analyser.compare(report)
+        analyser.port_surface(report)
+    return report
@@ -0,0 +1,121 @@
+'''
+Generation across a matrix of AWS profiles, regions and environments
+'''
+
+import asyncio
+import itertools
+import logging
+import os
+import time
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_TARGET_WORKERS = 8
+
+Target = namedtuple('Target', ('profile', 'region', 'env_name'))
+
+
+def target_matrix(profiles, regions, env_names):
+    '''
+    Returns a Target for every combination of profile, region and
+    env_name, dropping repeats but keeping the order given
+    '''
+    targets = []
+    for target in itertools.product(profiles, regions, env_names):
+        if target not in targets:
+            targets.append(Target(*target))
+    return targets
+
+
+def target_path(template_path, target):
+    '''
+    Returns the directory a target's templates are written to,
+    template_path/profile/region/env_name
+    '''
+    return os.path.join(template_path, target.profile, target.region, target.env_name)
+
+
+class TargetResult(object):
+    '''
+    The outcome of one target: what generate returned, or the error
+    that stopped it, and how long its inventory and generation took
+    '''
+    def __init__(self, target):
+        self.target = target
+        self.value = None
+        self.error = None
+        self.inventory_seconds = 0.0
+        self.generate_seconds = 0.0
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def summary(self):
+        outcome = 'ok' if self.ok else 'failed: {}'.format(self.error)
+        return '{}/{}/{}: {} (inventory {:.1f}s, generation {:.1f}s)'.format(
+            self.target.profile, self.target.region, self.target.env_name,
+            outcome, self.inventory_seconds, self.generate_seconds
+        )
+
+
+class FanOut(object):
+    '''
+    Runs load(target) for every target at once on a pool of threads,
+    and generate(target, inventory) for each target as soon as its
+    inventory arrives. Inventories are network bound and make up most of
+    a run, so the wall time is close to the slowest target's rather
+    than the sum of all of them.
+
+    boto3 clients are not shared between threads: load is expected to
+    create its own session per target, as create_client does.
+    Generation is CPU bound and runs one target at a time on the event
+    loop's thread, so each target's output is printed in one piece.
+    A target that fails is reported without stopping the others.
+    '''
+    def __init__(self, load, generate, workers=DEFAULT_TARGET_WORKERS):
+        self.load = load
+        self.generate = generate
+        self.workers = workers
+
+    def run(self, targets):
+        '''
+        Returns a TargetResult per target, in the order given
+        '''
+        return asyncio.run(self.run_targets(targets))
+
+    async def run_targets(self, targets):
+        loop = asyncio.get_running_loop()
+        results = {target: TargetResult(target) for target in targets}
+        workers = max(1, min(self.workers, len(targets)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = [
+                asyncio.ensure_future(self.load_inventory(loop, executor, results[target]))
+                for target in targets
+            ]
+            for loaded in asyncio.as_completed(pending):
+                result, inventory = await loaded
+                if result.ok:
+                    self.generate_target(result, inventory)
+        return [results[target] for target in targets]
+
+    async def load_inventory(self, loop, executor, result):
+        start = time.perf_counter()
+        inventory = None
+        try:
+            inventory = await loop.run_in_executor(executor, self.load, result.target)
+        except Exception as error:
+            logging.exception('Loading the inventory for {} failed'.format(result.target))
+            result.error = error
+        result.inventory_seconds = time.perf_counter() - start
+        return result, inventory
+
+    def generate_target(self, result, inventory):
+        start = time.perf_counter()
+        try:
+            result.value = self.generate(result.target, inventory)
+        except Exception as error:
+            logging.exception('Generating {} failed'.format(result.target))
+            result.error = error
+        result.generate_seconds = time.perf_counter() - start
@@ -0,0 +1,258 @@
+'''
+The rule generator shared by the ingress and egress templates
+'''
+
+import abc
+import logging
+import pprint
+
+from sgautomation.apply import DEFAULT_APPLY_WORKERS, ApplyEngine
+from sgautomation.compiler import SkippedRule, compile_rules
+from sgautomation.drift import detect_drift
+from sgautomation.emitter import YAML_FORMAT, get_emitter
+from sgautomation.inventory import DEFAULT_REGION, AwsInventory, create_client, env_vpc_names
+from sgautomation.manifest import TemplateWriter
+from sgautomation.metrics import METRICS
+from sgautomation.names import generate_group_name, generate_short_code
+from sgautomation.optimiser import RuleOptimiser
+from sgautomation.partition import pack_templates
+from sgautomation.quota import DEFAULT_RULE_QUOTA, plan_quotas
+from sgautomation.resolver import SecurityGroupResolver
+from sgautomation.templates import TemplateBuilder
+
+DEFAULT_PROFILE = 'scotgov'
+# attributes not needed to compile rules, left out when pickling for workers
+PROCESS_LOCAL_STATE = ('data', 'client', 'inventory', 'groups', 'templates', 'container',)
+
+
+class RuleGenerator(abc.ABC):
+    '''
+    Turns the rows of an ingress or egress sheet into SecurityGroupIngress
+    or SecurityGroupEgress resources, one template per short code, and
+    reports on, checks or applies the rules it generated.
+
+    Subclasses set the class attributes naming their direction and
+    templates, implement compile_rule, and can override index_inventory
+    to build the lookups compile_rule needs once the groups are known.
+    '''
+    generator_name = None
+    direction = None
+    template_prefix = None
+    template_name = None
+    template_header = None
+    load_network_interfaces = False
+    load_instances = False
+    process_local_state = PROCESS_LOCAL_STATE
+
+    def __init__(self, __data, region=None, aws_profile=None, env_name='',
+                 inventory=None, planned_groups=None, output_format=YAML_FORMAT,
+                 prefer_live_groups=False):
+        self.data = __data
+        self.env_name = env_name
+        self.region = region or DEFAULT_REGION
+        if inventory is None:
+            inventory = AwsInventory.load(
+                self.setup_boto_client(aws_profile, region),
+                vpc_names=self.get_vpc_names(),
+                network_interfaces=self.load_network_interfaces,
+                instances=self.load_instances
+            )
+        self.inventory = inventory
+        self.client = inventory.client
+        self.groups = self.get_all_security_groups()
+        self.vpc_ids = self.get_vpc_ids()
+        self.index_inventory()
+        self.dc_group = self.get_domain_controller_group_id()
+        self.resolver = SecurityGroupResolver(self.groups, self.dc_group,
+                                              prefer_live=prefer_live_groups)
+        for name, reference in (planned_groups or {}).items():
+            self.resolver.plan_group(name, reference)
+        self.emitter = get_emitter(output_format)
+        self.templates = TemplateBuilder(header=self.template_header, emitter=self.emitter)
+        self.container = self.templates.container
+        self.optimisation_report = None
+        self.changeset = None
+        self.compiled_rules = []
+
+    def setup_boto_client(self, aws_profile, region):
+        '''
+        Prepare boto3 client for interacting with AWS API
+        '''
+        return create_client(aws_profile or DEFAULT_PROFILE, region)
+
+    def get_vpc_names(self):
+        '''
+        Return a list of VPC names
+        '''
+        return env_vpc_names(self.env_name)
+
+    def get_vpc_ids(self):
+        '''
+        Returns the vpc ids associated with the environment
+        '''
+        return self.inventory.vpc_ids
+
+    def get_all_security_groups(self):
+        '''
+        Returns all groups in the environment's VPCs
+        '''
+        return self.inventory.security_groups
+
+    def index_inventory(self):
+        '''
+        Builds any lookups compile_rule needs from the inventory
+        '''
+
+    def get_domain_controller_group_id(self):
+        '''
+        Gets the domain controller group id
+        '''
+        return None
+
+    def get_security_group_id(self, short_name):
+        '''
+        Looks up a security group based on the name
+        '''
+        return self.resolver.resolve(short_name)
+
+    def generate_security_group_structure(self, workers=1, optimise=False):
+        '''
+        Generates a dictionary structure suitable for transforming into
+        cloudformation templates. With workers > 1 the rules are compiled
+        in a process pool; the result is identical to a serial run. With
+        optimise, redundant rules are merged before they are added.
+        '''
+        with METRICS.phase('structure_build', generator=self.generator_name):
+            self.build_structure(workers, optimise)
+
+    def build_structure(self, workers, optimise):
+        '''
+        The body of generate_security_group_structure, timed as one phase
+        '''
+        skipped_rules = []
+        compiled_rules = []
+
+        for result in compile_rules(self.compile_rule, self.data, workers):
+            if isinstance(result, SkippedRule):
+                self.record_skipped(result)
+                skipped_rules.append(format(result.rule.rule_id, '03'))
+                METRICS.count('rows_skipped_total', generator=self.generator_name,
+                              reason=result.reason)
+                continue
+            compiled_rules.append(result)
+        METRICS.count('rows_total', len(compiled_rules), generator=self.generator_name,
+                      outcome='compiled')
+        METRICS.count('rows_total', len(skipped_rules), generator=self.generator_name,
+                      outcome='skipped')
+        METRICS.count('resolver_lookups_total', self.resolver.hits,
+                      generator=self.generator_name, result='hit')
+        METRICS.count('resolver_lookups_total', self.resolver.misses,
+                      generator=self.generator_name, result='miss')
+        if optimise:
+            with METRICS.phase('optimise', generator=self.generator_name):
+                compiled_rules, self.optimisation_report = RuleOptimiser().optimise(compiled_rules)
+            logging.info('Optimisation: {}'.format(self.optimisation_report.summary()))
+        self.compiled_rules = compiled_rules
+        with METRICS.phase('template_layout', generator=self.generator_name):
+            for result in compiled_rules:
+                self.templates.add(result.key, result.resource_name, result.resource,
+                                   affinity=result.rule.group)
+        report = self.skipped_report()
+        if report:
+            logging.warning('\n'.join(report))
+        if len(skipped_rules) > 0:
+            logging.warning('Rows skipped: {}'.format(skipped_rules))
+        else:
+            logging.info('All rules processed succesffully.')
+        logging.info('Rules processed: \n{}'.format(pprint.pformat(self.templates.resource_counts())))
+
+    @abc.abstractmethod
+    def compile_rule(self, rule):
+        '''
+        Translates a single rule into a CompiledRule holding its template
+        resource, or a SkippedRule explaining why it cannot be generated
+        '''
+
+    def record_skipped(self, result):
+        '''
+        Called with each SkippedRule; skips are logged one by one unless
+        a subclass collects them for skipped_report
+        '''
+        logging.warning(result.message)
+
+    def skipped_report(self):
+        '''
+        Returns lines summarising skipped rules that were collected
+        rather than logged, or an empty list
+        '''
+        return []
+
+    def __getstate__(self):
+        '''
+        Only the lookup state needed by compile_rule is sent to worker
+        processes
+        '''
+        state = dict(self.__dict__)
+        for name in self.process_local_state:
+            state.pop(name, None)
+        return state
+
+    def drift_report(self):
+        '''
+        Compares the generated rules with the live permissions of the
+        groups they belong to
+        '''
+        with METRICS.phase('drift_report', generator=self.generator_name):
+            return detect_drift(self.compiled_rules, self.groups, self.direction)
+
+    def quota_report(self, quota=DEFAULT_RULE_QUOTA):
+        '''
+        Checks the generated rules against the rules per group quota
+        '''
+        with METRICS.phase('quota_check', generator=self.generator_name):
+            return plan_quotas(self.compiled_rules, self.direction, quota)
+
+    def apply_rules(self, client, dry_run=False, prune=False,
+                    workers=DEFAULT_APPLY_WORKERS):
+        '''
+        Applies the generated rules straight to the live groups instead
+        of through a stack update. Returns (ApplyPlan, ApplyResult); the
+        result is None for a dry run. Without a client the plan is made
+        against the inventory's copy of the groups.
+        '''
+        engine = ApplyEngine(client, workers=workers, prune=prune)
+        plan = engine.plan(self.compiled_rules, self.direction,
+                           security_groups=None if client else self.groups)
+        if dry_run:
+            return plan, None
+        with METRICS.phase('apply', generator=self.generator_name):
+            return plan, engine.apply(plan)
+
+    def pack_templates(self, template_path):
+        '''
+        Replaces the per short code buckets with as few numbered
+        templates as the CloudFormation limits allow
+        '''
+        with METRICS.phase('pack', generator=self.generator_name):
+            pack_templates(self.templates, template_path, self.template_prefix)
+
+    def write_to_file(self, template_path, incremental=False):
+        '''
+        Writes each element in self.container to file. When incremental,
+        only templates that changed since the previous run are rewritten
+        and the changes are kept in self.changeset.
+        '''
+        writer = TemplateWriter(template_path, self.template_prefix, incremental,
+                                emitter=self.emitter)
+        with METRICS.phase('yaml_emit', generator=self.generator_name):
+            for short_name, template_data in self.container.items():
+                template_data.update(self.template_header)
+                template_name = template_path + '/' + self.template_name.format(short_name.title())
+                writer.write(template_name, template_data)
+        self.changeset = writer.finish()
+
+    def generate_group_name(self, raw_name):
+        return generate_group_name(raw_name)
+
+    def generate_short_code(self, raw_name):
+        return generate_short_code(raw_name)
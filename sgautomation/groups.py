@@ -0,0 +1,258 @@
+'''
+Generates SecurityGroup resources from the group creation sheet
+'''
+
+import logging
+import os
+
+from sgautomation.emitter import YAML_FORMAT, get_emitter
+from sgautomation.inventory import AwsInventory, UnresolvedVpcError, VpcIndex, create_client
+from sgautomation.manifest import TemplateWriter
+from sgautomation.metrics import METRICS
+from sgautomation.names import definition_group_name
+from sgautomation.partition import (
+    Item, Partitioner, load_assignments, partition_file, save_assignments
+)
+from sgautomation.templates import MAX_TEMPLATE_BYTES
+
+DEFAULT_VPCSHORTCODE_TAG = 'VPC_Short_Code'
+GENERATOR_NAME = 'basic'
+TEMPLATE_PREFIX = 'GeneratedSecurityGroups'
+TEMPLATE_NAME = TEMPLATE_PREFIX + '{}.template.yaml'
+MAX_RESOURCES_PER_TEMPLATE = 60
+
+
+class GroupGenerator(object):
+    '''
+    Turns the rows of the creation sheet into SecurityGroup resources
+    with an exported output each, written sixty groups to a template
+    '''
+    def __init__(self, __data, region=None, aws_profile=None, inventory=None,
+                 output_format=YAML_FORMAT):
+        self.data = __data
+        if inventory is None:
+            inventory = AwsInventory.load(
+                self.setup_boto_client(aws_profile, region),
+                security_groups=False,
+                network_interfaces=False
+            )
+        self.inventory = inventory
+        self.client = inventory.client
+        self.vpcs = inventory.vpcs
+        self.vpc_index = VpcIndex(self.vpcs)
+        self.resources = []
+        self.emitter = get_emitter(output_format)
+        self.writer = None
+        self.changeset = None
+        
+    def setup_boto_client(self, aws_profile, region):
+        '''
+        Prepare boto3 client for interacting with AWS API
+        '''
+        return create_client(aws_profile, region)
+    
+    def describe_vpcs(self):
+        '''
+        Gather data on all VPCs for debugging
+        '''
+        for vpc in self.vpcs:
+            logging.info(vpc.get('VpcId', ''))
+        
+    def get_vpc_short_code(self, vpc_id, vpc_tag):
+        '''
+        Lookup vpc short code based on vpc id
+        '''
+        return self.vpc_index.tag(vpc_id, vpc_tag) or ''
+    
+    def get_vpc_id(self, vpc_short_code, vpc_tag):
+        '''
+        Gets the VPC ID based on a vpc short code, or None
+        '''
+        return self.vpc_index.vpc_id(vpc_tag, vpc_short_code)
+    
+    def generate_security_group_structure(self, vpc_short_code_part2=None, vpc_tag=None):
+        '''
+        Creates a dictionary structure representing the components of
+        an AWS CloudFormation template. Raises UnresolvedVpcError,
+        listing every definition affected, if any short code has no VPC.
+        '''
+        vpc_id = ''
+        vpc_short_code = ''
+        resources = []
+        unresolved = {}
+        for definition in self.data:
+            resource = {}
+            group_name = self.generate_group_name(definition.name)
+            vpc_short_code_part1 = definition.vpc_code.lower()
+            vpc_short_code = '{}-{}'.format(vpc_short_code_part1, vpc_short_code_part2)
+            vpc_id = self.get_vpc_id(vpc_short_code, vpc_tag)
+            if vpc_id is None:
+                unresolved.setdefault(vpc_short_code, []).append(definition)
+                continue
+            resource_name = 'r' + group_name
+            export_name = vpc_short_code + '-SecurityGroup-' + group_name
+            resource['resource_name'] = resource_name
+            resource['vpc_short_code'] = vpc_short_code
+            resource['Resource'] = {
+                'Type': 'AWS::EC2::SecurityGroup',
+                'Properties': {
+                    'GroupDescription': definition.description,
+                    'GroupName': export_name,
+                    'VpcId': vpc_id,
+                    'SecurityGroupIngress': [],
+                    'SecurityGroupEgress': [],
+                    'Tags': [
+                        {
+                            'Key': 'Name',
+                            'Value': export_name
+                        },
+                        {
+                            'Key': vpc_tag,
+                            'Value': vpc_short_code
+                        }
+                    ]
+                }
+            }
+            output_name = 'o' + group_name
+            resource['output_name'] = output_name
+            resource['Output'] = {
+                'Description': definition.description,
+                'Value': {'Ref': resource_name},
+                'Export': {
+                    'Name': export_name
+                }
+            }
+            self.resources.append(resource)
+        if unresolved:
+            raise UnresolvedVpcError('No VPC has a {} tag of {}:\n{}'.format(
+                vpc_tag, ', '.join(sorted(unresolved)),
+                '\n'.join(
+                    '  line {} {} ({})'.format(definition.line, definition.name, code)
+                    for code, definitions in sorted(unresolved.items())
+                    for definition in definitions
+                )
+            ))
+        METRICS.count('rows_total', len(self.resources), generator=GENERATOR_NAME,
+                      outcome='compiled')
+    
+    def get_exported_groups(self):
+        '''
+        Returns a dict of logical group name to an Fn::ImportValue of the
+        group's export, so rules generated in the same run can refer to
+        groups that have not been deployed yet
+        '''
+        return {
+            resource['resource_name'][1:]: {
+                'Fn::ImportValue': resource['Output']['Export']['Name']
+            }
+            for resource in self.resources
+        }
+
+    def generate_templates(self, template_path=None, incremental=False):
+        '''
+        Generate a series of cloudformation templates
+        '''
+        self.writer = TemplateWriter(template_path, TEMPLATE_PREFIX, incremental,
+                                     emitter=self.emitter)
+        i = 0
+        template_num = 1
+        template = {
+            'AWSTemplateFormatVersion': '2010-09-09',
+            'Description': 'Security Group definitions',
+        }
+        template_resources = {}
+        template_outputs = {}
+        while i < len(self.resources):
+            resource = self.resources[i]
+            logging.info(resource)
+            template_resources[resource.get('resource_name')] = resource.get('Resource')
+            template_outputs[resource.get('resource_name')] = resource.get('Output')
+            if (i > 0 and (i + 1) % MAX_RESOURCES_PER_TEMPLATE == 0) or i == len(self.resources) - 1:
+                template['Resources'] = template_resources
+                template['Outputs'] = template_outputs
+                template_name = template_path + '/' + TEMPLATE_NAME
+                self.write_to_file(template, template_num, template_name)
+                template = {
+                    'AWSTemplateFormatVersion': '2010-09-09',
+                    'Description': 'Security Group definitions {}'.format(template_num),
+                }
+                template_resources = {}
+                template_outputs = {}
+                template_num += 1
+            i += 1
+        self.changeset = self.writer.finish()
+        
+    
+    def generate_packed_templates(self, template_path=None, incremental=False):
+        '''
+        Generate templates with the groups bin packed by size and count.
+        Groups keep the template they were in on the previous run; on the
+        first run that is the template generate_templates would use.
+        '''
+        header = {
+            'AWSTemplateFormatVersion': '2010-09-09',
+            'Description': 'Security Group definitions {}'.format(len(self.resources)),
+        }
+        overhead = self.emitter.overhead(header, ('Resources', 'Outputs'))
+        items = []
+        for resource in self.resources:
+            name = resource.get('resource_name')
+            size = (
+                self.emitter.entry_size('Resources', name, resource.get('Resource')) +
+                self.emitter.entry_size('Outputs', name, resource.get('Output'))
+            )
+            items.append(Item(name, size, resource.get('vpc_short_code')))
+        path = partition_file(template_path, TEMPLATE_PREFIX)
+        previous = load_assignments(path) or {
+            resource.get('resource_name'): i // MAX_RESOURCES_PER_TEMPLATE + 1
+            for i, resource in enumerate(self.resources)
+        }
+        partitioner = Partitioner(MAX_TEMPLATE_BYTES, MAX_RESOURCES_PER_TEMPLATE, overhead)
+        assignments = partitioner.pack(items, previous)
+        templates = {}
+        for resource in self.resources:
+            template_num = assignments[resource.get('resource_name')]
+            template = templates.setdefault(template_num, {
+                'AWSTemplateFormatVersion': '2010-09-09',
+                'Description': 'Security Group definitions {}'.format(template_num - 1)
+                    if template_num > 1 else 'Security Group definitions',
+                'Resources': {},
+                'Outputs': {},
+            })
+            template['Resources'][resource.get('resource_name')] = resource.get('Resource')
+            template['Outputs'][resource.get('resource_name')] = resource.get('Output')
+        self.writer = TemplateWriter(template_path, TEMPLATE_PREFIX, incremental,
+                                     emitter=self.emitter)
+        template_name = template_path + '/' + TEMPLATE_NAME
+        for template_num in sorted(templates):
+            self.write_to_file(templates[template_num], template_num, template_name)
+        save_assignments(path, assignments)
+        self.changeset = self.writer.finish()
+
+    def write_to_file(self, template, n, template_name):
+        '''
+        Write the dictionary structure (self.template) to file
+        '''
+        if self.writer is None:
+            self.writer = TemplateWriter(os.path.dirname(template_name), TEMPLATE_PREFIX,
+                                         emitter=self.emitter)
+        with METRICS.phase('yaml_emit', generator=GENERATOR_NAME):
+            self.writer.write(template_name.format(n), template)
+    
+    def generate_group_name(self, raw_name):
+        '''
+        Prepares a logical group name removing whitespace and
+        putting into title case
+        '''
+        return definition_group_name(raw_name)
+        
+    def generate_vpc_id(self, raw_vpc_id):
+        '''
+        A simple check on the format of the vpc id string
+        '''
+        vpc_id = ''
+        if raw_vpc_id[:4] != 'vpc-':
+            vpc_id = 'vpc-' + raw_vpc_id
+        else:
+            vpc_id = raw_vpc_id
+        return vpc_id
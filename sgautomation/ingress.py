@@ -0,0 +1,124 @@
+'''
+Generates SecurityGroupIngress resources from the ingress rule sheet
+'''
+
+import logging
+
+from sgautomation.compiler import CompiledRule, SkippedRule
+from sgautomation.drift import INGRESS
+from sgautomation.generator import RuleGenerator
+from sgautomation.inventory import tag_dict
+
+GENERATOR_NAME  = 'ingress'
+TEMPLATE_PREFIX = 'GeneratedSecurityGroupsIngress'
+TEMPLATE_NAME   = TEMPLATE_PREFIX + '{}.template.yaml'
+TEMPLATE_HEADER = {
+    'AWSTemplateFormatVersion': '2010-09-09',
+    'Description': 'Security Group Ingress definitions',
+}
+
+
+class IngressGenerator(RuleGenerator):
+    '''
+    Rules allowing traffic into a sheet group from another group, a VPC's
+    CIDR or a CIDR
+    '''
+    generator_name = GENERATOR_NAME
+    direction = INGRESS
+    template_prefix = TEMPLATE_PREFIX
+    template_name = TEMPLATE_NAME
+    template_header = TEMPLATE_HEADER
+
+    def index_inventory(self):
+        self.vpc_cidrs = self.get_vpc_cidr_ranges()
+        logging.info('VPC CIDRs found:\n{}'.format(self.vpc_cidrs))
+
+    def get_vpc_cidr_ranges(self):
+        '''
+        Returns a dict of VPC names and VPC CIDR ranges
+        '''
+        vpc_cidrs = {}
+        for vpc in self.inventory.env_vpcs:
+            cidr = vpc['CidrBlock']
+            tags = tag_dict(vpc)
+            name = tags['Name'].split('-')[0].lower()
+            vpc_cidrs[name] = cidr
+        return vpc_cidrs
+
+    def get_domain_controller_group_id(self):
+        '''
+        Gets the domain controller group id
+        '''
+        vpc_ids = self.get_vpc_ids()
+        for group in self.groups:
+            if (
+                group['GroupName'].startswith('d-') and
+                group['GroupName'].endswith('_controllers') and
+                group['VpcId'] in vpc_ids
+            ): return group['GroupId']
+
+    def compile_rule(self, rule):
+        '''
+        Translates a single rule into a CompiledRule holding its template
+        resource, or a SkippedRule explaining why it cannot be generated
+        '''
+        rule_id = format(rule.rule_id, '03')
+        destination_short_code = self.generate_short_code(rule.group)
+
+        source_group_name = None
+        if rule.peer_type == 'Group':
+            source_group_name = self.generate_group_name(rule.peer)
+            source_group_id = self.get_security_group_id(source_group_name)
+            source_cidr = None
+        elif rule.peer_type == 'VPC':
+            source_cidr = self.vpc_cidrs.get(rule.peer.lower())
+            source_group_id = None
+        elif rule.peer_type == 'CIDR':
+            source_cidr = rule.peer
+            source_group_id = None
+        destination_group_name = self.generate_group_name(rule.group)
+        destination_group_id = self.get_security_group_id(destination_group_name)
+        resource_name = 'r' + destination_group_name + 'Rule' + rule_id
+        from_port = rule.from_port
+        to_port = rule.to_port
+        protocol = rule.protocol
+        if destination_group_id is None and source_group_id is None:
+            return SkippedRule(
+                rule, 'groups_not_found',
+                'Source and Destination groups not found. Skipping rule number {}:\nUnable to find source group {} and destination group {}'.format(rule_id, source_group_name, destination_group_name)
+            )
+        elif destination_group_id is None:
+            return SkippedRule(
+                rule, 'group_not_found',
+                'Primary group not found. Skipping rule number {}:\nUnable to find destination group {}'.format(rule_id, destination_group_name)
+            )
+        elif source_group_id is None and source_cidr is None:
+            return SkippedRule(
+                rule, 'peer_not_found',
+                'Inbound group/CIDR not found. Skipping rule number {}:\nUnable to find source group {}'.format(rule_id, source_group_name or rule.peer)
+            )
+        if rule.peer_type == 'Group':
+            ingress_rule = {
+                'Type': 'AWS::EC2::SecurityGroupIngress',
+                'Properties': {
+                    'GroupId': destination_group_id,
+                    'SourceSecurityGroupId': source_group_id,
+                    'Description': 'Rule ID {}'.format(rule_id),
+                    'IpProtocol': protocol,
+                    'FromPort': from_port,
+                    'ToPort': to_port,
+                }
+            }
+        else:
+            ingress_rule = {
+                'Type': 'AWS::EC2::SecurityGroupIngress',
+                'Properties': {
+                    'GroupId': destination_group_id,
+                    'CidrIp': source_cidr,
+                    'Description': 'Rule ID {}'.format(rule_id),
+                    'IpProtocol': protocol,
+                    'FromPort': from_port,
+                    'ToPort': to_port,
+                }
+            }
+        return CompiledRule(rule, destination_short_code, resource_name, ingress_rule)
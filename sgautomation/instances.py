@@ -0,0 +1,86 @@
+'''
+Attaches the groups named in the instance role mapping sheet to instances
+'''
+
+import logging
+
+from sgautomation.apply import DEFAULT_APPLY_WORKERS
+from sgautomation.assignments import AssignmentEngine, role_key
+from sgautomation.compiler import CompiledRule, SkippedRule
+from sgautomation.generator import RuleGenerator
+from sgautomation.metrics import METRICS
+
+GENERATOR_NAME = 'instances'
+
+
+class InstanceGenerator(RuleGenerator):
+    '''
+    Rows of the mapping sheet attach a group to the instances carrying
+    an instance_role tag. Nothing is written as a template: the group
+    changes are planned, and applied, by an AssignmentEngine. Groups are
+    looked up by their live ids, as instances can only be given groups
+    that already exist.
+    '''
+    generator_name = GENERATOR_NAME
+    load_instances = True
+
+    def __init__(self, __data, region=None, aws_profile=None, env_name='', inventory=None):
+        super(InstanceGenerator, self).__init__(
+            list(__data), region=region, aws_profile=aws_profile, env_name=env_name,
+            inventory=inventory
+        )
+        METRICS.count('rows_total', len(self.data), generator=self.generator_name,
+                      outcome='read')
+
+    def index_inventory(self):
+        self.group_vpcs = {group['GroupId']: group.get('VpcId') for group in self.groups}
+
+    def get_security_group_id(self, raw_name):
+        '''
+        Looks up a security group from its name in the mapping sheet
+        '''
+        return self.resolver.resolve(self.generate_group_name(raw_name))
+
+    def compile_rule(self, rule):
+        '''
+        Resolves the group of a mapping row; the CompiledRule is keyed on
+        the role and holds the group id as its resource
+        '''
+        group_id = self.get_security_group_id(rule.group)
+        if group_id is None:
+            return SkippedRule(rule, 'group_not_found',
+                               'Unable to find group {}'.format(rule.group))
+        return CompiledRule(rule, role_key(rule.role), self.generate_group_name(rule.group),
+                            group_id)
+
+    def assign_groups(self, client, dry_run=False, prune=False,
+                      workers=DEFAULT_APPLY_WORKERS):
+        '''
+        Works out the group changes the mapping sheet calls for and
+        makes them. Returns (AssignmentPlan, AssignmentResult); the
+        result is None for a dry run. Without a client the plan is made
+        against the inventory's copy of the instances.
+        '''
+        engine = AssignmentEngine(client, self.get_security_group_id, self.group_vpcs,
+                                  workers=workers, prune=prune)
+        with METRICS.phase('structure_build', generator=self.generator_name):
+            plan = engine.plan(
+                self.data,
+                instances=None if client else self.inventory.instances or [],
+                vpc_ids=self.inventory.vpc_ids
+            )
+        # the same mapping can be skipped for thousands of instances
+        reported = set()
+        for skipped in plan.skipped:
+            message = 'Skipping mapping {}: {}'.format(
+                skipped.mapping.mapping_id if skipped.mapping else '-', skipped.message
+            )
+            if message not in reported:
+                reported.add(message)
+                logging.warning(message)
+            METRICS.count('rows_skipped_total', generator=self.generator_name,
+                          reason=skipped.reason)
+        if dry_run:
+            return plan, None
+        with METRICS.phase('apply', generator=self.generator_name):
+            return plan, engine.apply(plan)
@@ -0,0 +1,81 @@
+'''
+Sorts network interfaces into the load balancer and directory service
+lookups the egress rules are built from
+'''
+
+NLB_INTERFACE_TYPE = 'network_load_balancer'
+NLB_DESCRIPTION_PREFIX = 'ELB net/'
+DIRECTORY_MARKER = 'directory'
+DIRECTORY_ID_PREFIX = 'd-'
+# EC2 matches Description filters with * wildcards and ORs the values,
+# so one describe call returns only the load balancer and directory
+# service interfaces rather than every interface in the VPCs
+INTERFACE_DESCRIPTIONS = (NLB_DESCRIPTION_PREFIX + '*', '*' + DIRECTORY_MARKER + '*')
+
+
+def interface_filter():
+    '''
+    Returns the describe_network_interfaces filter for the interfaces
+    InterfaceIndex uses
+    '''
+    return {'Name': 'description', 'Values': list(INTERFACE_DESCRIPTIONS)}
+
+
+def directory_id(description):
+    '''
+    Returns the directory id from an interface description such as
+    "AWS created network interface for directory d-1234567890"
+    '''
+    for word in description.split():
+        if word.startswith(DIRECTORY_ID_PREFIX):
+            return word
+    return description
+
+
+class InterfaceIndex(object):
+    '''
+    Indexes network interfaces in one pass:
+    by_type        - interface type to its interfaces
+    by_instance    - id of the instance an interface is attached to, to
+                     its interfaces
+    by_subnet      - subnet id to its interfaces
+    by_group       - security group id to the interfaces it is on
+    load_balancers - NLB name to availability zone to private IP as a /32
+    directories    - directory id to the group on its interfaces, in the
+                     order the directories were first seen
+    Interfaces of other kinds are only kept in the by_ lookups, so a
+    snapshot holding every interface in the VPCs gives the same load
+    balancers and directories as a filtered one.
+    '''
+    def __init__(self, interfaces):
+        self.by_type = {}
+        self.by_instance = {}
+        self.by_subnet = {}
+        self.by_group = {}
+        self.load_balancers = {}
+        self.directories = {}
+        for interface in interfaces:
+            interface_type = interface.get('InterfaceType')
+            description = interface.get('Description', '')
+            self.by_type.setdefault(interface_type, []).append(interface)
+            instance_id = interface.get('Attachment', {}).get('InstanceId')
+            if instance_id:
+                self.by_instance.setdefault(instance_id, []).append(interface)
+            if interface.get('SubnetId'):
+                self.by_subnet.setdefault(interface['SubnetId'], []).append(interface)
+            for group in interface.get('Groups', []):
+                self.by_group.setdefault(group['GroupId'], []).append(interface)
+            if interface_type == NLB_INTERFACE_TYPE:
+                name = description.split('/')[1]
+                self.load_balancers.setdefault(name, {})[interface['AvailabilityZone']] = \
+                    interface['PrivateIpAddress'] + '/32'
+            elif DIRECTORY_MARKER in description and interface.get('Groups'):
+                self.directories.setdefault(
+                    directory_id(description), interface['Groups'][0]['GroupId']
+                )
+
+    def directory_group(self):
+        '''
+        Returns the group of the first directory service found, or None
+        '''
+        return next(iter(self.directories.values()), None)
@@ -0,0 +1,212 @@
+'''
+Snapshot of the EC2 resources read by the generators
+'''
+
+import boto3
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from sgautomation.interfaces import interface_filter
+from sgautomation.metrics import METRICS
+
+DEFAULT_REGION = 'eu-west-2'
+VPC_NAME_TEMPLATES = ['mgmt-{}', 'dmz-{}', 'appdata-{}']
+VPCS_KEY = 'Vpcs'
+SECURITY_GROUPS_KEY = 'SecurityGroups'
+NETWORK_INTERFACES_KEY = 'NetworkInterfaces'
+INSTANCES_KEY = 'Instances'
+RESERVATIONS_KEY = 'Reservations'
+# terminated instances linger in describe_instances for about an hour
+LIVE_INSTANCE_STATES = ('pending', 'running', 'stopping', 'stopped')
+
+
+def create_client(aws_profile, region=None, service='ec2'):
+    '''
+    Prepare boto3 client for interacting with AWS API
+    '''
+    if region is None: region = DEFAULT_REGION
+    session = boto3.Session(profile_name=aws_profile)
+    return METRICS.instrument_client(session.client(service, region_name=region))
+
+
+def env_vpc_names(env_name):
+    '''
+    Returns the names of the VPCs making up an environment, e.g. for
+    nonprod: mgmt-nonprod, dmz-nonprod and appdata-nonprod
+    '''
+    return [s.format(env_name) for s in VPC_NAME_TEMPLATES]
+
+
+def query_filter(filter_key, *values):
+    '''
+    Prepare a query filter to be passed to an aws api lookup
+    '''
+    return {'Filters': [{'Name': filter_key, 'Values': list(values)}]}
+
+
+def describe_all(client, operation, result_key, **kwargs):
+    '''
+    Runs a describe call through its paginator and returns every item
+    across all pages
+    '''
+    items = []
+    for page in client.get_paginator(operation).paginate(**kwargs):
+        items.extend(page.get(result_key, []))
+    logging.info('{} returned {} {}'.format(operation, len(items), result_key))
+    return items
+
+
+def describe_instances(client, **kwargs):
+    '''
+    Returns every instance matched by a paginated describe_instances,
+    flattened out of their reservations
+    '''
+    return [
+        instance
+        for reservation in describe_all(client, 'describe_instances', RESERVATIONS_KEY, **kwargs)
+        for instance in reservation.get(INSTANCES_KEY, [])
+    ]
+
+
+def inventory_kinds(security_groups=True, network_interfaces=True, instances=False):
+    '''
+    Returns the kinds of resource an inventory holds, VPCs always
+    '''
+    return (VPCS_KEY,) + tuple(
+        kind for kind, wanted in (
+            (SECURITY_GROUPS_KEY, security_groups),
+            (NETWORK_INTERFACES_KEY, network_interfaces),
+            (INSTANCES_KEY, instances),
+        ) if wanted
+    )
+
+
+def tag_dict(resource):
+    '''
+    Returns the Tags list of an EC2 resource as a dict
+    '''
+    return {tag['Key']: tag['Value'] for tag in resource.get('Tags', [])}
+
+
+class UnresolvedVpcError(ValueError):
+    '''
+    Raised when rows name VPC short codes that no VPC is tagged with
+    '''
+
+
+class VpcIndex(object):
+    '''
+    Indexes VPCs once by (tag name, value) and by id, so looking a VPC
+    up from a tag, or a tag from a VPC id, is a dictionary hit instead
+    of a scan that rebuilds every VPC's tag dict. Where several VPCs
+    share a tag value the first one listed wins, as it did in the scan.
+    '''
+    def __init__(self, vpcs):
+        self.by_tag = {}
+        self.tags = {}
+        for vpc in vpcs:
+            tags = tag_dict(vpc)
+            self.tags[vpc['VpcId']] = tags
+            for item in tags.items():
+                self.by_tag.setdefault(item, vpc['VpcId'])
+
+    def vpc_id(self, tag, value):
+        '''
+        Returns the id of the VPC whose tag has value, or None
+        '''
+        return self.by_tag.get((tag, value))
+
+    def tag(self, vpc_id, tag):
+        '''
+        Returns a tag of a VPC, or None
+        '''
+        return self.tags.get(vpc_id, {}).get(tag)
+
+
+class AwsInventory(object):
+    '''
+    Holds the VPCs, security groups and network interfaces for a run so
+    each describe call is made once and the result shared by every
+    generator that needs it.
+
+    vpcs holds every VPC in the region. env_vpcs holds the subset named
+    in vpc_names (all of them when vpc_names is None) and the security
+    groups, network interfaces and instances are those belonging to
+    env_vpcs. Only the load balancer and directory service interfaces
+    are read, as nothing else uses them. Instances are only read when
+    asked for; instances is None when they were not.
+
+    kinds lists what was read, see inventory_kinds. Security groups and
+    network interfaces that were not asked for are empty lists, so
+    kinds is what tells them apart from an estate that has none.
+    '''
+    def __init__(self, vpcs=None, security_groups=None, network_interfaces=None,
+                 vpc_names=None, client=None, instances=None, kinds=None):
+        self.client = client
+        self.vpc_names = vpc_names
+        if kinds is None:
+            kinds = inventory_kinds(instances=instances is not None)
+        self.kinds = tuple(kinds)
+        self.vpcs = vpcs or []
+        self.security_groups = security_groups or []
+        self.network_interfaces = network_interfaces or []
+        self.instances = instances
+        if vpc_names is None:
+            self.env_vpcs = list(self.vpcs)
+        else:
+            self.env_vpcs = [
+                vpc for vpc in self.vpcs
+                if tag_dict(vpc).get('Name') in vpc_names
+            ]
+        self.vpc_ids = [vpc['VpcId'] for vpc in self.env_vpcs]
+
+    @classmethod
+    def load(cls, client, vpc_names=None, security_groups=True,
+             network_interfaces=True, instances=False, max_workers=4):
+        '''
+        Fetches the inventory from AWS using paginated describe calls run
+        on a thread pool. Without vpc_names the calls run at once. With
+        vpc_names the VPCs are read first, since the other queries are
+        filtered on their ids, and the remaining calls then run
+        concurrently. Security groups, network interfaces and instances
+        are only described when asked for.
+        '''
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            vpcs = executor.submit(describe_all, client, 'describe_vpcs', VPCS_KEY)
+            if vpc_names is None:
+                filters = {}
+            else:
+                inventory = cls(vpcs.result(), vpc_names=vpc_names)
+                filters = query_filter('vpc-id', *inventory.vpc_ids)
+            groups = interfaces = instance_list = None
+            if security_groups and (vpc_names is None or inventory.vpc_ids):
+                groups = executor.submit(
+                    describe_all, client, 'describe_security_groups',
+                    SECURITY_GROUPS_KEY, **filters
+                )
+            if network_interfaces and (vpc_names is None or inventory.vpc_ids):
+                interfaces = executor.submit(
+                    describe_all, client, 'describe_network_interfaces',
+                    NETWORK_INTERFACES_KEY,
+                    Filters=filters.get('Filters', []) + [interface_filter()]
+                )
+            if instances and (vpc_names is None or inventory.vpc_ids):
+                instance_list = executor.submit(
+                    describe_instances, client, Filters=filters.get('Filters', []) + [
+                        {'Name': 'instance-state-name', 'Values': list(LIVE_INSTANCE_STATES)}
+                    ]
+                )
+            if instance_list is not None:
+                instance_list = instance_list.result()
+            elif instances:
+                instance_list = []
+            return cls(
+                vpcs=vpcs.result(),
+                security_groups=groups.result() if groups else [],
+                network_interfaces=interfaces.result() if interfaces else [],
+                vpc_names=vpc_names,
+                client=client,
+                instances=instance_list,
+                kinds=inventory_kinds(security_groups, network_interfaces, instances),
+            )
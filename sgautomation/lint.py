@@ -0,0 +1,464 @@
+'''
+Checks the creation, ingress and egress sheets for rows that would be
+skipped, would break a deployment or look unintended, reporting every
+problem in one pass instead of one at a time during generation
+'''
+
+import csv
+import ipaddress
+import json
+
+from collections import namedtuple
+
+from sgautomation.cidrs import NETWORK_MASKS, parse_ipv4
+from sgautomation.egress import EgressGenerator
+from sgautomation.groups import DEFAULT_VPCSHORTCODE_TAG
+from sgautomation.ingress import IngressGenerator
+from sgautomation.inventory import DEFAULT_REGION, VpcIndex
+from sgautomation.names import definition_group_name, generate_group_name
+from sgautomation.rules import (
+    ALL_PORTS, MAX_PORT, MIN_PORT, EgressRule, GroupDefinition, IngressRule,
+    RowValidationError, normalise_protocol, parse_ports
+)
+
+ERROR = 'error'
+WARNING = 'warning'
+NAMED_PROTOCOLS = ('tcp', 'udp', 'icmp', 'icmpv6', '-1')
+MAX_PROTOCOL_NUMBER = 255
+PORT_PROTOCOLS = ('tcp', 'udp')
+OPTIONAL_FIELDS = ('description',)
+# the field identifying a row in findings, the first one a sheet has
+ROW_ID_FIELDS = ('rule_id', 'name')
+
+Finding = namedtuple('Finding', ('sheet', 'line', 'row_id', 'check', 'severity', 'message'))
+# the parts of a rule EgressGenerator.get_load_balancer_reference reads
+LoadBalancerPeer = namedtuple('LoadBalancerPeer', ('peer', 'peer_type'))
+
+
+def distinct(values, check):
+    '''
+    Runs check once per distinct value and returns {value: result}.
+    Sheets repeat a small set of names, protocols, ports and CIDRs many
+    times, so the checks work on the distinct values of a column and
+    rows only look their result up.
+    '''
+    return {value: check(value) for value in set(values)}
+
+
+def protocol_problem(protocol):
+    '''
+    Returns why a normalised protocol cannot be used, or None
+    '''
+    if not protocol:
+        return 'No protocol'
+    if protocol in NAMED_PROTOCOLS:
+        return None
+    if protocol.isdigit() and int(protocol) <= MAX_PROTOCOL_NUMBER:
+        return None
+    return 'Unknown protocol {!r}'.format(protocol)
+
+
+def port_range(ports):
+    '''
+    Returns ((from_port, to_port), None) for (from port, to port,
+    protocol) values, or (None, problem)
+    '''
+    from_port, to_port, protocol = ports
+    try:
+        return parse_ports(from_port, to_port, protocol), None
+    except RowValidationError as error:
+        return None, str(error)
+
+
+def check_cidr(cidr):
+    '''
+    Returns (prefix length, None) for a usable CIDR peer, or (prefix
+    length or None, (severity, problem)). The generators write CIDRs as
+    CidrIp, which only takes IPv4.
+    '''
+    network = parse_ipv4(cidr)
+    if network is not None:
+        value, prefix = network
+        if value & NETWORK_MASKS[prefix] == value:
+            return prefix, None
+    try:
+        network = ipaddress.ip_network(cidr)
+    except ValueError:
+        try:
+            network = ipaddress.ip_network(cidr, strict=False)
+        except ValueError:
+            return None, (ERROR, 'Malformed CIDR {!r}'.format(cidr))
+        return network.prefixlen, (
+            WARNING, 'CIDR {} has host bits set, it covers {}'.format(cidr, network)
+        )
+    if network.version != 4:
+        return network.prefixlen, (ERROR, 'IPv6 CIDR {} cannot be written as CidrIp'.format(cidr))
+    return network.prefixlen, None
+
+
+def covers_every_port(protocol, ports):
+    if protocol == '-1':
+        return True
+    return protocol in PORT_PROTOCOLS and ports in ((ALL_PORTS, ALL_PORTS), (MIN_PORT, MAX_PORT))
+
+
+class SheetColumns(object):
+    '''
+    A sheet read into one list per record field rather than one record
+    per row, with cells stripped and the sheet line of each row in
+    lines. Columns are found by header name as RuleSheetReader finds
+    them; a sheet missing a required column, or one with no header, is
+    reported as a finding and has no rows.
+    '''
+    def __init__(self, filename, record_type):
+        self.filename = filename
+        self.record_type = record_type
+        self.columns = {}
+        self.lines = []
+        self.row_ids = []
+        self.findings = []
+
+    @classmethod
+    def read(cls, filename, record_type):
+        sheet = cls(filename, record_type)
+        with open(filename, newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            header = next(reader, None)
+            if not header:
+                sheet.add(1, '', 'empty_sheet', ERROR, 'The sheet has no header row')
+                return sheet
+            positions = sheet.column_positions(header)
+            if positions is None:
+                return sheet
+            width = len(header)
+            columns = {field: [] for field in positions}
+            # the columns are filled straight from the reader; holding
+            # every row and transposing them costs more than the parse
+            cells = [(columns[field].append, index) for field, index in positions.items()]
+            lines = []
+            lengths = []
+            for row in reader:
+                if not (row and row[0].strip()) and not ''.join(row).strip():
+                    continue
+                if len(row) != width:
+                    lengths.append((len(lines), len(row)))
+                    row = (row + [''] * width)[:width]
+                # the line the row ends on, quoted cells can span lines
+                lines.append(reader.line_num)
+                for append, index in cells:
+                    append(row[index].strip())
+        sheet.lines = lines
+        sheet.columns = columns
+        id_field = next(field for field in ROW_ID_FIELDS if field in sheet.columns)
+        sheet.row_ids = sheet.columns[id_field]
+        for index, length in lengths:
+            sheet.add_row(index, 'row_length', WARNING,
+                          'Row has {} columns, the header has {}'.format(length, width))
+        return sheet
+
+    def column_positions(self, header):
+        '''
+        Maps each required record field to its column index, or returns
+        None and records a finding when one is missing
+        '''
+        names = [name.strip().upper() for name in header]
+        positions = {}
+        missing = []
+        for field, aliases in self.record_type.columns.items():
+            if field in OPTIONAL_FIELDS:
+                continue
+            found = [alias for alias in aliases if alias in names]
+            if found:
+                positions[field] = names.index(found[0])
+            else:
+                missing.append(aliases[0])
+        if missing:
+            self.add(1, '', 'missing_columns', ERROR,
+                     'No column for {}'.format(', '.join(sorted(missing))))
+            return None
+        return positions
+
+    def column(self, field):
+        return self.columns[field]
+
+    def add(self, line, row_id, check, severity, message):
+        self.findings.append(Finding(self.filename, line, row_id, check, severity, message))
+
+    def add_row(self, index, check, severity, message):
+        '''
+        Records a finding against the index'th row
+        '''
+        self.add(self.lines[index], self.row_ids[index], check, severity, message)
+
+
+def rows_with(column, values):
+    '''
+    Returns the indexes of the rows whose value is one of values. A
+    column holding none of them, the usual case, is not scanned in Python.
+    '''
+    present = set(values).intersection(column)
+    if not present:
+        return []
+    return [index for index, value in enumerate(column) if value in present]
+
+
+def check_rule_ids(sheet):
+    '''
+    Rule ids must be integers and unique, as they name the generated
+    resources
+    '''
+    first_rows = {}
+    for index, raw_id in enumerate(sheet.column('rule_id')):
+        try:
+            rule_id = int(raw_id)
+        except ValueError:
+            sheet.add_row(index, 'invalid_rule_id', ERROR, 'Invalid rule id {!r}'.format(raw_id))
+            continue
+        first_row = first_rows.setdefault(rule_id, index)
+        if first_row != index:
+            sheet.add_row(index, 'duplicate_rule_id', ERROR,
+                          'Rule id {} is already used on line {}'.format(
+                              rule_id, sheet.lines[first_row]))
+
+
+def check_rules(sheet):
+    '''
+    Checks each rule's group, protocol, ports and peer, and flags rules
+    open to every address on every port. Each check works out which of a
+    column's distinct values are bad and then finds the rows holding them.
+    '''
+    groups = sheet.column('group')
+    peers = sheet.column('peer')
+    peer_types = sheet.column('peer_type')
+    protocols = distinct(sheet.column('protocol'), normalise_protocol)
+    protocol_column = list(map(protocols.__getitem__, sheet.column('protocol')))
+    from_ports, to_ports = sheet.column('from_port'), sheet.column('to_port')
+    protocol_problems = {
+        protocol: problem for protocol, problem in
+        distinct(protocol_column, protocol_problem).items() if problem
+    }
+    ranges = distinct(zip(from_ports, to_ports, protocol_column), port_range)
+    port_problems = {ports: problem for ports, (_, problem) in ranges.items() if problem}
+    bad_peer_types = {
+        peer_type for peer_type in set(peer_types)
+        if not sheet.record_type.valid_peer_type(peer_type)
+    }
+    cidrs = distinct(
+        {peer for peer, peer_type in zip(peers, peer_types) if peer_type == 'CIDR' and peer},
+        check_cidr
+    )
+    # malformed CIDRs and those covering every address
+    flagged_cidrs = {cidr for cidr, (prefix, problem) in cidrs.items() if problem or prefix == 0}
+
+    for index in rows_with(groups, ('',)):
+        sheet.add_row(index, 'no_group', ERROR, 'No security group name')
+    for index in rows_with(protocol_column, protocol_problems):
+        sheet.add_row(index, 'invalid_protocol', ERROR, protocol_problems[protocol_column[index]])
+    if port_problems:
+        for index, ports in enumerate(zip(from_ports, to_ports, protocol_column)):
+            if ports in port_problems:
+                sheet.add_row(index, 'invalid_ports', ERROR, port_problems[ports])
+    for index in rows_with(peer_types, bad_peer_types):
+        sheet.add_row(index, 'invalid_peer_type', ERROR,
+                      'Unknown type {!r}'.format(peer_types[index]))
+    for index in rows_with(peers, ('',)):
+        if peer_types[index] not in bad_peer_types:
+            sheet.add_row(index, 'no_peer', ERROR, 'No {} reference'.format(peer_types[index]))
+    for index in rows_with(peers, flagged_cidrs):
+        if peer_types[index] != 'CIDR':
+            continue
+        prefix, problem = cidrs[peers[index]]
+        if problem:
+            sheet.add_row(index, 'invalid_cidr', problem[0], problem[1])
+        protocol = protocol_column[index]
+        ports = ranges[(from_ports[index], to_ports[index], protocol)][0]
+        if prefix == 0 and covers_every_port(protocol, ports):
+            sheet.add_row(index, 'any_any', WARNING,
+                          'Allows {} traffic on every port to or from {}'.format(
+                              'all' if protocol == '-1' else protocol, peers[index]))
+
+
+def check_references(sheet, generator):
+    '''
+    Checks that the groups, VPCs and load balancers rules refer to can be
+    found, using the generator's lookups so the answer matches what
+    generation would do. Rows that would be skipped are errors.
+    '''
+    def group_found(name):
+        return not name or generator.get_security_group_id(generate_group_name(name)) is not None
+
+    def peer_found(peer):
+        # invalid peer types are already reported by check_rules
+        if not peer.peer or not sheet.record_type.valid_peer_type(peer.peer_type):
+            return True
+        if peer.peer_type == 'Group':
+            return group_found(peer.peer)
+        if peer.peer_type == 'VPC':
+            return peer.peer.lower() in generator.vpc_cidrs
+        if peer.peer_type.startswith('LB_'):
+            name, az = generator.get_load_balancer_reference(peer)
+            return az in generator.nlb_cidrs.get(name, {})
+        return True
+
+    groups = sheet.column('group')
+    peers = sheet.column('peer')
+    peer_types = sheet.column('peer_type')
+    unknown_groups = {group for group in set(groups) if not group_found(group)}
+    unknown_peers = {
+        peer for peer in set(zip(peers, peer_types)) if not peer_found(LoadBalancerPeer(*peer))
+    }
+    for index in rows_with(groups, unknown_groups):
+        sheet.add_row(index, 'unknown_group', ERROR,
+                      'Security group {} not found'.format(groups[index]))
+    if unknown_peers:
+        for index, peer in enumerate(zip(peers, peer_types)):
+            if peer in unknown_peers:
+                sheet.add_row(index, 'unknown_peer', ERROR, '{1} {0} not found'.format(*peer))
+
+
+def check_definitions(sheet, vpc_index=None, vpc_tag=None, env_name=None):
+    '''
+    Group names must be given and unique once cleaned up, as they name
+    the generated resources and exports, and each VPC code must match a
+    VPC when a VPC index is given
+    '''
+    first_rows = {}
+    for index, name in enumerate(sheet.column('name')):
+        if not name:
+            sheet.add_row(index, 'no_group', ERROR, 'No security group name')
+            continue
+        group_name = definition_group_name(name)
+        first_row = first_rows.setdefault(group_name, index)
+        if first_row != index:
+            sheet.add_row(index, 'duplicate_group', ERROR,
+                          'Group {} is already defined on line {}'.format(
+                              group_name, sheet.lines[first_row]))
+    vpc_codes = sheet.column('vpc_code')
+    vpc_ids = {}
+    if vpc_index is not None:
+        vpc_ids = distinct(
+            vpc_codes,
+            lambda code: vpc_index.vpc_id(vpc_tag, '{}-{}'.format(code.lower(), env_name.lower()))
+        )
+    for index, vpc_code in enumerate(vpc_codes):
+        if not vpc_code:
+            sheet.add_row(index, 'no_vpc_code', ERROR, 'No vpc code')
+        elif vpc_index is not None and vpc_ids[vpc_code] is None:
+            sheet.add_row(index, 'unknown_vpc', ERROR, 'No VPC tagged {} = {}-{}'.format(
+                vpc_tag, vpc_code.lower(), env_name.lower()))
+
+
+def lint_rule_sheet(filename, record_type, generator=None):
+    '''
+    Returns the SheetColumns of an ingress or egress sheet with its
+    findings. References are only checked when a generator built from
+    the inventory is given.
+    '''
+    sheet = SheetColumns.read(filename, record_type)
+    if sheet.lines:
+        check_rule_ids(sheet)
+        check_rules(sheet)
+        if generator is not None:
+            check_references(sheet, generator)
+    return sheet
+
+
+def lint_creation_sheet(filename, record_type, vpc_index=None, vpc_tag=None, env_name=None):
+    '''
+    Returns the SheetColumns of the group creation sheet with its findings
+    '''
+    sheet = SheetColumns.read(filename, record_type)
+    if sheet.lines:
+        check_definitions(sheet, vpc_index, vpc_tag, env_name)
+    return sheet
+
+
+class LintReport(object):
+    '''
+    Every finding from the sheets linted, ordered by sheet and line
+    '''
+    def __init__(self):
+        self.rows = {}
+        self.findings = []
+
+    def add(self, sheet):
+        self.rows[sheet.filename] = len(sheet.lines)
+        self.findings.extend(sorted(sheet.findings, key=lambda finding: finding.line))
+
+    def count(self, severity):
+        return sum(1 for finding in self.findings if finding.severity == severity)
+
+    def failed(self, strict=False):
+        '''
+        True if there are errors, or any findings at all when strict
+        '''
+        return bool(self.findings) if strict else self.count(ERROR) > 0
+
+    def summary(self):
+        return '{} errors and {} warnings in {} rows'.format(
+            self.count(ERROR), self.count(WARNING), sum(self.rows.values())
+        )
+
+    def describe(self):
+        '''
+        Returns one line per finding
+        '''
+        return [
+            '{} line {}{}: {} {}: {}'.format(
+                finding.sheet, finding.line,
+                ' ({})'.format(finding.row_id) if finding.row_id else '',
+                finding.severity, finding.check, finding.message
+            )
+            for finding in self.findings
+        ]
+
+    def to_dict(self):
+        checks = {}
+        for finding in self.findings:
+            checks[finding.check] = checks.get(finding.check, 0) + 1
+        return {
+            'summary': self.summary(),
+            'rows': self.rows,
+            'errors': self.count(ERROR),
+            'warnings': self.count(WARNING),
+            'checks': checks,
+            'findings': [finding._asdict() for finding in self.findings],
+        }
+
+    def write(self, path):
+        with open(path, 'w') as report_file:
+            json.dump(self.to_dict(), report_file, indent=1, sort_keys=True)
+
+
+def lint_sheets(creation_file=None, ingress_file=None, egress_file=None,
+                inventory=None, env_name='', region=DEFAULT_REGION):
+    '''
+    Lints whichever sheets are given and returns a LintReport. With an
+    inventory, VPC codes, groups, VPCs and load balancers are looked up
+    too; groups defined in the creation sheet count as found, as they
+    do when the sheets are generated together.
+    '''
+    report = LintReport()
+    planned_groups = {}
+    if creation_file:
+        sheet = lint_creation_sheet(
+            creation_file, GroupDefinition,
+            VpcIndex(inventory.vpcs) if inventory is not None else None,
+            DEFAULT_VPCSHORTCODE_TAG, env_name
+        )
+        if sheet.lines:
+            planned_groups = {
+                definition_group_name(name): name for name in sheet.column('name') if name
+            }
+        report.add(sheet)
+    for filename, record_type, generator_class in (
+            (ingress_file, IngressRule, IngressGenerator),
+            (egress_file, EgressRule, EgressGenerator)):
+        if not filename:
+            continue
+        generator = None
+        if inventory is not None:
+            generator = generator_class([], region=region, env_name=env_name,
+                                        inventory=inventory, planned_groups=planned_groups)
+        report.add(lint_rule_sheet(filename, record_type, generator))
+    return report
@@ -0,0 +1,182 @@
+'''
+Incremental template writing driven by a manifest of content hashes
+'''
+
+import hashlib
+import json
+import logging
+import os
+
+from sgautomation.emitter import get_emitter
+from sgautomation.metrics import METRICS
+
+MANIFEST_FILE_NAME = '{}.manifest.json'
+MANIFEST_VERSION = 2
+RESOURCES_KEY = 'Resources'
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def resource_hash(resource):
+    return content_hash(json.dumps(resource, sort_keys=True, default=str))
+
+
+def template_hash(template, resource_hashes):
+    '''
+    Hashes a template from its resource hashes and the rest of its
+    content, so the template does not have to be serialized to find out
+    whether it needs writing
+    '''
+    parts = [json.dumps(
+        {key: value for key, value in template.items() if key != RESOURCES_KEY},
+        sort_keys=True, default=str
+    )]
+    parts.extend(
+        '{}={}'.format(name, resource_hashes[name]) for name in sorted(resource_hashes)
+    )
+    return content_hash('\n'.join(parts))
+
+
+class TemplateChange(object):
+    '''
+    The resources added, removed and modified in one template since the
+    previous run
+    '''
+    def __init__(self, template, added=(), removed=(), modified=()):
+        self.template = template
+        self.added = sorted(added)
+        self.removed = sorted(removed)
+        self.modified = sorted(modified)
+
+    def summary(self):
+        return '{}: {} added, {} removed, {} modified'.format(
+            self.template, len(self.added), len(self.removed), len(self.modified)
+        )
+
+
+class ChangeSet(object):
+    '''
+    What an incremental run changed across a family of templates
+    '''
+    def __init__(self):
+        self.changed = []
+        self.unchanged = []
+        self.deleted = []
+
+    def summary(self):
+        lines = [change.summary() for change in self.changed]
+        lines.extend(
+            '{}: no longer generated, {} resources removed'.format(
+                change.template, len(change.removed)
+            )
+            for change in self.deleted
+        )
+        lines.append('{} templates changed, {} unchanged'.format(
+            len(self.changed) + len(self.deleted), len(self.unchanged)
+        ))
+        return '\n'.join(lines)
+
+
+class TemplateWriter(object):
+    '''
+    Writes a family of templates (e.g. all GeneratedSecurityGroupsIngress
+    templates) to template_path.
+
+    In incremental mode a manifest of the hash of every template and of
+    every resource in it is kept beside the templates. Templates whose
+    content has not changed since the previous run are not rewritten,
+    and finish() returns a ChangeSet of the rules added, removed and
+    modified per template. Templates that are no longer generated are
+    reported but left on disk.
+
+    Templates are streamed to disk by the emitter, YAML unless another
+    is given; the emitter also sets the file extension.
+    '''
+    def __init__(self, template_path, template_prefix, incremental=False, emitter=None):
+        self.template_path = template_path
+        self.incremental = incremental
+        self.emitter = emitter or get_emitter()
+        self.manifest_path = os.path.join(
+            template_path, MANIFEST_FILE_NAME.format(template_prefix)
+        )
+        self.previous = self.load_manifest() if incremental else {}
+        self.current = {}
+        self.changeset = ChangeSet()
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get('version') != MANIFEST_VERSION:
+            logging.warning('Ignoring manifest {} with unknown version'.format(self.manifest_path))
+            return {}
+        return manifest.get('templates', {})
+
+    def write(self, template_name, template):
+        '''
+        Writes template to template_name, with the extension replaced by
+        the emitter's, unless it is unchanged since the previous
+        incremental run. Returns True if the file was written.
+        '''
+        template_name = self.emitter.file_name(template_name)
+        key = os.path.basename(template_name)
+        resources = {
+            name: resource_hash(resource)
+            for name, resource in template.get(RESOURCES_KEY, {}).items()
+        }
+        entry = {
+            'hash': template_hash(template, resources),
+            'resources': resources,
+        }
+        self.current[key] = entry
+        previous = self.previous.get(key)
+        if self.incremental and previous and previous['hash'] == entry['hash'] \
+                and os.path.exists(template_name):
+            self.changeset.unchanged.append(key)
+            METRICS.count('templates_total', outcome='unchanged')
+            logging.info('{} is unchanged'.format(template_name))
+            return False
+        if self.incremental:
+            self.changeset.changed.append(self.compare(key, previous, entry))
+        with open(template_name, 'w+') as template_file:
+            logging.info('Saving {} to disk.'.format(template_name))
+            self.emitter.dump(template, template_file)
+            METRICS.set('template_bytes', template_file.tell(), template=key)
+        METRICS.count('templates_total', outcome='written')
+        return True
+
+    def compare(self, key, previous, entry):
+        before = (previous or {}).get('resources', {})
+        after = entry['resources']
+        return TemplateChange(
+            key,
+            added=[name for name in after if name not in before],
+            removed=[name for name in before if name not in after],
+            modified=[
+                name for name in after
+                if name in before and before[name] != after[name]
+            ],
+        )
+
+    def finish(self):
+        '''
+        Saves the manifest and returns the ChangeSet, or None when not
+        running incrementally
+        '''
+        if not self.incremental:
+            return None
+        for key in sorted(set(self.previous) - set(self.current)):
+            self.changeset.deleted.append(TemplateChange(
+                key, removed=self.previous[key].get('resources', {})
+            ))
+            logging.warning('{} is no longer generated'.format(key))
+        with open(self.manifest_path, 'w') as manifest_file:
+            json.dump({
+                'version': MANIFEST_VERSION,
+                'templates': self.current,
+            }, manifest_file, indent=1, sort_keys=True)
+        logging.info('Changes since last run:\n{}'.format(self.changeset.summary()))
+        return self.changeset
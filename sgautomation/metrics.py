@@ -0,0 +1,183 @@
+'''
+Run metrics: phase timings, AWS call counts and latency, rows processed
+and skipped, lookup cache hits and bytes written
+'''
+
+import json
+import threading
+import time
+
+from contextlib import contextmanager
+
+METRIC_PREFIX = 'sgautomation_'
+JSON_FORMAT = 'json'
+PROMETHEUS_FORMAT = 'prometheus'
+FORMATS = (JSON_FORMAT, PROMETHEUS_FORMAT)
+# name: (prometheus type, help)
+DESCRIPTIONS = {
+    'phase_seconds': ('gauge', 'Wall clock time spent in each phase'),
+    'aws_calls_total': ('counter', 'AWS API calls made'),
+    'aws_call_errors_total': ('counter', 'AWS API calls that returned an error'),
+    'aws_call_seconds': ('summary', 'Latency of AWS API calls'),
+    'rows_total': ('counter', 'Sheet rows by outcome'),
+    'rows_skipped_total': ('counter', 'Sheet rows skipped by reason'),
+    'resolver_lookups_total': ('counter', 'Group name lookups by cache result'),
+    'template_bytes': ('gauge', 'Bytes written per template'),
+    'templates_total': ('counter', 'Templates by outcome'),
+    'inventory_cache_total': ('counter', 'Cached inventory snapshots used or missed'),
+}
+CALL_START = 'sgautomation_call_start'
+
+
+def labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def prometheus_labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in key
+    ) + '}'
+
+
+class Metrics(object):
+    '''
+    Collects the metrics of one run. Disabled by default, in which case
+    every method returns straight away, so the calls can stay in the
+    generators' code paths.
+
+    Counters and gauges are kept per name and label set; observations
+    (phase times, call latencies) keep a count and a sum. Updates are
+    locked, as inventories are loaded and rules applied from thread pools.
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.values = {}
+        self.observations = {}
+
+    def enable(self):
+        self.enabled = True
+        self.reset()
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = labels_key(labels)
+        with self.lock:
+            series = self.values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.values.setdefault(name, {})[labels_key(labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = labels_key(labels)
+        with self.lock:
+            series = self.observations.setdefault(name, {})
+            observation = series.setdefault(key, [0, 0.0])
+            observation[0] += 1
+            observation[1] += seconds
+
+    @contextmanager
+    def phase(self, name, **labels):
+        '''
+        Times the body of a with block as phase name
+        '''
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('phase_seconds', time.perf_counter() - start, phase=name, **labels)
+
+    def instrument_client(self, client):
+        '''
+        Times every API call a botocore client makes, including each
+        page fetched by a paginator
+        '''
+        events = getattr(getattr(client, 'meta', None), 'events', None)
+        if events is None:
+            return client
+        # timing starts at parameter building, which every call passes
+        # through even when a stub answers it in before-call
+        events.register('before-parameter-build', self.before_call)
+        events.register('after-call', self.after_call)
+        return client
+
+    def before_call(self, context=None, **kwargs):
+        if self.enabled and context is not None:
+            context[CALL_START] = time.perf_counter()
+
+    def after_call(self, http_response=None, parsed=None, model=None, context=None, **kwargs):
+        if not self.enabled or context is None or CALL_START not in context:
+            return
+        operation = model.name if model is not None else 'unknown'
+        self.aws_call(operation, time.perf_counter() - context.pop(CALL_START),
+                      error=bool(parsed and 'Error' in parsed))
+
+    def aws_call(self, operation, seconds, error=False):
+        self.count('aws_calls_total', operation=operation)
+        self.observe('aws_call_seconds', seconds, operation=operation)
+        if error:
+            self.count('aws_call_errors_total', operation=operation)
+
+    def to_dict(self):
+        report = {
+            'started': self.started,
+            'duration': time.time() - self.started,
+            'metrics': {},
+        }
+        for name, series in sorted(self.values.items()):
+            report['metrics'][name] = [
+                dict(key, value=value) for key, value in sorted(series.items())
+            ]
+        for name, series in sorted(self.observations.items()):
+            report['metrics'][name] = [
+                dict(key, count=count, sum=round(total, 6))
+                for key, (count, total) in sorted(series.items())
+            ]
+        return report
+
+    def prometheus(self):
+        '''
+        Returns the metrics in the Prometheus text exposition format
+        '''
+        lines = []
+        for name in sorted(set(self.values).union(self.observations)):
+            metric = METRIC_PREFIX + name
+            metric_type, help_text = DESCRIPTIONS.get(name, ('untyped', name))
+            lines.append('# HELP {} {}'.format(metric, help_text))
+            lines.append('# TYPE {} {}'.format(metric, metric_type))
+            for key, value in sorted(self.values.get(name, {}).items()):
+                lines.append('{}{} {}'.format(metric, prometheus_labels(key), value))
+            for key, (count, total) in sorted(self.observations.get(name, {}).items()):
+                if metric_type == 'summary':
+                    lines.append('{}_count{} {}'.format(metric, prometheus_labels(key), count))
+                    lines.append('{}_sum{} {:.6f}'.format(metric, prometheus_labels(key), total))
+                else:
+                    lines.append('{}{} {:.6f}'.format(metric, prometheus_labels(key), total))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, output_format=JSON_FORMAT):
+        with open(path, 'w') as metrics_file:
+            if output_format == PROMETHEUS_FORMAT:
+                metrics_file.write(self.prometheus())
+            else:
+                json.dump(self.to_dict(), metrics_file, indent=1, sort_keys=True)
+
+
+METRICS = Metrics()
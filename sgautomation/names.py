@@ -0,0 +1,69 @@
+'''
+Canonical forms of the group names used in the sheets and in EC2
+'''
+
+import functools
+import re
+
+# rule sheets repeat the same few hundred names thousands of times, so
+# each canonical form is worked out once and then served from a cache;
+# the bound keeps memory flat for very large or generated sheets
+NAME_CACHE_SIZE = 8192
+NON_ALPHANUMERIC = re.compile(r'[^a-zA-Z0-9]')
+NON_KEY_CHARACTERS = re.compile(r'[^a-z0-9]')
+TEMP_MARKER = 'temp'
+SSM_MARKER = 'SSM'
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def generate_group_name(raw_name):
+    '''
+    Prepares a logical group name removing whitespace and
+    putting into title case. Temp and SSM names are used as given.
+    '''
+    if TEMP_MARKER in raw_name.lower():
+        return raw_name
+    elif SSM_MARKER in raw_name:
+        return raw_name
+    return NON_ALPHANUMERIC.sub('', raw_name.lower().title())
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def definition_group_name(raw_name):
+    '''
+    The logical name of a group in the creation sheet: title case with
+    everything but letters and digits removed, temp and SSM names included
+    '''
+    return NON_ALPHANUMERIC.sub('', raw_name.lower().title())
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def generate_short_code(raw_name):
+    '''
+    Returns the first part of the group name from the raw input
+    '''
+    return raw_name.split('_')[0].split(' ')[0].lower()
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def group_key(name):
+    '''
+    Returns a case and punctuation insensitive key for a group name, so
+    that e.g. Mgt_RHEL_instances and MgtRhelInstances compare equal
+    '''
+    return NON_KEY_CHARACTERS.sub('', name.lower())
+
+
+CACHED_FUNCTIONS = (generate_group_name, definition_group_name, generate_short_code, group_key)
+
+
+def cache_info():
+    '''
+    Returns the hits, misses and size of each name cache
+    '''
+    return {function.__name__: function.cache_info()._asdict() for function in CACHED_FUNCTIONS}
+
+
+def clear_caches():
+    for function in CACHED_FUNCTIONS:
+        function.cache_clear()
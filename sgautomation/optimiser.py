@@ -0,0 +1,238 @@
+'''
+Removes redundant rules before they are added to templates
+'''
+
+import copy
+import ipaddress
+import json
+import logging
+
+from sgautomation.rules import ALL_PORTS, MAX_PORT, MIN_PORT
+
+PORT_PROTOCOLS = ('tcp', 'udp')
+PEER_PROPERTIES = ('SourceSecurityGroupId', 'DestinationSecurityGroupId', 'CidrIp')
+MAX_DESCRIPTION_LENGTH = 255
+
+
+def freeze(value):
+    '''
+    Returns a hashable form of a property value, which may be a
+    reference such as {'Fn::ImportValue': ...}
+    '''
+    if isinstance(value, dict):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def port_span(properties):
+    '''
+    Returns (from port, to port) of a tcp/udp rule, with the all ports
+    sentinel as the range it stands for
+    '''
+    if properties['FromPort'] == ALL_PORTS:
+        return MIN_PORT, MAX_PORT
+    return properties['FromPort'], properties['ToPort']
+
+
+def peer_of(properties):
+    for name in PEER_PROPERTIES:
+        if name in properties:
+            return name, freeze(properties[name])
+    return None, None
+
+
+class OptimisationReport(object):
+    '''
+    Counts of the rules removed by each optimisation, and which rules
+    each surviving rule absorbed
+    '''
+    def __init__(self, rules_in=0):
+        self.rules_in = rules_in
+        self.rules_out = rules_in
+        self.duplicates = 0
+        self.port_merges = 0
+        self.cidr_merges = 0
+        self.merged = {}
+
+    def record(self, kept, absorbed):
+        self.merged.setdefault(kept.resource_name, []).extend(
+            rule.resource_name for rule in absorbed
+        )
+
+    def summary(self):
+        return (
+            '{} rules in, {} out: {} duplicates removed, {} saved by merging '
+            'port ranges, {} saved by collapsing CIDRs'.format(
+                self.rules_in, self.rules_out, self.duplicates,
+                self.port_merges, self.cidr_merges
+            )
+        )
+
+
+class RuleOptimiser(object):
+    '''
+    Shrinks a list of CompiledRules without changing the traffic they
+    allow:
+    1. exact duplicates (same group, peer, protocol and ports) are dropped
+    2. tcp/udp rules for the same group, peer and protocol with
+       overlapping or adjacent port ranges are merged into one range;
+       a rule for all ports (-1) counts as 0-65535
+    3. CIDR rules for the same group, protocol and ports are reduced
+       with ipaddress.collapse_addresses
+    The first rule of each merged set (in sheet order) is kept, with its
+    resource name and template bucket, and its description lists the
+    rule ids it absorbed.
+    '''
+    def optimise(self, rules):
+        '''
+        Returns (optimised rules, OptimisationReport)
+        '''
+        report = OptimisationReport(len(rules))
+        rules = self.remove_duplicates(rules, report)
+        rules = self.merge_port_ranges(rules, report)
+        rules = self.collapse_cidrs(rules, report)
+        report.rules_out = len(rules)
+        for kept, absorbed in sorted(report.merged.items()):
+            logging.info('Rule {} now covers {}'.format(kept, ', '.join(absorbed)))
+        return rules, report
+
+    def rule_key(self, rule, *extra):
+        properties = rule.resource['Properties']
+        return (
+            rule.resource['Type'], freeze(properties['GroupId']),
+            properties['IpProtocol']
+        ) + peer_of(properties) + extra
+
+    def remove_duplicates(self, rules, report):
+        seen = {}
+        kept = []
+        for rule in rules:
+            properties = rule.resource['Properties']
+            key = self.rule_key(rule, properties['FromPort'], properties['ToPort'])
+            if key in seen:
+                report.duplicates += 1
+                report.record(seen[key], [rule])
+                continue
+            seen[key] = rule
+            kept.append(rule)
+        return kept
+
+    def merge_port_ranges(self, rules, report):
+        sets = self.group_rules(
+            rules, lambda rule: rule.resource['Properties']['IpProtocol'] in PORT_PROTOCOLS,
+            self.rule_key
+        )
+        replacements = {}
+        for members in sets:
+            ordered = sorted(members, key=lambda item: (
+                port_span(item[1].resource['Properties']), item[0]
+            ))
+            run = [ordered[0]]
+            end = port_span(ordered[0][1].resource['Properties'])[1]
+            for item in ordered[1:]:
+                from_port, to_port = port_span(item[1].resource['Properties'])
+                if from_port <= end + 1:
+                    run.append(item)
+                    end = max(end, to_port)
+                    continue
+                self.merge_run(run, replacements, report)
+                run = [item]
+                end = to_port
+            self.merge_run(run, replacements, report)
+        return self.apply(rules, replacements)
+
+    def merge_run(self, run, replacements, report):
+        if len(run) < 2:
+            return
+        run = sorted(run)
+        position, first = run[0]
+        absorbed = [rule for _, rule in run[1:]]
+        resource = copy.deepcopy(first.resource)
+        properties = resource['Properties']
+        spans = [port_span(rule.resource['Properties']) for _, rule in run]
+        properties['FromPort'] = min(from_port for from_port, _ in spans)
+        properties['ToPort'] = max(to_port for _, to_port in spans)
+        properties['Description'] = self.merged_description(first, absorbed)
+        replacements[position] = first._replace(resource=resource)
+        for other, _ in run[1:]:
+            replacements[other] = None
+        report.port_merges += len(absorbed)
+        report.record(first, absorbed)
+
+    def collapse_cidrs(self, rules, report):
+        def key(rule):
+            properties = rule.resource['Properties']
+            return (
+                rule.resource['Type'], freeze(properties['GroupId']),
+                properties['IpProtocol'], properties['FromPort'], properties['ToPort']
+            )
+        sets = self.group_rules(rules, self.has_ipv4_cidr, key)
+        replacements = {}
+        for members in sets:
+            networks = [
+                (ipaddress.ip_network(rule.resource['Properties']['CidrIp'], strict=False), position, rule)
+                for position, rule in members
+            ]
+            collapsed = list(ipaddress.collapse_addresses(network for network, _, _ in networks))
+            if len(collapsed) == len(networks):
+                continue
+            for network in collapsed:
+                covered = sorted(
+                    (position, rule) for member, position, rule in networks
+                    if member.subnet_of(network)
+                )
+                position, first = covered[0]
+                absorbed = [rule for _, rule in covered[1:]]
+                resource = copy.deepcopy(first.resource)
+                resource['Properties']['CidrIp'] = str(network)
+                if absorbed:
+                    resource['Properties']['Description'] = self.merged_description(first, absorbed)
+                    report.record(first, absorbed)
+                replacements[position] = first._replace(resource=resource)
+                for other, _ in covered[1:]:
+                    replacements[other] = None
+            report.cidr_merges += len(networks) - len(collapsed)
+        return self.apply(rules, replacements)
+
+    def has_ipv4_cidr(self, rule):
+        cidr = rule.resource['Properties'].get('CidrIp')
+        if cidr is None:
+            return False
+        try:
+            return ipaddress.ip_network(cidr, strict=False).version == 4
+        except ValueError:
+            return False
+
+    def group_rules(self, rules, predicate, key):
+        '''
+        Returns lists of (position, rule) sharing a key, for sets of two
+        or more rules matching predicate
+        '''
+        groups = {}
+        for position, rule in enumerate(rules):
+            if predicate(rule):
+                groups.setdefault(key(rule), []).append((position, rule))
+        return [members for members in groups.values() if len(members) > 1]
+
+    def apply(self, rules, replacements):
+        '''
+        Rebuilds the rule list in its original order, substituting merged
+        rules and dropping the ones they absorbed
+        '''
+        output = []
+        for position, rule in enumerate(rules):
+            rule = replacements.get(position, rule)
+            if rule is not None:
+                output.append(rule)
+        return output
+
+    def merged_description(self, first, absorbed):
+        ids = ', '.join(format(rule.rule.rule_id, '03') for rule in absorbed)
+        description = '{} (merged {})'.format(
+            first.resource['Properties']['Description'], ids
+        )
+        if len(description) > MAX_DESCRIPTION_LENGTH:
+            description = '{} (merged {} rules)'.format(
+                first.resource['Properties']['Description'], len(absorbed)
+            )
+        return description
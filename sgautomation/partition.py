@@ -0,0 +1,162 @@
+'''
+Packing resources into as few CloudFormation templates as possible
+'''
+
+import json
+import logging
+import os
+
+from collections import namedtuple
+
+from sgautomation.templates import MAX_TEMPLATE_BYTES, MAX_TEMPLATE_RESOURCES
+
+PARTITION_FILE_NAME = '{}.partition.json'
+PARTITION_VERSION = 1
+
+Item = namedtuple('Item', ('name', 'size', 'affinity'))
+
+
+class Bin(object):
+
+    def __init__(self, number, overhead):
+        self.number = number
+        self.size = overhead
+        self.count = 0
+        self.affinities = set()
+
+    def fits(self, size, count, max_bytes, max_resources):
+        return self.size + size <= max_bytes and self.count + count <= max_resources
+
+    def add(self, item):
+        self.size += item.size
+        self.count += 1
+        self.affinities.add(item.affinity)
+
+
+class Partitioner(object):
+    '''
+    Assigns resources to numbered templates, treating the byte and
+    resource limits as a two dimensional bin packing problem.
+
+    Resources keep the template they were given on the previous run
+    while it still has room, so unchanged rules do not move between
+    stacks. The rest are packed first-fit-decreasing, largest unit
+    first, where a unit is all resources sharing an affinity (e.g. the
+    rules of one security group). A unit goes into a template already
+    holding its affinity if it fits, then into the first template with
+    room, and is only split across templates when no single one can
+    take it.
+    '''
+    def __init__(self, max_bytes=MAX_TEMPLATE_BYTES,
+                 max_resources=MAX_TEMPLATE_RESOURCES, overhead=0):
+        self.max_bytes = max_bytes
+        self.max_resources = max_resources
+        self.overhead = overhead
+
+    def pack(self, items, previous=None):
+        '''
+        Returns a dict of item name to template number
+        '''
+        previous = previous or {}
+        bins = {}
+        assignments = {}
+        remaining = []
+        for item in sorted(items, key=lambda item: (previous.get(item.name, 0), item.name)):
+            number = previous.get(item.name)
+            if number is not None:
+                target = bins.setdefault(number, Bin(number, self.overhead))
+                if target.fits(item.size, 1, self.max_bytes, self.max_resources):
+                    target.add(item)
+                    assignments[item.name] = number
+                    continue
+            remaining.append(item)
+        units = {}
+        for item in remaining:
+            units.setdefault(item.affinity, []).append(item)
+        for affinity in sorted(units, key=lambda a: (-self.weight(units[a]), a)):
+            unit = sorted(units[affinity], key=lambda item: (-item.size, item.name))
+            size = sum(item.size for item in unit)
+            target = self.first_fit(bins, size, len(unit), affinity)
+            if target is not None:
+                for item in unit:
+                    target.add(item)
+                    assignments[item.name] = target.number
+                continue
+            for item in unit:
+                target = self.first_fit(bins, item.size, 1, affinity)
+                if target is None:
+                    target = self.new_bin(bins)
+                target.add(item)
+                assignments[item.name] = target.number
+        logging.info('Packed {} resources into {} templates'.format(
+            len(assignments), len(set(assignments.values()))
+        ))
+        return assignments
+
+    def weight(self, unit):
+        '''
+        The larger of a unit's share of the byte and resource limits
+        '''
+        return max(
+            float(sum(item.size for item in unit)) / self.max_bytes,
+            float(len(unit)) / self.max_resources
+        )
+
+    def first_fit(self, bins, size, count, affinity):
+        ordered = [bins[number] for number in sorted(bins)]
+        candidates = [b for b in ordered if affinity in b.affinities] + ordered
+        for candidate in candidates:
+            if candidate.fits(size, count, self.max_bytes, self.max_resources):
+                return candidate
+        return None
+
+    def new_bin(self, bins):
+        number = max(bins) + 1 if bins else 1
+        bins[number] = Bin(number, self.overhead)
+        return bins[number]
+
+
+def partition_file(template_path, template_prefix):
+    '''
+    Returns the path of the file recording a template family's
+    assignments
+    '''
+    return os.path.join(template_path, PARTITION_FILE_NAME.format(template_prefix))
+
+
+def load_assignments(path):
+    '''
+    Returns the assignments saved by the previous run, or an empty dict
+    '''
+    if not os.path.exists(path):
+        return {}
+    with open(path) as partition_file:
+        state = json.load(partition_file)
+    if state.get('version') != PARTITION_VERSION:
+        logging.warning('Ignoring partition file {} with unknown version'.format(path))
+        return {}
+    return state.get('assignments', {})
+
+
+def save_assignments(path, assignments):
+    with open(path, 'w') as partition_file:
+        json.dump({
+            'version': PARTITION_VERSION,
+            'assignments': assignments,
+        }, partition_file, indent=1, sort_keys=True)
+
+
+def pack_templates(builder, template_path, template_prefix):
+    '''
+    Repacks the buckets of a TemplateBuilder into numbered templates,
+    reusing and then updating the assignments stored in template_path
+    '''
+    path = partition_file(template_path, template_prefix)
+    partitioner = Partitioner(builder.max_bytes, builder.max_resources,
+                              builder.bucket_overhead)
+    assignments = partitioner.pack(
+        [Item(*item) for item in builder.items()], load_assignments(path)
+    )
+    builder.repack(assignments)
+    save_assignments(path, assignments)
+    return assignments
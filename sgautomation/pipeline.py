@@ -0,0 +1,104 @@
+'''
+Generates the group, ingress and egress templates from one inventory
+'''
+
+import logging
+
+from sgautomation.apply import DEFAULT_APPLY_WORKERS
+from sgautomation.cli import report_quotas
+from sgautomation.drift import DriftReport
+from sgautomation.egress import EgressGenerator
+from sgautomation.emitter import YAML_FORMAT
+from sgautomation.groups import DEFAULT_VPCSHORTCODE_TAG, GENERATOR_NAME, GroupGenerator
+from sgautomation.ingress import IngressGenerator
+from sgautomation.inventory import DEFAULT_REGION
+from sgautomation.metrics import METRICS
+from sgautomation.quota import DEFAULT_RULE_QUOTA, QuotaReport
+
+
+def generate_all(creation_data, ingress_data, egress_data, env_name,
+                 inventory, template_path, region=DEFAULT_REGION, workers=1,
+                 optimise=False, pack=False, incremental=False,
+                 output_format=YAML_FORMAT, drift_report=None,
+                 max_ingress_rules=DEFAULT_RULE_QUOTA,
+                 max_egress_rules=DEFAULT_RULE_QUOTA, quota_report=None,
+                 strict_quotas=False, apply=False, client=None, dry_run=False,
+                 prune=False, apply_workers=DEFAULT_APPLY_WORKERS):
+    '''
+    Builds the group definitions first, then generates the ingress and
+    egress rules against the same inventory with the new groups
+    registered as Fn::ImportValue references. When applying or reporting
+    drift, groups already in AWS resolve to their live ids instead;
+    rules on groups not deployed yet cannot be applied or compared until
+    the group stacks are, so they are left out.
+    Rules are checked against the rules per group quotas before anything
+    is written or applied; with strict_quotas a group over quota raises
+    QuotaExceededError.
+    '''
+    group_generator = GroupGenerator(creation_data, inventory=inventory,
+                                     output_format=output_format)
+    with METRICS.phase('structure_build', generator=GENERATOR_NAME):
+        group_generator.generate_security_group_structure(
+            vpc_short_code_part2=env_name.lower(), vpc_tag=DEFAULT_VPCSHORTCODE_TAG
+        )
+    planned_groups = group_generator.get_exported_groups()
+    logging.info('{} groups defined in this run'.format(len(planned_groups)))
+    prefer_live_groups = apply or bool(drift_report)
+    rule_generators = [
+        IngressGenerator(
+            ingress_data, env_name=env_name, inventory=inventory,
+            planned_groups=planned_groups, output_format=output_format,
+            prefer_live_groups=prefer_live_groups
+        ),
+        EgressGenerator(
+            egress_data, region=region, env_name=env_name, inventory=inventory,
+            planned_groups=planned_groups, output_format=output_format,
+            prefer_live_groups=prefer_live_groups
+        ),
+    ]
+    for rule_generator in rule_generators:
+        rule_generator.generate_security_group_structure(
+            workers=workers, optimise=optimise
+        )
+        if rule_generator.optimisation_report:
+            print('{} rules optimised: {}'.format(
+                rule_generator.generator_name.title(),
+                rule_generator.optimisation_report.summary()
+            ))
+        skipped = rule_generator.skipped_report()
+        if skipped:
+            print('\n'.join(skipped))
+    logging.info("Finished generating SG structure")
+    if drift_report:
+        report = DriftReport()
+        for rule_generator in rule_generators:
+            report.update(rule_generator.drift_report())
+        report.write(drift_report)
+        print(report.summary())
+        return
+    quotas = QuotaReport()
+    for rule_generator, quota in zip(rule_generators, (max_ingress_rules, max_egress_rules)):
+        quotas.update(rule_generator.quota_report(quota))
+    report_quotas(quotas, quota_report, strict_quotas)
+    if apply:
+        for rule_generator in rule_generators:
+            plan, result = rule_generator.apply_rules(
+                client, dry_run=dry_run, prune=prune, workers=apply_workers
+            )
+            print('{}: {}'.format(rule_generator.generator_name.title(), plan.summary()))
+            print('\n'.join(plan.describe()) if result is None else result.summary())
+        return
+    if pack:
+        group_generator.generate_packed_templates(template_path=template_path,
+                                                  incremental=incremental)
+    else:
+        group_generator.generate_templates(template_path=template_path,
+                                           incremental=incremental)
+    for rule_generator in rule_generators:
+        if pack:
+            rule_generator.pack_templates(template_path)
+        rule_generator.write_to_file(template_path=template_path,
+                                     incremental=incremental)
+    for generator in [group_generator] + rule_generators:
+        if generator.changeset:
+            print(generator.changeset.summary())
@@ -0,0 +1,322 @@
+'''
+Reachability and exposure queries over the parsed ingress and egress
+sheets
+'''
+
+import ipaddress
+
+from collections import namedtuple
+
+from sgautomation.names import group_key
+from sgautomation.rules import ALL_PORTS, MAX_PORT, MIN_PORT, normalise_protocol
+
+INGRESS = 'ingress'
+EGRESS = 'egress'
+ALL_PROTOCOLS = '-1'
+CIDR_PEER_TYPE = 'CIDR'
+INTERVAL_LEAF_SIZE = 16
+
+Reachability = namedtuple('Reachability', ('allowed', 'ingress', 'egress'))
+
+
+def port_range(rule):
+    '''
+    Returns the (low, high) ports a rule covers, all ports for protocol
+    -1, icmp and rules written as all ports
+    '''
+    if rule.protocol == ALL_PROTOCOLS or rule.from_port == ALL_PORTS:
+        return MIN_PORT, MAX_PORT
+    return rule.from_port, rule.to_port
+
+
+def query_range(port=None, to_port=None, protocol='tcp'):
+    '''
+    Returns the (low, high) ports a query covers, normalised the way
+    port_range normalises rules: no port, ALL_PORTS (as parse_ports
+    gives for icmp and "all") and protocol -1 cover every port, and a
+    missing to_port means the single port
+    '''
+    if port is None or port == ALL_PORTS or protocol == ALL_PROTOCOLS:
+        return MIN_PORT, MAX_PORT
+    return port, port if to_port is None else to_port
+
+
+class IntervalTree(object):
+    '''
+    A static centered interval tree. Each node holds the intervals
+    containing its center, sorted by start and by end, so a point or
+    range query visits one node per level plus the intervals it returns.
+    Nodes of up to INTERVAL_LEAF_SIZE intervals are scanned instead.
+    '''
+    __slots__ = ('center', 'by_start', 'by_end', 'left', 'right')
+
+    def __init__(self, intervals):
+        '''
+        intervals is a list of (low, high, value) with low <= high
+        '''
+        if len(intervals) <= INTERVAL_LEAF_SIZE:
+            self.center = None
+            self.by_start = intervals
+            self.by_end = self.left = self.right = None
+            return
+        endpoints = sorted(point for low, high, _ in intervals for point in (low, high))
+        self.center = endpoints[len(endpoints) // 2] if endpoints else 0
+        here, left, right = [], [], []
+        for interval in intervals:
+            if interval[1] < self.center:
+                left.append(interval)
+            elif interval[0] > self.center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        self.by_start = sorted(here, key=lambda interval: interval[0])
+        self.by_end = sorted(here, key=lambda interval: -interval[1])
+        self.left = IntervalTree(left) if left else None
+        self.right = IntervalTree(right) if right else None
+
+    def overlapping(self, low, high=None):
+        '''
+        Returns the values of the intervals overlapping [low, high]; a
+        single point when high is not given
+        '''
+        if high is None:
+            high = low
+        found = []
+        node = self
+        pending = []
+        while node is not None:
+            if node.center is None:
+                found.extend(
+                    value for start, end, value in node.by_start
+                    if start <= high and end >= low
+                )
+                node = None
+            elif high < node.center:
+                for start, _, value in node.by_start:
+                    if start > high:
+                        break
+                    found.append(value)
+                node = node.left
+            elif low > node.center:
+                for _, end, value in node.by_end:
+                    if end < low:
+                        break
+                    found.append(value)
+                node = node.right
+            else:
+                found.extend(value for _, _, value in node.by_start)
+                if node.right is not None:
+                    pending.append(node.right)
+                node = node.left
+            if node is None and pending:
+                node = pending.pop()
+        return found
+
+
+class CidrNode(object):
+    '''
+    A CidrTrie node: the network it stands for, the values stored on
+    exactly that network and the subtrees whose next bit is 0 and 1
+    '''
+    __slots__ = ('address', 'length', 'values', 'children')
+
+    def __init__(self, address, length, values=None):
+        self.address = address
+        self.length = length
+        self.values = [] if values is None else values
+        self.children = [None, None]
+
+
+class CidrTrie(object):
+    '''
+    A path compressed binary prefix (radix) trie of networks, one per
+    address family. Only networks holding values and the points where
+    two of them branch get a node, so a sparse set of /24s does not cost
+    a chain of single child nodes each. Finding the networks that
+    contain an address walks at most one node per prefix bit; finding
+    the networks inside a prefix walks to it and collects the subtree.
+    Networks can also be given as the (version, address, prefix length,
+    address width) tuples from prefix, which saves working them out
+    again for callers handling many rules.
+    '''
+    def __init__(self):
+        self.roots = {4: CidrNode(0, 0), 6: CidrNode(0, 0)}
+
+    @staticmethod
+    def prefix(network):
+        return (network.version, int(network.network_address), network.prefixlen,
+                network.max_prefixlen)
+
+    def insert(self, network, value):
+        self.insert_prefix(self.prefix(network), value)
+
+    def insert_prefix(self, prefix, value):
+        version, address, length, width = prefix
+        node = self.roots[version]
+        while node.length < length:
+            bit = (address >> (width - 1 - node.length)) & 1
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = CidrNode(address, length, [value])
+                return
+            # the number of leading bits child and the new network share
+            shared = min(child.length, length)
+            differing = (address ^ child.address) >> (width - shared)
+            if differing:
+                shared -= differing.bit_length()
+            if shared == child.length:
+                node = child
+                continue
+            branch = CidrNode(address >> (width - shared) << (width - shared), shared)
+            branch.children[(child.address >> (width - 1 - shared)) & 1] = child
+            node.children[bit] = branch
+            if shared == length:
+                branch.values.append(value)
+            else:
+                branch.children[(address >> (width - 1 - shared)) & 1] = CidrNode(
+                    address, length, [value]
+                )
+            return
+        node.values.append(value)
+
+    def containing(self, network):
+        '''
+        Returns the values of every network that contains network
+        '''
+        return self.containing_prefix(self.prefix(network))
+
+    def containing_prefix(self, prefix):
+        version, address, length, width = prefix
+        node = self.roots[version]
+        found = list(node.values)
+        while node.length < length:
+            node = node.children[(address >> (width - 1 - node.length)) & 1]
+            if node is None or node.length > length or \
+                    (address ^ node.address) >> (width - node.length):
+                break
+            found.extend(node.values)
+        return found
+
+    def within(self, network):
+        '''
+        Returns the values of every network inside network
+        '''
+        version, address, length, width = self.prefix(network)
+        node = self.roots[version]
+        while node.length < length:
+            node = node.children[(address >> (width - 1 - node.length)) & 1]
+            if node is None or \
+                    (address ^ node.address) >> (width - min(node.length, length)):
+                return []
+        found = []
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            found.extend(node.values)
+            pending.extend(child for child in node.children if child is not None)
+        return found
+
+
+class RuleIndex(object):
+    '''
+    Indexes IngressRule/EgressRule records for queries such as "can
+    AppD_RHEL_Instances reach Active Directory on 389/tcp" or "which
+    groups expose 22 to 0.0.0.0/0". Group names are matched the way the
+    generators match them, ignoring case and punctuation.
+
+    Rules are indexed per (direction, group, protocol) in an
+    IntervalTree of their port ranges, and the CIDR peers of each
+    direction in a CidrTrie. The rules themselves are kept in records.
+    '''
+    def __init__(self, ingress_rules=(), egress_rules=()):
+        intervals = {}
+        self.cidrs = {INGRESS: CidrTrie(), EGRESS: CidrTrie()}
+        self.records = {INGRESS: [], EGRESS: []}
+        for direction, rules in ((INGRESS, ingress_rules), (EGRESS, egress_rules)):
+            for rule in rules:
+                self.records[direction].append(rule)
+                low, high = port_range(rule)
+                intervals.setdefault(
+                    (direction, group_key(rule.group), rule.protocol), []
+                ).append((low, high, rule))
+                if rule.peer_type == CIDR_PEER_TYPE:
+                    try:
+                        network = ipaddress.ip_network(rule.peer, strict=False)
+                    except ValueError:
+                        continue
+                    self.cidrs[direction].insert(network, rule)
+        self.trees = {key: IntervalTree(value) for key, value in intervals.items()}
+
+    def rules(self, group, port=None, protocol='tcp', direction=INGRESS, to_port=None):
+        '''
+        Returns the rules on group of one direction that cover any of the
+        ports from port to to_port (all ports when port is None)
+        '''
+        protocol = normalise_protocol(protocol)
+        low, high = query_range(port, to_port, protocol)
+        found = []
+        protocols = (protocol,) if protocol == ALL_PROTOCOLS else (protocol, ALL_PROTOCOLS)
+        for candidate in protocols:
+            tree = self.trees.get((direction, group_key(group), candidate))
+            if tree is not None:
+                found.extend(tree.overlapping(low, high))
+        return sorted(found, key=lambda rule: rule.rule_id)
+
+    def can_reach(self, source, destination, port, protocol='tcp', to_port=None):
+        '''
+        Returns a Reachability holding the destination's ingress rules
+        admitting source and the source's egress rules allowing traffic
+        to destination on any port from port to to_port. source may be a
+        group name or an IP address; allowed needs both sides (only
+        ingress when no egress rules were loaded, or the source is an
+        address).
+        '''
+        source_address = self.network(source)
+        ingress = []
+        for rule in self.rules(destination, port, protocol, INGRESS, to_port):
+            if source_address is not None:
+                peer = self.network(rule.peer) if rule.peer_type == CIDR_PEER_TYPE else None
+                if peer is not None and peer.version == source_address.version \
+                        and source_address.subnet_of(peer):
+                    ingress.append(rule)
+            elif rule.peer_type != CIDR_PEER_TYPE and group_key(rule.peer) == group_key(source):
+                ingress.append(rule)
+        egress = []
+        if source_address is None:
+            egress = [
+                rule for rule in self.rules(source, port, protocol, EGRESS, to_port)
+                if rule.peer_type != CIDR_PEER_TYPE and
+                group_key(rule.peer) == group_key(destination)
+            ]
+        check_egress = source_address is None and len(self.records[EGRESS]) > 0
+        allowed = bool(ingress) and (bool(egress) or not check_egress)
+        return Reachability(allowed, ingress, egress)
+
+    def exposed(self, network, port=None, protocol='tcp', direction=INGRESS, within=False,
+                to_port=None):
+        '''
+        Returns the rules with a CIDR peer containing network (or inside
+        it, with within) that cover any of the ports from port to
+        to_port, e.g. exposed('0.0.0.0/0', 22) lists the rules opening
+        ssh to the internet
+        '''
+        network = ipaddress.ip_network(network, strict=False)
+        trie = self.cidrs[direction]
+        candidates = trie.within(network) if within else trie.containing(network)
+        protocol = normalise_protocol(protocol)
+        query_low, query_high = query_range(port, to_port, protocol)
+        found = []
+        for rule in candidates:
+            if protocol != ALL_PROTOCOLS and rule.protocol not in (protocol, ALL_PROTOCOLS):
+                continue
+            low, high = port_range(rule)
+            if low <= query_high and query_low <= high:
+                found.append(rule)
+        return sorted(found, key=lambda rule: (group_key(rule.group), rule.rule_id))
+
+    @staticmethod
+    def network(value):
+        try:
+            return ipaddress.ip_network(value, strict=False)
+        except ValueError:
+            return None
@@ -0,0 +1,299 @@
+'''
+Checks generated rules against the EC2 limit on rules per security group
+'''
+
+import json
+import math
+
+from collections import namedtuple
+
+from sgautomation.cidrs import (
+    IPV4_BITS, NETWORK_MASKS, canonical_cidr, format_ipv4, parse_ipv4
+)
+from sgautomation.drift import (
+    PEER_CIDR, PEER_CIDR_V6, PEER_GROUP, PEER_PREFIX_LIST, PORT_PROTOCOLS,
+    RESOURCE_DIRECTION, RESOURCE_PEERS, canonical_ports
+)
+from sgautomation.optimiser import freeze
+from sgautomation.rules import normalise_protocol
+
+# the default quota for inbound and for outbound rules; it can be raised
+# per account, so the generators take it as an option
+DEFAULT_RULE_QUOTA = 60
+IPV4 = 'ipv4'
+IPV6 = 'ipv6'
+# EC2 counts the quota separately for IPv4 and IPv6 rules, and a rule
+# referencing a group or prefix list counts once against each
+PEER_FAMILIES = {
+    PEER_GROUP: (IPV4, IPV6),
+    PEER_PREFIX_LIST: (IPV4, IPV6),
+    PEER_CIDR: (IPV4,),
+    PEER_CIDR_V6: (IPV6,),
+}
+
+QuotaEntry = namedtuple('QuotaEntry', ('protocol', 'from_port', 'to_port', 'peer_kind', 'peer'))
+
+
+class QuotaExceededError(ValueError):
+    '''
+    Raised when rules would take a group over its quota and the run was
+    asked to stop rather than write templates that cannot deploy
+    '''
+
+
+def quota_entry(resource):
+    '''
+    Returns (group reference, QuotaEntry) for a SecurityGroupIngress or
+    Egress resource. Groups created in the same run are still
+    Fn::ImportValue references, which are frozen so they can be counted.
+    '''
+    properties = resource['Properties']
+    peer_kind, peer = None, None
+    for name, kind in RESOURCE_PEERS:
+        if name in properties:
+            peer_kind, peer = kind, freeze(properties[name])
+            break
+    if peer_kind in (PEER_CIDR, PEER_CIDR_V6):
+        peer = canonical_cidr(peer)
+    protocol = normalise_protocol(str(properties['IpProtocol']))
+    from_port, to_port = canonical_ports(
+        protocol, properties.get('FromPort'), properties.get('ToPort')
+    )
+    return freeze(properties['GroupId']), QuotaEntry(protocol, from_port, to_port, peer_kind, peer)
+
+
+def merge_port_ranges(entries):
+    '''
+    Returns entries with the overlapping or adjacent tcp/udp port ranges
+    of each protocol and peer merged, which allows the same traffic
+    '''
+    merged = []
+    ranges = {}
+    for entry in entries:
+        if entry.protocol in PORT_PROTOCOLS:
+            ranges.setdefault((entry.protocol, entry.peer_kind, entry.peer), []).append(entry)
+        else:
+            merged.append(entry)
+    for members in ranges.values():
+        members.sort(key=lambda entry: (entry.from_port, entry.to_port))
+        current = members[0]
+        for entry in members[1:]:
+            if entry.from_port <= current.to_port + 1:
+                current = current._replace(to_port=max(current.to_port, entry.to_port))
+                continue
+            merged.append(current)
+            current = entry
+        merged.append(current)
+    return merged
+
+
+def collapse_networks(networks):
+    '''
+    Returns the smallest set of (address, prefix) IPv4 networks covering
+    exactly the given ones. Networks inside another are dropped and pairs
+    of sibling networks are replaced by their parent, working up from
+    the longest prefix, so each network is looked at a bounded number of
+    times rather than sorted.
+    '''
+    networks = set(networks)
+    for value, prefix in list(networks):
+        for parent in range(prefix - 1, -1, -1):
+            if (value & NETWORK_MASKS[parent], parent) in networks:
+                networks.discard((value, prefix))
+                break
+    levels = [set() for _ in range(IPV4_BITS + 1)]
+    for value, prefix in networks:
+        levels[prefix].add(value)
+    for prefix in range(IPV4_BITS, 0, -1):
+        level = levels[prefix]
+        bit = 1 << (IPV4_BITS - prefix)
+        for value in list(level):
+            if value in level and value ^ bit in level:
+                level.discard(value)
+                level.discard(value ^ bit)
+                levels[prefix - 1].add(value & ~bit)
+    return [(value, prefix) for prefix, level in enumerate(levels) for value in level]
+
+
+def split_cidrs(entries):
+    '''
+    Returns (IPv4 CIDR entries by protocol and ports as
+    {key: [(address, prefix)]}, other entries)
+    '''
+    cidrs = {}
+    others = []
+    for entry in entries:
+        network = parse_ipv4(entry.peer) if entry.peer_kind == PEER_CIDR else None
+        if network is None:
+            others.append(entry)
+            continue
+        cidrs.setdefault((entry.protocol, entry.from_port, entry.to_port), []).append(network)
+    return cidrs, others
+
+
+def collapse_cidrs(entries):
+    '''
+    Returns entries with the IPv4 CIDRs sharing a protocol and port range
+    collapsed into the fewest networks covering the same addresses
+    '''
+    cidrs, collapsed = split_cidrs(entries)
+    for (protocol, from_port, to_port), networks in cidrs.items():
+        collapsed.extend(
+            QuotaEntry(protocol, from_port, to_port, PEER_CIDR, format_ipv4(value, prefix))
+            for value, prefix in collapse_networks(networks)
+        )
+    return collapsed
+
+
+def widened_count(cidrs, others, length):
+    count = len(others)
+    for networks in cidrs.values():
+        mask = NETWORK_MASKS[length]
+        count += len(set(
+            (value & mask, length) if prefix > length else (value, prefix)
+            for value, prefix in networks
+        ))
+    return count
+
+
+def widest_prefix(entries, quota):
+    '''
+    Returns the longest prefix length IPv4 CIDRs would have to be widened
+    to for entries to fit within quota, or None if widening alone cannot
+    get there. The count only falls as prefixes get shorter, so the
+    length is found by bisection.
+    '''
+    cidrs, others = split_cidrs(entries)
+    if not cidrs or widened_count(cidrs, others, 0) > quota:
+        return None
+    low, high = 0, IPV4_BITS - 1
+    while low < high:
+        length = (low + high + 1) // 2
+        if widened_count(cidrs, others, length) <= quota:
+            low = length
+        else:
+            high = length - 1
+    return low
+
+
+class QuotaReport(object):
+    '''
+    The groups whose generated rules go over the rules per group quota,
+    per direction and IP family, with the cheapest way to bring each
+    back within it
+    '''
+    def __init__(self):
+        self.checked = 0
+        self.violations = []
+
+    def update(self, other):
+        self.checked += other.checked
+        self.violations.extend(other.violations)
+
+    def summary(self):
+        return '{} of {} group rule quotas exceeded'.format(
+            len(self.violations), self.checked
+        )
+
+    def describe(self):
+        '''
+        Returns one line per group over its quota
+        '''
+        return [
+            '{} {} ({}): {} rules, quota {}. {}'.format(
+                violation['group'], violation['direction'], violation['family'],
+                violation['rules'], violation['quota'], violation['suggestion']
+            )
+            for violation in self.violations
+        ]
+
+    def to_dict(self):
+        return {
+            'summary': self.summary(),
+            'checked': self.checked,
+            'violations': self.violations,
+        }
+
+    def write(self, path):
+        with open(path, 'w') as report_file:
+            json.dump(self.to_dict(), report_file, indent=1, sort_keys=True)
+
+
+def suggest(group, group_id, direction, family, entries, quota):
+    '''
+    Returns the violation record for one group over its quota: how many
+    rules merging port ranges and collapsing CIDRs would save, and if
+    that is not enough, the fewest groups the rules would have to be
+    split across and how far CIDRs would have to be widened instead
+    '''
+    merged = merge_port_ranges(entries)
+    collapsed = collapse_cidrs(merged)
+    violation = {
+        'group': group,
+        'group_id': json.loads(group_id) if group_id.startswith('{') else group_id,
+        'direction': direction,
+        'family': family,
+        'rules': len(entries),
+        'quota': quota,
+        'over': len(entries) - quota,
+        'port_merges': len(entries) - len(merged),
+        'cidr_merges': len(merged) - len(collapsed),
+        'after_merging': len(collapsed),
+        'split_groups': int(math.ceil(len(collapsed) / float(quota))),
+        'widen_to_prefix': None,
+    }
+    if len(collapsed) <= quota:
+        violation['split_groups'] = 1
+        violation['suggestion'] = (
+            'Merging port ranges and CIDRs (--optimise) brings it to {} rules'.format(
+                len(collapsed)
+            )
+        )
+        return violation
+    violation['widen_to_prefix'] = widest_prefix(collapsed, quota)
+    suggestion = 'Split it across {} groups of at most {} rules'.format(
+        violation['split_groups'], quota
+    )
+    if len(collapsed) < len(entries):
+        suggestion += ' after merging down to {} rules'.format(len(collapsed))
+    if violation['widen_to_prefix'] is not None:
+        suggestion += ', or widen its CIDRs to /{}'.format(violation['widen_to_prefix'])
+    violation['suggestion'] = suggestion
+    return violation
+
+
+def plan_quotas(compiled_rules, direction=None, quota=DEFAULT_RULE_QUOTA):
+    '''
+    Counts the distinct rules each group would get from CompiledRules in
+    one pass and returns a QuotaReport of the groups over quota. The
+    direction is taken from each resource's type unless given. Only the
+    rules of groups over their quota are looked at again to work out
+    suggestions.
+    '''
+    counted = {}
+    names = {}
+    with_cidrs = set()
+    for result in compiled_rules:
+        group_id, entry = quota_entry(result.resource)
+        rule_direction = direction or RESOURCE_DIRECTION[result.resource['Type']]
+        names.setdefault(group_id, result.rule.group)
+        families = PEER_FAMILIES.get(entry.peer_kind, (IPV4,))
+        for family in families:
+            counted.setdefault((group_id, rule_direction, family), set()).add(entry)
+        if len(families) == 1:
+            with_cidrs.add((group_id, rule_direction, families[0]))
+    # without CIDRs of its own a family holds only the group and prefix
+    # list rules, which the other family counts too
+    checked = [
+        key for key in counted
+        if key in with_cidrs or key[2] == IPV4 and key[:2] + (IPV6,) not in with_cidrs
+    ]
+    report = QuotaReport()
+    report.checked = len(checked)
+    for group_id, rule_direction, family in sorted(checked):
+        entries = counted[(group_id, rule_direction, family)]
+        if len(entries) > quota:
+            report.violations.append(suggest(
+                names[group_id], group_id, rule_direction, family, list(entries), quota
+            ))
+    return report
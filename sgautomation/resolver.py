@@ -0,0 +1,109 @@
+'''
+Name to id resolution for existing security groups
+'''
+
+from sgautomation.names import TEMP_MARKER, group_key
+
+ACTIVE_DIRECTORY = 'activedirectory'
+
+
+class SecurityGroupResolver(object):
+    '''
+    Resolves the short names used in the rule sheets to security group
+    ids. The indexes are built once from the describe_security_groups
+    output so that each lookup is a dictionary hit rather than a scan
+    of every group.
+
+    The lookup rules match the original linear scan, where the first
+    group (in describe order) satisfying either test wins:
+    - names containing "temp" match any group whose name contains them
+    - all other names match a group whose name contains the short name
+      followed by a "." or the end of the name
+
+    Groups that are defined in the same run, and so may not exist yet,
+    can be registered with plan_group. By default they take precedence
+    over the groups found in AWS: templates refer to them through the
+    group stacks' exports, so CloudFormation deploys the rules after
+    the groups and keeps them tied to the stack managed group even once
+    it exists. Anything working on the live groups through the EC2 API
+    (applying rules, drift reports) cannot use those references and
+    sets prefer_live, so that a group already in AWS resolves to its
+    id and only groups not deployed yet fall back to the reference.
+    '''
+    def __init__(self, groups, dc_group=None, prefer_live=False):
+        self.dc_group = dc_group
+        self.prefer_live = prefer_live
+        self.planned = {}
+        self.segment_index = {}
+        self.temp_index = {}
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        for group in groups:
+            self.add_group(group)
+
+    def add_group(self, group):
+        '''
+        Indexes a single group. Existing entries are never replaced, so
+        earlier groups keep priority as they did in the linear scan.
+        '''
+        group_id = group.get('GroupId', '')
+        logical_name = group.get('GroupName', '').lower()
+        # every substring ending at a "." or at the end of the name
+        # satisfies short_name + "." in logical_name + "."
+        ends = [i for i, c in enumerate(logical_name) if c == '.']
+        ends.append(len(logical_name))
+        for end in ends:
+            for start in range(end + 1):
+                self.segment_index.setdefault(logical_name[start:end], group_id)
+        # only groups containing "temp" can match a "temp" short name, and
+        # only on substrings that themselves contain "temp"
+        start = logical_name.find(TEMP_MARKER)
+        while start != -1:
+            stop = start + len(TEMP_MARKER)
+            for i in range(start + 1):
+                for j in range(stop, len(logical_name) + 1):
+                    self.temp_index.setdefault(logical_name[i:j], group_id)
+            start = logical_name.find(TEMP_MARKER, start + 1)
+        self.cache.clear()
+
+    def plan_group(self, name, reference):
+        '''
+        Registers a group created in this run. reference is what rules
+        should use in place of the group id, e.g. an Fn::ImportValue.
+        '''
+        self.planned[group_key(name)] = reference
+        self.cache.clear()
+
+    def resolve(self, short_name):
+        '''
+        Returns the group id for a short name or None if no group matches
+        '''
+        try:
+            group_id = self.cache[short_name]
+            self.hits += 1
+        except KeyError:
+            group_id = self.lookup(short_name)
+            self.cache[short_name] = group_id
+            self.misses += 1
+        if isinstance(group_id, dict):
+            # each rule needs its own copy, a shared object would be
+            # written out as a YAML alias which CloudFormation rejects
+            return dict(group_id)
+        return group_id
+
+    def lookup(self, short_name):
+        '''
+        Uncached lookup behind resolve
+        '''
+        key = short_name.lower()
+        if key == ACTIVE_DIRECTORY and self.dc_group:
+            return self.dc_group
+        planned = self.planned.get(group_key(key)) if self.planned else None
+        if planned is not None and not self.prefer_live:
+            return planned
+        if TEMP_MARKER in key:
+            group_id = self.temp_index.get(key)
+        else:
+            group_id = self.segment_index.get(key)
+        return planned if group_id is None else group_id
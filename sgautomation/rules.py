@@ -0,0 +1,281 @@
+'''
+Streaming readers for the rule and group definition sheets
+'''
+
+import csv
+import logging
+import os
+
+from collections import namedtuple
+
+from sgautomation.metrics import METRICS
+
+ALL_PORTS = -1
+MIN_PORT = 0
+MAX_PORT = 65535
+PROTOCOL_ALIASES = {
+    'all': '-1',
+    '1': 'icmp',
+    '6': 'tcp',
+    '17': 'udp',
+}
+
+RULE_FIELDS = (
+    'rule_id', 'group', 'from_port', 'to_port', 'protocol', 'peer',
+    'peer_type', 'description', 'line',
+)
+
+RowError = namedtuple('RowError', ('filename', 'line', 'rule_id', 'message'))
+
+
+class RowValidationError(ValueError):
+    '''
+    Raised while parsing a row that cannot be turned into a record
+    '''
+
+
+def normalise_protocol(raw_protocol):
+    '''
+    Lower cases a protocol and maps the numeric forms of tcp, udp and
+    icmp, and "all", onto the names EC2 reports
+    '''
+    protocol = raw_protocol.strip().lower()
+    return PROTOCOL_ALIASES.get(protocol, protocol)
+
+
+def parse_port(raw_port):
+    try:
+        port = int(raw_port)
+    except ValueError:
+        raise RowValidationError('Invalid port {!r}'.format(raw_port))
+    if port != ALL_PORTS and not MIN_PORT <= port <= MAX_PORT:
+        raise RowValidationError('Port {} out of range'.format(port))
+    return port
+
+
+def parse_ports(raw_from_port, raw_to_port, protocol):
+    '''
+    Returns (from_port, to_port) as ints:
+    - icmp, protocol -1 and a from port of "all" cover every port (-1)
+    - a to port of 0 means the single from port
+    - a range may be written as a-b in the port columns
+    - a single blank column takes the value of the other one
+    '''
+    from_port = raw_from_port.strip()
+    to_port = raw_to_port.strip()
+    if protocol in ('icmp', '-1') or from_port.lower() == 'all':
+        return ALL_PORTS, ALL_PORTS
+    if from_port == '' and to_port == '':
+        raise RowValidationError('No ports given')
+    if '-' in from_port.lstrip('-') and to_port in ('', '0', from_port):
+        from_port, to_port = from_port.split('-', 1)
+    if to_port in ('', '0'):
+        to_port = from_port
+    if from_port == '':
+        from_port = to_port
+    from_port = parse_port(from_port)
+    to_port = parse_port(to_port)
+    if from_port > to_port:
+        raise RowValidationError('From port {} is above to port {}'.format(from_port, to_port))
+    return from_port, to_port
+
+
+class Rule(namedtuple('Rule', RULE_FIELDS)):
+    '''
+    A single row of a rule sheet. group is the security group the rule
+    is attached to and peer/peer_type the other end of the connection.
+    '''
+    __slots__ = ()
+    columns = {}
+    peer_types = ()
+
+    @classmethod
+    def from_row(cls, values, line):
+        try:
+            rule_id = int(values['rule_id'])
+        except ValueError:
+            raise RowValidationError('Invalid rule id {!r}'.format(values['rule_id']))
+        group = values['group'].strip()
+        if not group:
+            raise RowValidationError('No security group name')
+        protocol = normalise_protocol(values['protocol'])
+        if not protocol:
+            raise RowValidationError('No protocol')
+        peer_type = values['peer_type'].strip()
+        if not cls.valid_peer_type(peer_type):
+            raise RowValidationError('Unknown type {!r}'.format(peer_type))
+        peer = values['peer'].strip()
+        if not peer:
+            raise RowValidationError('No {} reference'.format(peer_type))
+        from_port, to_port = parse_ports(values['from_port'], values['to_port'], protocol)
+        return cls(
+            rule_id, group, from_port, to_port, protocol, peer, peer_type,
+            values.get('description', '').strip(), line
+        )
+
+    @classmethod
+    def valid_peer_type(cls, peer_type):
+        return peer_type in cls.peer_types
+
+
+class IngressRule(Rule):
+    '''
+    A row of the ingress sheet, peer is the source of the traffic
+    '''
+    __slots__ = ()
+    columns = {
+        'rule_id': ('RULE ID',),
+        'group': ('SECURITY GROUP NAME',),
+        'from_port': ('FROM PORT',),
+        'to_port': ('TO PORT',),
+        'protocol': ('PROTOCOL',),
+        'peer': ('FROM REFERENCE', 'FROM SECURITY GROUP'),
+        'peer_type': ('FROM TYPE',),
+        'description': ('DESCRIPTION',),
+    }
+    peer_types = ('Group', 'VPC', 'CIDR')
+
+
+class EgressRule(Rule):
+    '''
+    A row of the egress sheet, peer is the destination of the traffic.
+    Load balancer destinations have a type of LB_<az letter>.
+    '''
+    __slots__ = ()
+    columns = {
+        'rule_id': ('RULE ID',),
+        'group': ('SECURITY GROUP NAME',),
+        'from_port': ('FROM PORT',),
+        'to_port': ('TO PORT',),
+        'protocol': ('PROTOCOL',),
+        'peer': ('TO SECURITY GROUP', 'TO REFERENCE'),
+        'peer_type': ('FROM TYPE', 'TO TYPE'),
+        'description': ('DESCRIPTION',),
+    }
+    peer_types = ('Group', 'CIDR')
+
+    @classmethod
+    def valid_peer_type(cls, peer_type):
+        return peer_type in cls.peer_types or (
+            peer_type.startswith('LB_') and len(peer_type) == 4
+        )
+
+
+class GroupDefinition(namedtuple('GroupDefinition', ('name', 'description', 'vpc_code', 'line'))):
+    '''
+    A row of the security group creation sheet
+    '''
+    __slots__ = ()
+    columns = {
+        'name': ('SECURITY GROUP NAME',),
+        'description': ('SECURITY GROUP DESCRIPTION',),
+        'vpc_code': ('VPC_CODE', 'VPC CODE'),
+    }
+
+    @classmethod
+    def from_row(cls, values, line):
+        name = values['name'].strip()
+        if not name:
+            raise RowValidationError('No security group name')
+        vpc_code = values['vpc_code'].strip()
+        if not vpc_code:
+            raise RowValidationError('No vpc code')
+        return cls(name, values['description'].strip(), vpc_code, line)
+
+
+class RoleMapping(namedtuple('RoleMapping', ('mapping_id', 'role', 'group', 'vpc_code', 'line'))):
+    '''
+    A row of the instance role mapping sheet: instances tagged with
+    instance_role = role should be in group
+    '''
+    __slots__ = ()
+    columns = {
+        'mapping_id': ('MAPPING ID',),
+        'role': ('INSTANCE ROLE TAG', 'INSTANCE ROLE'),
+        'group': ('SECURITY GROUP NAME',),
+        'vpc_code': ('VPC_CODE', 'VPC CODE'),
+    }
+
+    @classmethod
+    def from_row(cls, values, line):
+        try:
+            mapping_id = int(values['mapping_id'])
+        except ValueError:
+            raise RowValidationError('Invalid mapping id {!r}'.format(values['mapping_id']))
+        role = values['role'].strip()
+        if not role:
+            raise RowValidationError('No instance role')
+        group = values['group'].strip()
+        if not group:
+            raise RowValidationError('No security group name')
+        return cls(mapping_id, role, group, values['vpc_code'].strip(), line)
+
+
+class RuleSheetReader(object):
+    '''
+    Reads a sheet one row at a time and yields records of record_type.
+    Columns are found by header name, so their order in the sheet does
+    not matter. Rows that fail validation are logged, kept in
+    self.errors and left out of the output.
+    '''
+    def __init__(self, filename, record_type=IngressRule):
+        self.filename = filename
+        self.record_type = record_type
+        self.errors = []
+
+    def column_positions(self, header):
+        '''
+        Maps each record field to its column index in the header row
+        '''
+        names = [name.strip().upper() for name in header]
+        positions = {}
+        for field, aliases in self.record_type.columns.items():
+            for alias in aliases:
+                if alias in names:
+                    positions[field] = names.index(alias)
+                    break
+        missing = [
+            field for field in self.record_type.columns
+            if field not in positions and field != 'description'
+        ]
+        if missing:
+            raise ValueError('File {} has no column for {}'.format(
+                self.filename, ', '.join(sorted(missing))
+            ))
+        return positions
+
+    def read(self):
+        '''
+        Yields one record per valid row
+        '''
+        with open(self.filename, newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            header = next(reader, None)
+            if not header:
+                raise ValueError('File {} appears to be empty'.format(self.filename))
+            positions = self.column_positions(header)
+            for row in reader:
+                if not any(cell.strip() for cell in row):
+                    continue
+                line = reader.line_num
+                if len(row) != len(header):
+                    logging.warning('Row {} has invalid length'.format(row))
+                values = {
+                    field: row[index] if index < len(row) else ''
+                    for field, index in positions.items()
+                }
+                try:
+                    yield self.record_type.from_row(values, line)
+                except RowValidationError as error:
+                    self.add_error(line, values.get('rule_id', ''), str(error))
+
+    __iter__ = read
+
+    def add_error(self, line, rule_id, message):
+        error = RowError(self.filename, line, rule_id.strip(), message)
+        logging.warning('Skipping {} line {} (rule {}): {}'.format(
+            error.filename, error.line, error.rule_id, error.message
+        ))
+        self.errors.append(error)
+        METRICS.count('rows_skipped_total', sheet=os.path.basename(self.filename),
+                      reason='invalid_row')
@@ -0,0 +1,133 @@
+'''
+Size-aware grouping of CloudFormation resources into templates
+'''
+
+from sgautomation.emitter import get_emitter
+
+MAX_TEMPLATE_BYTES = 50000
+MAX_TEMPLATE_RESOURCES = 200
+RESOURCES_KEY = 'Resources'
+
+
+class TemplateBuilder(object):
+    '''
+    Collects resources into template buckets keyed by a short code and
+    keeps a running total of each bucket's serialized size, so the
+    CloudFormation limits can be checked without dumping the template
+    again for every resource.
+
+    When a resource would push a bucket over the byte or resource limit
+    the short code rolls over to a new numbered bucket, e.g. mgt, mgt-2,
+    mgt-3. self.container has the same layout the generators have always
+    written out: {bucket: {'Resources': {resource_name: resource}}}.
+    Sizes are measured with the emitter the templates will be written
+    with, YAML unless another is given.
+    '''
+    def __init__(self, header=None, max_bytes=MAX_TEMPLATE_BYTES,
+                 max_resources=MAX_TEMPLATE_RESOURCES, emitter=None):
+        self.max_bytes = max_bytes
+        self.max_resources = max_resources
+        self.container = {}
+        self.sizes = {}
+        self.footprints = {}
+        self.placements = {}
+        self.affinities = {}
+        self.current_bucket = {}
+        self.emitter = emitter or get_emitter()
+        self.bucket_overhead = self.emitter.overhead(header, (RESOURCES_KEY,))
+
+    def resource_size(self, resource_name, resource):
+        '''
+        Returns the number of bytes a resource adds to the Resources
+        section of a template
+        '''
+        return self.emitter.entry_size(RESOURCES_KEY, resource_name, resource)
+
+    def fits(self, bucket, size):
+        '''
+        Returns True if a resource of the given size can go into bucket
+        '''
+        resources = self.container.get(bucket, {}).get(RESOURCES_KEY, {})
+        return (
+            len(resources) < self.max_resources and
+            self.sizes.get(bucket, self.bucket_overhead) + size <= self.max_bytes
+        )
+
+    def add(self, key, resource_name, resource, affinity=None):
+        '''
+        Adds a resource under the given short code and returns the name
+        of the bucket it was placed in. Re-adding a resource name
+        replaces the earlier definition. affinity names the resources
+        that should stay together if the templates are repacked, and
+        defaults to the short code.
+        '''
+        self.affinities[resource_name] = affinity or key
+        size = self.resource_size(resource_name, resource)
+        if resource_name in self.placements:
+            bucket = self.remove(resource_name)
+            if self.fits(bucket, size):
+                self.store(bucket, resource_name, resource, size)
+                return bucket
+        bucket, number = self.current_bucket.get(key, (key, 1))
+        while self.container.get(bucket, {}).get(RESOURCES_KEY) and not self.fits(bucket, size):
+            number += 1
+            bucket = '{}-{}'.format(key, number)
+        self.current_bucket[key] = (bucket, number)
+        self.store(bucket, resource_name, resource, size)
+        return bucket
+
+    def store(self, bucket, resource_name, resource, size):
+        '''
+        Records a resource in a bucket and updates the running size
+        '''
+        template = self.container.setdefault(bucket, {RESOURCES_KEY: {}})
+        template[RESOURCES_KEY][resource_name] = resource
+        self.sizes[bucket] = self.sizes.get(bucket, self.bucket_overhead) + size
+        self.footprints[resource_name] = size
+        self.placements[resource_name] = bucket
+
+    def remove(self, resource_name):
+        '''
+        Removes a resource and returns the bucket it was held in
+        '''
+        bucket = self.placements.pop(resource_name)
+        del self.container[bucket][RESOURCES_KEY][resource_name]
+        self.sizes[bucket] -= self.footprints.pop(resource_name)
+        return bucket
+
+    def items(self):
+        '''
+        Returns (resource_name, size, affinity) for every resource held
+        '''
+        return [
+            (resource_name, self.footprints[resource_name], self.affinities[resource_name])
+            for resource_name in self.placements
+        ]
+
+    def repack(self, assignments):
+        '''
+        Moves every resource into the bucket given for it in assignments,
+        a dict of resource name to bucket name
+        '''
+        resources = [
+            (resource_name, self.container[bucket][RESOURCES_KEY][resource_name])
+            for resource_name, bucket in self.placements.items()
+        ]
+        footprints = dict(self.footprints)
+        self.container.clear()
+        self.sizes.clear()
+        self.placements.clear()
+        self.footprints.clear()
+        self.current_bucket.clear()
+        for resource_name, resource in sorted(resources, key=lambda r: r[0]):
+            self.store(str(assignments[resource_name]), resource_name, resource,
+                       footprints[resource_name])
+
+    def resource_counts(self):
+        '''
+        Returns a dict of bucket name to number of resources held
+        '''
+        return {
+            bucket: len(template.get(RESOURCES_KEY, {}))
+            for bucket, template in self.container.items()
+        }
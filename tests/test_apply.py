@@ -0,0 +1,199 @@
+'''
+ApplyEngine against a stubbed EC2 client: batching, the one rule at a
+time retry, throttling and pruning
+'''
+
+import unittest
+
+import boto3
+
+from botocore.stub import ANY, Stubber
+
+from sgautomation.apply import MAX_PEERS_PER_CALL, AdaptiveBackoff, ApplyEngine
+from sgautomation.compiler import CompiledRule
+from sgautomation.drift import INGRESS
+
+GROUP_ID = 'sg-0123456789abcdef0'
+OTHER_GROUP_ID = 'sg-0fedcba9876543210'
+
+
+def compiled_rule(cidr, group_id=GROUP_ID, port=443):
+    return CompiledRule(None, 'mgt', 'rRule', {
+        'Type': 'AWS::EC2::SecurityGroupIngress',
+        'Properties': {
+            'GroupId': group_id,
+            'CidrIp': cidr,
+            'Description': 'Rule ID 001',
+            'IpProtocol': 'tcp',
+            'FromPort': port,
+            'ToPort': port,
+        }
+    })
+
+
+def host_rules(count, group_id=GROUP_ID):
+    return [compiled_rule('10.0.{}.{}/32'.format(i // 256, i % 256), group_id)
+            for i in range(count)]
+
+
+def live_group(group_id=GROUP_ID, cidrs=()):
+    return {
+        'GroupId': group_id,
+        'IpPermissions': [{
+            'IpProtocol': 'tcp', 'FromPort': 443, 'ToPort': 443,
+            'IpRanges': [{'CidrIp': cidr} for cidr in cidrs],
+        }] if cidrs else [],
+        'IpPermissionsEgress': [],
+    }
+
+
+class ApplyEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = boto3.client(
+            'ec2', region_name='eu-west-2',
+            aws_access_key_id='testing', aws_secret_access_key='testing'
+        )
+        self.stubber = Stubber(self.client)
+        self.stubber.activate()
+        self.sleeps = []
+        self.backoff = AdaptiveBackoff(sleep=self.sleeps.append)
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def engine(self, prune=False):
+        return ApplyEngine(self.client, workers=1, prune=prune, backoff=self.backoff)
+
+    def expect_authorize(self, group_id=GROUP_ID):
+        self.stubber.add_response(
+            'authorize_security_group_ingress', {'Return': True},
+            {'GroupId': group_id, 'IpPermissions': ANY}
+        )
+
+    def test_calls_are_batched_at_max_peers(self):
+        rules = host_rules(MAX_PEERS_PER_CALL * 2 + 1)
+        plan = self.engine().plan(rules, INGRESS, security_groups=[live_group()])
+        self.assertEqual([call.peers for call in plan.calls],
+                         [MAX_PEERS_PER_CALL, MAX_PEERS_PER_CALL, 1])
+        for _ in plan.calls:
+            self.expect_authorize()
+        result = self.engine().apply(plan)
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual((result.calls, result.authorized, result.failures),
+                         (3, len(rules), []))
+
+    def test_live_rules_are_not_authorized_again(self):
+        rules = host_rules(3)
+        live = live_group(cidrs=['10.0.0.0/32', '10.0.0.1/32'])
+        plan = self.engine().plan(rules, INGRESS, security_groups=[live])
+        self.assertEqual(plan.count('authorize'), 1)
+        self.assertEqual(plan.calls[0].permissions[0]['IpRanges'],
+                         [{'CidrIp': '10.0.0.2/32', 'Description': 'Rule ID 001'}])
+
+    def test_plan_reads_the_live_groups(self):
+        self.stubber.add_response(
+            'describe_security_groups', {'SecurityGroups': [live_group(cidrs=['10.0.0.0/32'])]},
+            {'Filters': [{'Name': 'group-id', 'Values': [GROUP_ID]}]}
+        )
+        plan = self.engine().plan(host_rules(2), INGRESS)
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(plan.count('authorize'), 1)
+
+    def test_duplicate_splits_the_batch(self):
+        plan = self.engine().plan(host_rules(3), INGRESS, security_groups=[live_group()])
+        self.stubber.add_client_error('authorize_security_group_ingress',
+                                      'InvalidPermission.Duplicate')
+        self.expect_authorize()
+        self.stubber.add_client_error('authorize_security_group_ingress',
+                                      'InvalidPermission.Duplicate')
+        self.expect_authorize()
+        result = self.engine().apply(plan)
+        self.stubber.assert_no_pending_responses()
+        # the batch plus one call per rule, the duplicate counting as done
+        self.assertEqual((result.calls, result.authorized, result.failures), (4, 2, []))
+
+    def test_single_rule_failure_does_not_stop_the_group(self):
+        plan = self.engine().plan(
+            host_rules(2) + [compiled_rule('10.1.0.0/32', OTHER_GROUP_ID)],
+            INGRESS, security_groups=[live_group(), live_group(OTHER_GROUP_ID)]
+        )
+        self.stubber.add_client_error('authorize_security_group_ingress',
+                                      'InvalidPermission.Duplicate')
+        self.stubber.add_client_error('authorize_security_group_ingress',
+                                      'InvalidParameterValue')
+        self.expect_authorize()
+        self.expect_authorize(OTHER_GROUP_ID)
+        result = self.engine().apply(plan)
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(result.authorized, 2)
+        self.assertEqual(len(result.failures), 1)
+        call, error = result.failures[0]
+        self.assertEqual(call.peers, 1)
+        self.assertEqual(error.response['Error']['Code'], 'InvalidParameterValue')
+
+    def test_duplicate_single_rule_counts_as_applied(self):
+        plan = self.engine().plan(host_rules(1), INGRESS, security_groups=[live_group()])
+        self.stubber.add_client_error('authorize_security_group_ingress',
+                                      'InvalidPermission.Duplicate')
+        result = self.engine().apply(plan)
+        self.assertEqual((result.calls, result.authorized, result.failures), (1, 0, []))
+
+    def test_throttled_calls_back_off_and_retry(self):
+        plan = self.engine().plan(host_rules(2), INGRESS, security_groups=[live_group()])
+        self.stubber.add_client_error('authorize_security_group_ingress', 'RequestLimitExceeded')
+        self.stubber.add_client_error('authorize_security_group_ingress', 'RequestLimitExceeded')
+        self.expect_authorize()
+        result = self.engine().apply(plan)
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual((result.authorized, result.failures), (2, []))
+        self.assertEqual(self.backoff.throttled, 2)
+        # the delay doubles with each throttle before the retry sleeps
+        base = self.backoff.base_delay
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertTrue(base / 2 <= self.sleeps[0] <= base)
+        self.assertTrue(base <= self.sleeps[1] <= base * 2)
+        # the success halves the delay again
+        self.assertEqual(self.backoff.delay, self.backoff.base_delay)
+
+    def test_throttling_gives_up_after_max_attempts(self):
+        self.backoff.max_attempts = 2
+        plan = self.engine().plan(host_rules(2), INGRESS, security_groups=[live_group()])
+        for _ in range(2):
+            self.stubber.add_client_error('authorize_security_group_ingress', 'RequestLimitExceeded')
+        result = self.engine().apply(plan)
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(len(result.failures), 1)
+
+    def test_prune_revokes_stale_rules(self):
+        live = live_group(cidrs=['10.0.0.0/32', '192.168.0.0/24'])
+        self.assertEqual(self.engine().plan(host_rules(1), INGRESS, [live]).calls, [])
+        plan = self.engine(prune=True).plan(host_rules(1), INGRESS, security_groups=[live])
+        self.assertEqual([(call.action, call.peers) for call in plan.calls], [('revoke', 1)])
+        self.stubber.add_response(
+            'revoke_security_group_ingress', {'Return': True},
+            {'GroupId': GROUP_ID, 'IpPermissions': [{
+                'IpProtocol': 'tcp', 'FromPort': 443, 'ToPort': 443,
+                'IpRanges': [{'CidrIp': '192.168.0.0/24'}],
+            }]}
+        )
+        result = self.engine(prune=True).apply(plan)
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual((result.revoked, result.failures), (1, []))
+
+    def test_not_found_splits_a_revoke(self):
+        live = live_group(cidrs=['10.0.0.0/32', '192.168.0.0/24', '192.168.1.0/24'])
+        plan = self.engine(prune=True).plan(host_rules(1), INGRESS, security_groups=[live])
+        self.stubber.add_client_error('revoke_security_group_ingress',
+                                      'InvalidPermission.NotFound')
+        self.stubber.add_client_error('revoke_security_group_ingress',
+                                      'InvalidPermission.NotFound')
+        self.stubber.add_response('revoke_security_group_ingress', {'Return': True},
+                                  {'GroupId': GROUP_ID, 'IpPermissions': ANY})
+        result = self.engine(prune=True).apply(plan)
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual((result.calls, result.revoked, result.failures), (3, 1, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
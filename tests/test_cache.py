@@ -0,0 +1,42 @@
+'''
+InventoryCache snapshots keep only the kinds of resource they were loaded with
+'''
+
+import shutil
+import tempfile
+import unittest
+
+from sgautomation.cache import CacheMissError, InventoryCache
+from sgautomation.inventory import AwsInventory, inventory_kinds
+
+VPC = {'VpcId': 'vpc-0000000000000001', 'CidrBlock': '10.0.0.0/16',
+       'Tags': [{'Key': 'Name', 'Value': 'mgmt-nonprod'}]}
+
+
+class InventoryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = InventoryCache(self.cache_dir)
+        self.cache.save(
+            AwsInventory(vpcs=[VPC], kinds=inventory_kinds(False, False)),
+            'prof', 'eu-west-2', 'nonprod'
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_snapshot_serves_runs_needing_only_its_kinds(self):
+        inventory = self.cache.load('prof', 'eu-west-2', 'nonprod',
+                                    security_groups=False, network_interfaces=False)
+        self.assertEqual(inventory.vpcs, [VPC])
+        self.assertEqual(inventory.kinds, inventory_kinds(False, False))
+
+    def test_snapshot_missing_a_kind_is_not_used(self):
+        self.assertIsNone(self.cache.load('prof', 'eu-west-2', 'nonprod'))
+        with self.assertRaises(CacheMissError):
+            self.cache.load('prof', 'eu-west-2', 'nonprod', offline=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
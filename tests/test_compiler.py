@@ -0,0 +1,87 @@
+'''
+Compiling rules into resources, serially and in worker processes
+'''
+
+import unittest
+
+from sgautomation.compiler import CompiledRule, SkippedRule, compile_rules
+from sgautomation.ingress import IngressGenerator
+from sgautomation.inventory import AwsInventory
+from sgautomation.rules import ALL_PORTS, IngressRule
+
+VPC = {'VpcId': 'vpc-0000000000000001', 'CidrBlock': '10.0.0.0/16',
+       'Tags': [{'Key': 'Name', 'Value': 'mgmt-nonprod'}]}
+GROUPS = [
+    {'GroupId': 'sg-00000000000000001', 'GroupName': 'mgmt-nonprod-MgtA', 'VpcId': VPC['VpcId']},
+    {'GroupId': 'sg-00000000000000002', 'GroupName': 'mgmt-nonprod-MgtB', 'VpcId': VPC['VpcId']},
+]
+PLANNED = {'MgtNew': {'Fn::ImportValue': 'mgmt-nonprod-SecurityGroup-MgtNew'}}
+
+
+def double(value):
+    return value * 2
+
+
+class CompileRulesTest(unittest.TestCase):
+
+    def test_workers_give_the_serial_results_in_order(self):
+        values = list(range(1200))
+        serial = list(compile_rules(double, values))
+        self.assertEqual(serial, [value * 2 for value in values])
+        self.assertEqual(list(compile_rules(double, values, workers=2, chunk_size=100)), serial)
+
+
+class IngressCompileRuleTest(unittest.TestCase):
+
+    def setUp(self):
+        inventory = AwsInventory(vpcs=[VPC], security_groups=GROUPS, vpc_names=['mgmt-nonprod'])
+        self.generator = IngressGenerator([], env_name='nonprod', inventory=inventory,
+                                          planned_groups=PLANNED)
+
+    def compile(self, *fields):
+        return self.generator.compile_rule(IngressRule(*fields))
+
+    def test_group_rule(self):
+        result = self.compile(1, 'Mgt_A', 443, 443, 'tcp', 'Mgt_B', 'Group', '', 2)
+        self.assertEqual(result, CompiledRule(result.rule, 'mgt', 'rMgtARule001', {
+            'Type': 'AWS::EC2::SecurityGroupIngress',
+            'Properties': {
+                'GroupId': 'sg-00000000000000001',
+                'SourceSecurityGroupId': 'sg-00000000000000002',
+                'Description': 'Rule ID 001',
+                'IpProtocol': 'tcp',
+                'FromPort': 443,
+                'ToPort': 443,
+            }
+        }))
+
+    def test_vpc_and_all_traffic_rule(self):
+        result = self.compile(2, 'Mgt_A', ALL_PORTS, ALL_PORTS, '-1', 'mgmt', 'VPC', '', 3)
+        properties = result.resource['Properties']
+        self.assertEqual(properties['CidrIp'], '10.0.0.0/16')
+        self.assertEqual((properties['IpProtocol'], properties['FromPort'], properties['ToPort']),
+                         ('-1', ALL_PORTS, ALL_PORTS))
+
+    def test_planned_groups_are_imported(self):
+        result = self.compile(3, 'Mgt_New', 22, 22, 'tcp', 'Mgt_A', 'Group', '', 4)
+        self.assertEqual(result.resource['Properties']['GroupId'],
+                         {'Fn::ImportValue': 'mgmt-nonprod-SecurityGroup-MgtNew'})
+        self.assertEqual(result.resource_name, 'rMgtNewRule003')
+        # every rule gets its own copy of the reference
+        again = self.compile(4, 'Mgt_New', 80, 80, 'tcp', 'Mgt_A', 'Group', '', 5)
+        self.assertIsNot(again.resource['Properties']['GroupId'],
+                         result.resource['Properties']['GroupId'])
+
+    def test_unresolved_rules_are_skipped(self):
+        for fields, reason in (
+                ((5, 'Mgt_X', 22, 22, 'tcp', 'Mgt_Y', 'Group', '', 6), 'groups_not_found'),
+                ((6, 'Mgt_X', 22, 22, 'tcp', 'Mgt_A', 'Group', '', 7), 'group_not_found'),
+                ((7, 'Mgt_A', 22, 22, 'tcp', 'Mgt_Y', 'Group', '', 8), 'peer_not_found'),
+                ((8, 'Mgt_A', 22, 22, 'tcp', 'dmz', 'VPC', '', 9), 'peer_not_found')):
+            result = self.compile(*fields)
+            self.assertIsInstance(result, SkippedRule)
+            self.assertEqual(result.reason, reason)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+'''
+RuleGenerator subclasses have to implement compile_rule
+'''
+
+import unittest
+
+from sgautomation.generator import RuleGenerator
+from sgautomation.inventory import AwsInventory
+
+
+class IncompleteGenerator(RuleGenerator):
+    direction = 'ingress'
+
+
+class RuleGeneratorTest(unittest.TestCase):
+
+    def test_subclass_without_compile_rule_cannot_be_created(self):
+        with self.assertRaises(TypeError):
+            IncompleteGenerator([], env_name='nonprod', inventory=AwsInventory())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+'''
+InstanceGenerator plans group changes from the role mapping sheet
+'''
+
+import unittest
+
+from sgautomation.compiler import CompiledRule, SkippedRule
+from sgautomation.instances import InstanceGenerator
+from sgautomation.inventory import AwsInventory
+from sgautomation.rules import RoleMapping
+
+VPC = {'VpcId': 'vpc-0000000000000001', 'CidrBlock': '10.0.0.0/16',
+       'Tags': [{'Key': 'Name', 'Value': 'mgmt-nonprod'}]}
+GROUPS = [
+    {'GroupId': 'sg-00000000000000001', 'GroupName': 'mgmt-nonprod-MgtA', 'VpcId': VPC['VpcId']},
+    {'GroupId': 'sg-00000000000000002', 'GroupName': 'mgmt-nonprod-MgtB', 'VpcId': VPC['VpcId']},
+]
+
+
+def instance(number, role, groups=()):
+    return {
+        'InstanceId': 'i-{:017x}'.format(number), 'VpcId': VPC['VpcId'],
+        'Tags': [{'Key': 'instance_role', 'Value': role}],
+        'NetworkInterfaces': [{
+            'NetworkInterfaceId': 'eni-{:017x}'.format(number),
+            'Attachment': {'DeviceIndex': 0},
+            'Groups': [{'GroupId': group_id} for group_id in groups],
+        }],
+    }
+
+
+class InstanceGeneratorTest(unittest.TestCase):
+
+    def setUp(self):
+        inventory = AwsInventory(
+            vpcs=[VPC], security_groups=GROUPS, vpc_names=['mgmt-nonprod'],
+            instances=[instance(1, 'bastion'), instance(2, 'bastion', ['sg-00000000000000001'])],
+        )
+        self.mappings = [
+            RoleMapping(1, 'bastion', 'Mgt_A', 'mgmt', 2),
+            RoleMapping(2, 'Bastion', 'Mgt_Missing', 'mgmt', 3),
+        ]
+        self.generator = InstanceGenerator(self.mappings, env_name='nonprod', inventory=inventory)
+
+    def test_plan_against_the_inventory_instances(self):
+        plan, result = self.generator.assign_groups(None, dry_run=True)
+        self.assertIsNone(result)
+        self.assertEqual(
+            [(assignment.instance_id, assignment.desired) for assignment in plan.assignments],
+            [('i-00000000000000001', ['sg-00000000000000001'])]
+        )
+        self.assertEqual(plan.unchanged, 1)
+        self.assertEqual([skipped.reason for skipped in plan.skipped], ['group_not_found'])
+
+    def test_compile_rule_resolves_the_mapped_group(self):
+        compiled = self.generator.compile_rule(self.mappings[0])
+        self.assertIsInstance(compiled, CompiledRule)
+        self.assertEqual((compiled.key, compiled.resource), ('bastion', 'sg-00000000000000001'))
+        self.assertIsInstance(self.generator.compile_rule(self.mappings[1]), SkippedRule)
+
+
+if __name__ == '__main__':
+    unittest.main()
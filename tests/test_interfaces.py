@@ -0,0 +1,86 @@
+'''
+InterfaceIndex lookups over describe_network_interfaces output
+'''
+
+import unittest
+
+from sgautomation.egress import EgressGenerator
+from sgautomation.interfaces import InterfaceIndex
+from sgautomation.inventory import AwsInventory
+
+NLB_A = {
+    'NetworkInterfaceId': 'eni-01', 'InterfaceType': 'network_load_balancer',
+    'Description': 'ELB net/mgmt-nonprod-ToolingNLB/0123456789abcdef',
+    'AvailabilityZone': 'eu-west-2a', 'PrivateIpAddress': '10.0.1.10', 'SubnetId': 'subnet-a',
+    'Groups': [],
+}
+NLB_B = dict(NLB_A, NetworkInterfaceId='eni-02', AvailabilityZone='eu-west-2b',
+             PrivateIpAddress='10.0.2.10', SubnetId='subnet-b')
+DIRECTORY = {
+    'NetworkInterfaceId': 'eni-03', 'InterfaceType': 'interface',
+    'Description': 'AWS created network interface for directory d-1234567890',
+    'SubnetId': 'subnet-a', 'Groups': [{'GroupId': 'sg-dc'}],
+}
+SECOND_DIRECTORY = dict(DIRECTORY, NetworkInterfaceId='eni-04',
+                        Description='AWS created network interface for directory d-0987654321',
+                        Groups=[{'GroupId': 'sg-dc2'}])
+INSTANCE = {
+    'NetworkInterfaceId': 'eni-05', 'InterfaceType': 'interface', 'Description': '',
+    'SubnetId': 'subnet-b', 'Attachment': {'InstanceId': 'i-01', 'DeviceIndex': 0},
+    'Groups': [{'GroupId': 'sg-app'}, {'GroupId': 'sg-dc'}],
+}
+INSTANCE_SECOND = dict(INSTANCE, NetworkInterfaceId='eni-06',
+                       Attachment={'InstanceId': 'i-01', 'DeviceIndex': 1},
+                       Groups=[{'GroupId': 'sg-app'}])
+INTERFACES = [NLB_A, NLB_B, DIRECTORY, SECOND_DIRECTORY, INSTANCE, INSTANCE_SECOND]
+
+
+def ids(interfaces):
+    return [interface['NetworkInterfaceId'] for interface in interfaces]
+
+
+class InterfaceIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = InterfaceIndex(INTERFACES)
+
+    def test_by_instance(self):
+        self.assertEqual(ids(self.index.by_instance['i-01']), ['eni-05', 'eni-06'])
+        self.assertNotIn('i-02', self.index.by_instance)
+
+    def test_by_subnet(self):
+        self.assertEqual(ids(self.index.by_subnet['subnet-a']), ['eni-01', 'eni-03', 'eni-04'])
+        self.assertEqual(ids(self.index.by_subnet['subnet-b']), ['eni-02', 'eni-05', 'eni-06'])
+
+    def test_by_group(self):
+        self.assertEqual(ids(self.index.by_group['sg-app']), ['eni-05', 'eni-06'])
+        self.assertEqual(ids(self.index.by_group['sg-dc']), ['eni-03', 'eni-05'])
+
+    def test_by_type(self):
+        self.assertEqual(ids(self.index.by_type['network_load_balancer']), ['eni-01', 'eni-02'])
+
+    def test_load_balancers_by_availability_zone(self):
+        self.assertEqual(self.index.load_balancers, {
+            'mgmt-nonprod-ToolingNLB': {'eu-west-2a': '10.0.1.10/32', 'eu-west-2b': '10.0.2.10/32'},
+        })
+
+    def test_first_directory_group(self):
+        self.assertEqual(list(self.index.directories), ['d-1234567890', 'd-0987654321'])
+        self.assertEqual(self.index.directory_group(), 'sg-dc')
+        self.assertIsNone(InterfaceIndex([NLB_A]).directory_group())
+
+
+class EgressProcessStateTest(unittest.TestCase):
+
+    def test_interfaces_are_not_sent_to_workers(self):
+        generator = EgressGenerator([], env_name='nonprod',
+                                    inventory=AwsInventory(network_interfaces=INTERFACES))
+        self.assertEqual(ids(generator.network_interfaces), ids(INTERFACES))
+        state = generator.__getstate__()
+        self.assertNotIn('network_interfaces', state)
+        self.assertNotIn('interfaces', state)
+        self.assertEqual(state['dc_group'], 'sg-dc')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+'''
+AwsInventory.load and describe_all: pagination, one paginated call per
+describe and the describes running concurrently
+'''
+
+import threading
+import unittest
+
+import boto3
+
+from botocore.stub import Stubber
+
+from benchmarks.stub_client import StubEC2Client
+from sgautomation.inventory import AwsInventory, describe_all
+
+MGMT_VPC = {'VpcId': 'vpc-0000000000000001', 'CidrBlock': '10.0.0.0/16',
+            'Tags': [{'Key': 'Name', 'Value': 'mgmt-nonprod'}]}
+OTHER_VPC = {'VpcId': 'vpc-0000000000000002', 'CidrBlock': '10.1.0.0/16',
+             'Tags': [{'Key': 'Name', 'Value': 'mgmt-prod'}]}
+
+
+def security_group(number, vpc=MGMT_VPC):
+    return {'GroupId': 'sg-{:017x}'.format(number), 'GroupName': 'group{}'.format(number),
+            'VpcId': vpc['VpcId']}
+
+
+def load_balancer_interface(number, vpc=MGMT_VPC):
+    return {'NetworkInterfaceId': 'eni-{:017x}'.format(number), 'VpcId': vpc['VpcId'],
+            'InterfaceType': 'network_load_balancer',
+            'Description': 'ELB net/mgmt-nonprod-ToolingNLB/{}'.format(number)}
+
+
+class ConcurrentStubClient(StubEC2Client):
+    '''
+    Holds the security group and network interface describes until both
+    have started, so load only finishes if they run at the same time
+    '''
+    def __init__(self, *args, **kwargs):
+        super(ConcurrentStubClient, self).__init__(*args, **kwargs)
+        self.barrier = threading.Barrier(2, timeout=5)
+
+    def query(self, operation, filters=None):
+        if operation in ('describe_security_groups', 'describe_network_interfaces'):
+            self.barrier.wait()
+        return super(ConcurrentStubClient, self).query(operation, filters)
+
+
+class DescribeAllTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = boto3.client(
+            'ec2', region_name='eu-west-2',
+            aws_access_key_id='testing', aws_secret_access_key='testing'
+        )
+        self.stubber = Stubber(self.client)
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def test_every_page_is_read(self):
+        self.stubber.add_response(
+            'describe_security_groups',
+            {'SecurityGroups': [security_group(1), security_group(2)], 'NextToken': 'page2'}, {}
+        )
+        self.stubber.add_response(
+            'describe_security_groups',
+            {'SecurityGroups': [security_group(3)], 'NextToken': 'page3'}, {'NextToken': 'page2'}
+        )
+        self.stubber.add_response(
+            'describe_security_groups', {'SecurityGroups': []}, {'NextToken': 'page3'}
+        )
+        groups = describe_all(self.client, 'describe_security_groups', 'SecurityGroups')
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual([group['GroupName'] for group in groups], ['group1', 'group2', 'group3'])
+
+    def test_load_filters_on_the_environment_vpcs(self):
+        self.stubber.add_response('describe_vpcs', {'Vpcs': [MGMT_VPC, OTHER_VPC]}, {})
+        self.stubber.add_response(
+            'describe_security_groups',
+            {'SecurityGroups': [security_group(1)], 'NextToken': 'page2'},
+            {'Filters': [{'Name': 'vpc-id', 'Values': [MGMT_VPC['VpcId']]}]}
+        )
+        self.stubber.add_response(
+            'describe_security_groups', {'SecurityGroups': [security_group(2)]},
+            {'Filters': [{'Name': 'vpc-id', 'Values': [MGMT_VPC['VpcId']]}], 'NextToken': 'page2'}
+        )
+        inventory = AwsInventory.load(self.client, vpc_names=['mgmt-nonprod'],
+                                      network_interfaces=False)
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(inventory.vpc_ids, [MGMT_VPC['VpcId']])
+        self.assertEqual(len(inventory.vpcs), 2)
+        self.assertEqual(len(inventory.security_groups), 2)
+        self.assertEqual(inventory.network_interfaces, [])
+        self.assertIsNone(inventory.instances)
+
+
+class AwsInventoryLoadTest(unittest.TestCase):
+
+    def test_one_paginated_call_per_describe(self):
+        client = StubEC2Client(
+            vpcs=[MGMT_VPC, OTHER_VPC],
+            security_groups=[security_group(i) for i in range(5)] + [security_group(9, OTHER_VPC)],
+            network_interfaces=[load_balancer_interface(1)],
+            page_size=2,
+        )
+        inventory = AwsInventory.load(client, vpc_names=['mgmt-nonprod'])
+        self.assertEqual(client.calls, {
+            'describe_vpcs': 1,
+            'describe_security_groups': 1,
+            'describe_network_interfaces': 1,
+        })
+        self.assertEqual(len(inventory.security_groups), 5)
+        self.assertEqual(len(inventory.network_interfaces), 1)
+
+    def test_describes_run_concurrently(self):
+        client = ConcurrentStubClient(
+            vpcs=[MGMT_VPC],
+            security_groups=[security_group(1)],
+            network_interfaces=[load_balancer_interface(1)],
+        )
+        inventory = AwsInventory.load(client, vpc_names=['mgmt-nonprod'], max_workers=4)
+        self.assertEqual(len(inventory.security_groups), 1)
+        self.assertEqual(len(inventory.network_interfaces), 1)
+
+    def test_kinds_not_asked_for_are_not_described(self):
+        client = StubEC2Client(vpcs=[MGMT_VPC], security_groups=[security_group(1)])
+        inventory = AwsInventory.load(client, vpc_names=['mgmt-nonprod'],
+                                      security_groups=False, network_interfaces=False)
+        self.assertEqual(client.calls, {'describe_vpcs': 1})
+        self.assertEqual(inventory.security_groups, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+'''
+Linting sheets against an inventory
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sgautomation.inventory import AwsInventory
+from sgautomation.lint import lint_sheets
+
+EGRESS_HEADER = 'RULE ID,SECURITY GROUP NAME,FROM PORT,TO PORT,PROTOCOL,TO SECURITY GROUP,FROM TYPE,DESCRIPTION\n'
+MGMT_VPC = {'VpcId': 'vpc-0000000000000001', 'CidrBlock': '10.0.0.0/16',
+            'Tags': [{'Key': 'Name', 'Value': 'mgmt-nonprod'}]}
+GROUP = {'GroupId': 'sg-00000000000000001', 'GroupName': 'mgmt-nonprod-MgtA',
+         'VpcId': MGMT_VPC['VpcId']}
+
+
+class LintReferencesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_sheet(self, header, *rows):
+        path = os.path.join(self.directory, 'sheet.csv')
+        with open(path, 'w') as sheet_file:
+            sheet_file.write(header + ''.join(row + '\n' for row in rows))
+        return path
+
+    def test_vpc_peer_in_an_egress_sheet_is_an_invalid_peer_type(self):
+        egress = self.write_sheet(
+            EGRESS_HEADER,
+            '1,Mgt_A,443,443,tcp,mgmt,VPC,to the mgmt vpc',
+            '2,Mgt_A,443,443,tcp,Mgt_Missing,Group,to a missing group',
+        )
+        inventory = AwsInventory(vpcs=[MGMT_VPC], security_groups=[GROUP],
+                                 vpc_names=['mgmt-nonprod'])
+        report = lint_sheets(egress_file=egress, inventory=inventory, env_name='nonprod')
+        checks = sorted((finding.line, finding.check) for finding in report.findings)
+        self.assertEqual(checks, [(2, 'invalid_peer_type'), (3, 'unknown_peer')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+'''
+Incremental template writing against the manifest of the previous run
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sgautomation.ingress import IngressGenerator
+from sgautomation.inventory import AwsInventory
+from sgautomation.manifest import TemplateWriter
+from sgautomation.rules import IngressRule
+
+VPC = {'VpcId': 'vpc-0000000000000001', 'CidrBlock': '10.0.0.0/16',
+       'Tags': [{'Key': 'Name', 'Value': 'mgmt-nonprod'}]}
+GROUPS = [
+    {'GroupId': 'sg-00000000000000001', 'GroupName': 'mgmt-nonprod-MgtA', 'VpcId': VPC['VpcId']},
+    {'GroupId': 'sg-00000000000000002', 'GroupName': 'dmz-nonprod-DmzB', 'VpcId': VPC['VpcId']},
+]
+RULES = [
+    IngressRule(1, 'Mgt_A', 443, 443, 'tcp', '10.0.0.0/24', 'CIDR', '', 2),
+    IngressRule(2, 'Mgt_A', 22, 22, 'tcp', 'Dmz_B', 'Group', '', 3),
+    IngressRule(3, 'Dmz_B', 80, 80, 'tcp', '10.1.0.0/24', 'CIDR', '', 4),
+]
+
+
+def template(*names):
+    return {
+        'AWSTemplateFormatVersion': '2010-09-09',
+        'Resources': {name: {'Type': 'AWS::EC2::SecurityGroupIngress', 'Properties': {}}
+                      for name in names},
+    }
+
+
+class TemplateWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, templates):
+        writer = TemplateWriter(self.directory, 'Prefix', incremental=True)
+        written = [
+            writer.write(os.path.join(self.directory, name + '.template.yaml'), content)
+            for name, content in sorted(templates.items())
+        ]
+        return written, writer.finish()
+
+    def generate(self, rules):
+        inventory = AwsInventory(vpcs=[VPC], security_groups=GROUPS, vpc_names=['mgmt-nonprod'])
+        generator = IngressGenerator(rules, env_name='nonprod', inventory=inventory)
+        generator.generate_security_group_structure()
+        generator.write_to_file(self.directory, incremental=True)
+        return generator.changeset
+
+    def test_unchanged_templates_are_not_rewritten(self):
+        templates = {'PrefixA': template('r1', 'r2'), 'PrefixB': template('r3')}
+        written, changeset = self.write(templates)
+        self.assertEqual(written, [True, True])
+        self.assertEqual(changeset.summary().splitlines()[-1], '2 templates changed, 0 unchanged')
+        written, changeset = self.write(templates)
+        self.assertEqual(written, [False, False])
+        self.assertEqual(changeset.summary(), '0 templates changed, 2 unchanged')
+
+    def test_changes_are_listed_per_template(self):
+        self.write({'PrefixA': template('r1', 'r2'), 'PrefixB': template('r3')})
+        changed = template('r1', 'r4')
+        changed['Resources']['r1']['Properties']['FromPort'] = 22
+        written, changeset = self.write({'PrefixA': changed})
+        self.assertEqual(written, [True])
+        self.assertEqual(changeset.summary().splitlines(), [
+            'PrefixA.template.yaml: 1 added, 1 removed, 1 modified',
+            'PrefixB.template.yaml: no longer generated, 1 resources removed',
+            '2 templates changed, 0 unchanged',
+        ])
+
+    def test_second_generator_run_changes_nothing(self):
+        first = self.generate(RULES)
+        self.assertEqual(first.summary().splitlines()[-1], '2 templates changed, 0 unchanged')
+        second = self.generate(RULES)
+        self.assertEqual(second.summary(), '0 templates changed, 2 unchanged')
+        third = self.generate(RULES[:2])
+        self.assertEqual(third.summary().splitlines()[-1], '1 templates changed, 1 unchanged')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+'''
+RuleOptimiser: duplicates, port range merges and CIDR collapse
+'''
+
+import unittest
+
+from sgautomation.compiler import CompiledRule
+from sgautomation.optimiser import RuleOptimiser
+from sgautomation.rules import ALL_PORTS, IngressRule
+
+GROUP_ID = 'sg-0123456789abcdef0'
+
+
+def cidr_rule(rule_id, from_port, to_port, cidr='10.0.0.0/24', protocol='tcp'):
+    rule = IngressRule(rule_id, 'Mgt_A', from_port, to_port, protocol, cidr, 'CIDR',
+                       'rule {}'.format(rule_id), rule_id + 1)
+    return CompiledRule(rule, 'mgt', 'rMgtARule{:03}'.format(rule_id), {
+        'Type': 'AWS::EC2::SecurityGroupIngress',
+        'Properties': {
+            'GroupId': GROUP_ID,
+            'CidrIp': cidr,
+            'IpProtocol': protocol,
+            'FromPort': from_port,
+            'ToPort': to_port,
+            'Description': 'rule {}'.format(rule_id),
+        }
+    })
+
+
+def ports(rules):
+    return [
+        (rule.resource_name, rule.resource['Properties']['FromPort'],
+         rule.resource['Properties']['ToPort'])
+        for rule in rules
+    ]
+
+
+class RuleOptimiserTest(unittest.TestCase):
+
+    def optimise(self, *rules):
+        return RuleOptimiser().optimise(list(rules))
+
+    def test_duplicates_are_dropped(self):
+        rules, report = self.optimise(cidr_rule(1, 443, 443), cidr_rule(2, 443, 443))
+        self.assertEqual(ports(rules), [('rMgtARule001', 443, 443)])
+        self.assertEqual(report.duplicates, 1)
+
+    def test_adjacent_and_overlapping_ranges_merge(self):
+        rules, report = self.optimise(
+            cidr_rule(1, 80, 80), cidr_rule(2, 81, 90), cidr_rule(3, 85, 100),
+            cidr_rule(4, 200, 200)
+        )
+        self.assertEqual(ports(rules), [('rMgtARule001', 80, 100), ('rMgtARule004', 200, 200)])
+        self.assertEqual(report.port_merges, 2)
+        self.assertEqual(rules[0].resource['Properties']['Description'],
+                         'rule 1 (merged 002, 003)')
+
+    def test_all_ports_rule_absorbs_the_ranges_it_covers(self):
+        rules, report = self.optimise(
+            cidr_rule(1, ALL_PORTS, ALL_PORTS), cidr_rule(2, 0, 10), cidr_rule(3, 443, 443)
+        )
+        self.assertEqual(ports(rules), [('rMgtARule001', 0, 65535)])
+        self.assertEqual(report.port_merges, 2)
+
+    def test_lone_all_ports_rule_is_left_alone(self):
+        rules, _ = self.optimise(cidr_rule(1, ALL_PORTS, ALL_PORTS),
+                                 cidr_rule(2, 0, 10, protocol='udp'))
+        self.assertEqual(ports(rules), [('rMgtARule001', ALL_PORTS, ALL_PORTS),
+                                        ('rMgtARule002', 0, 10)])
+
+    def test_cidrs_collapse(self):
+        rules, report = self.optimise(
+            cidr_rule(1, 22, 22, '10.0.0.0/25'), cidr_rule(2, 22, 22, '10.0.0.128/25'),
+            cidr_rule(3, 22, 22, '10.1.0.0/24')
+        )
+        self.assertEqual([rule.resource['Properties']['CidrIp'] for rule in rules],
+                         ['10.0.0.0/24', '10.1.0.0/24'])
+        self.assertEqual(report.cidr_merges, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+'''
+Packing resources into numbered templates within the CloudFormation limits
+'''
+
+import io
+import shutil
+import tempfile
+import unittest
+
+from sgautomation.ingress import TEMPLATE_HEADER, TEMPLATE_PREFIX
+from sgautomation.partition import Item, Partitioner, pack_templates
+from sgautomation.templates import MAX_TEMPLATE_BYTES, MAX_TEMPLATE_RESOURCES, TemplateBuilder
+
+
+def rule_resources(groups=40, rules_per_group=25):
+    '''
+    Ingress resources of uneven sizes, rules_per_group for each group
+    '''
+    for group in range(groups):
+        for rule in range(rules_per_group):
+            yield 'g{:02}'.format(group % 7), 'Group{:02}'.format(group), 'rGroup{:02}Rule{:03}'.format(group, rule), {
+                'Type': 'AWS::EC2::SecurityGroupIngress',
+                'Properties': {
+                    'GroupId': 'sg-{:017x}'.format(group),
+                    'CidrIp': '10.{}.{}.0/24'.format(group, rule),
+                    'Description': 'Rule ID {:03} '.format(rule) + 'x' * (group * rule % 150),
+                    'IpProtocol': 'tcp',
+                    'FromPort': rule,
+                    'ToPort': rule,
+                }
+            }
+
+
+def build(resources):
+    builder = TemplateBuilder(header=TEMPLATE_HEADER)
+    for key, affinity, resource_name, resource in resources:
+        builder.add(key, resource_name, resource, affinity=affinity)
+    return builder
+
+
+class PackTemplatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def pack(self, resources):
+        builder = build(resources)
+        assignments = pack_templates(builder, self.directory, TEMPLATE_PREFIX)
+        return builder, assignments
+
+    def test_no_template_goes_over_the_limits(self):
+        builder, assignments = self.pack(rule_resources())
+        self.assertEqual(len(assignments), 1000)
+        self.assertGreater(len(builder.container), 1)
+        for bucket, template in builder.container.items():
+            template = dict(template, **TEMPLATE_HEADER)
+            output = io.StringIO()
+            builder.emitter.dump(template, output)
+            self.assertLessEqual(len(template['Resources']), MAX_TEMPLATE_RESOURCES, bucket)
+            self.assertLessEqual(len(output.getvalue().encode('utf-8')), MAX_TEMPLATE_BYTES, bucket)
+
+    def test_packing_is_stable_across_runs(self):
+        _, first = self.pack(rule_resources())
+        _, second = self.pack(rule_resources())
+        self.assertEqual(first, second)
+        # a new group goes into free space without moving existing rules
+        _, third = self.pack(list(rule_resources()) + list(rule_resources(41, 1))[-1:])
+        self.assertEqual({name: third[name] for name in first}, first)
+
+    def test_first_fit_decreasing(self):
+        partitioner = Partitioner(max_bytes=100, max_resources=3)
+        assignments = partitioner.pack([
+            Item('a1', 60, 'a'), Item('b1', 30, 'b'), Item('b2', 30, 'b'),
+            Item('c1', 40, 'c'), Item('d1', 10, 'd'),
+        ])
+        # b weighs most (2 of 3 resources), then a, c and d; c fills
+        # template 1 to 100 bytes and 3 resources, so d joins a
+        self.assertEqual(assignments, {'b1': 1, 'b2': 1, 'c1': 1, 'a1': 2, 'd1': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+'''
+RuleIndex queries for icmp, all traffic and port ranges
+'''
+
+import unittest
+
+from sgautomation.query import RuleIndex
+from sgautomation.rules import ALL_PORTS, IngressRule
+
+RULES = [
+    IngressRule(1, 'Mgt_A', ALL_PORTS, ALL_PORTS, '-1', 'Mgt_B', 'Group', 'all from B', 2),
+    IngressRule(2, 'Mgt_A', 1500, 1600, 'udp', 'Mgt_C', 'Group', 'udp range', 3),
+    IngressRule(3, 'Mgt_A', ALL_PORTS, ALL_PORTS, 'icmp', '10.0.0.0/8', 'CIDR', 'ping', 4),
+]
+
+
+class RuleIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = RuleIndex(RULES)
+
+    def rule_ids(self, rules):
+        return [rule.rule_id for rule in rules]
+
+    def test_icmp_query_matches_all_traffic_and_icmp_rules(self):
+        # parse_ports gives ALL_PORTS for 0/icmp and 8/icmp alike
+        self.assertTrue(self.index.can_reach('Mgt_B', 'Mgt_A', ALL_PORTS, 'icmp').allowed)
+        self.assertEqual(self.rule_ids(self.index.rules('Mgt_A', ALL_PORTS, 'icmp')), [1, 3])
+        self.assertEqual(
+            self.rule_ids(self.index.exposed('10.1.0.0/16', ALL_PORTS, 'icmp')), [3]
+        )
+
+    def test_all_traffic_query(self):
+        self.assertEqual(self.rule_ids(self.index.rules('Mgt_A', ALL_PORTS, '-1')), [1])
+
+    def test_port_ranges_are_queried_whole(self):
+        self.assertTrue(self.index.can_reach('Mgt_C', 'Mgt_A', 1000, 'udp', to_port=2000).allowed)
+        self.assertFalse(self.index.can_reach('Mgt_C', 'Mgt_A', 1000, 'udp').allowed)
+        self.assertEqual(self.rule_ids(self.index.rules('Mgt_A', 1000, 'udp', to_port=2000)), [1, 2])
+        self.assertEqual(self.rule_ids(self.index.rules('Mgt_A', 1000, 'udp')), [1])
+
+    def test_exposed_port_range(self):
+        self.assertEqual(self.index.exposed('10.1.0.0/16', 22, 'tcp'), [])
+        self.assertEqual(
+            self.rule_ids(self.index.exposed('10.1.0.0/16', 0, '-1', to_port=65535)), [3]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
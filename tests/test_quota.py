@@ -0,0 +1,40 @@
+'''
+Rule quota suggestions for groups with CIDRs the fast path cannot parse
+'''
+
+import unittest
+
+from sgautomation.compiler import CompiledRule
+from sgautomation.drift import INGRESS
+from sgautomation.quota import plan_quotas
+from sgautomation.rules import IngressRule
+
+RULE = IngressRule(1, 'Mgt_A', 443, 443, 'tcp', '10.0.0.0/24', 'CIDR', '', 2)
+
+
+def cidr_rule(cidr):
+    return CompiledRule(RULE, 'mgt', 'rMgtARule001', {
+        'Type': 'AWS::EC2::SecurityGroupIngress',
+        'Properties': {
+            'GroupId': 'sg-0123456789abcdef0',
+            'CidrIp': cidr,
+            'IpProtocol': 'tcp',
+            'FromPort': 443,
+            'ToPort': 443,
+        }
+    })
+
+
+class PlanQuotasTest(unittest.TestCase):
+
+    def test_malformed_cidr_on_a_group_over_quota(self):
+        rules = [cidr_rule('10.0.{}.0/24'.format(i)) for i in range(70)]
+        rules.append(cidr_rule('10.0.x.0/24'))
+        report = plan_quotas(rules, INGRESS, quota=60)
+        self.assertEqual(len(report.violations), 1)
+        # the 70 /24s collapse into 3 networks, the malformed CIDR stays as it is
+        self.assertIn('brings it to 4 rules', report.describe()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
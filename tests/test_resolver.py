@@ -0,0 +1,75 @@
+'''
+SecurityGroupResolver gives the same ids as the linear scan it replaced
+'''
+
+import unittest
+
+from sgautomation.resolver import SecurityGroupResolver
+
+DC_GROUP = 'sg-0000000000000dc01'
+GROUPS = [
+    {'GroupId': 'sg-01', 'GroupName': 'mgmt-nonprod-SecurityGroup-MgtProxy'},
+    {'GroupId': 'sg-02', 'GroupName': 'mgmt-nonprod-SecurityGroup-MgtRhelInstances'},
+    {'GroupId': 'sg-03', 'GroupName': 'dmz-nonprod-SecurityGroup-Proxy'},
+    {'GroupId': 'sg-04', 'GroupName': 'mgmt-nonprod-SecurityGroup-Proxy.old'},
+    {'GroupId': 'sg-05', 'GroupName': 'mgmttemp-nonprod-SecurityGroup-Bastion'},
+    {'GroupId': 'sg-06', 'GroupName': 'appdatatemp-nonprod-SecurityGroup-Bastion'},
+    {'GroupId': 'sg-07', 'GroupName': 'appd-nonprod-SecurityGroup-ActiveDirectory'},
+    {'GroupId': 'sg-08', 'GroupName': 'appd-nonprod-SecurityGroup-Web.Tier'},
+    {'GroupName': 'no-id-SecurityGroup-Orphan'},
+]
+NAMES = [
+    # segment matches, several of which match more than one group
+    'MgtProxy', 'Proxy', 'proxy', 'SecurityGroup-Proxy', 'MgtRhelInstances',
+    'Web', 'Tier', 'Web.Tier', 'Orphan',
+    # temp names match on any substring
+    'mgmttemp', 'temp', 'TEMP-nonprod', 'datatemp-nonprod-SecurityGroup-Bast',
+    # the domain controller group wins over a group of the same name
+    'ActiveDirectory', 'activedirectory',
+    # misses
+    'Mgt', 'Prox', 'ProxyX', 'nosuchtemp', 'Proxy.old.new', '',
+]
+
+
+def linear_scan(groups, short_name, dc_group=None):
+    '''
+    The lookup from before the resolver was indexed
+    '''
+    if short_name.lower() == 'activedirectory' and dc_group:
+        return dc_group
+    for group in groups:
+        logical_name = group.get('GroupName', '').lower()
+        if 'temp' in short_name.lower() and short_name.lower() in logical_name.lower():
+            return group.get('GroupId', '')
+        elif short_name.lower() + '.' in logical_name.lower() + '.':
+            return group.get('GroupId', '')
+
+
+class SecurityGroupResolverTest(unittest.TestCase):
+
+    def assert_matches_linear_scan(self, groups, dc_group=None):
+        resolver = SecurityGroupResolver(groups, dc_group)
+        for name in NAMES:
+            self.assertEqual(resolver.resolve(name), linear_scan(groups, name, dc_group), name)
+
+    def test_same_results_as_the_linear_scan(self):
+        self.assert_matches_linear_scan(GROUPS)
+
+    def test_same_results_with_a_domain_controller_group(self):
+        self.assert_matches_linear_scan(GROUPS, DC_GROUP)
+
+    def test_first_group_in_describe_order_wins(self):
+        self.assert_matches_linear_scan(list(reversed(GROUPS)))
+        resolver = SecurityGroupResolver(GROUPS)
+        # MgtProxy ends in proxy, so it matches before dmz's Proxy
+        self.assertEqual(resolver.resolve('Proxy'), 'sg-01')
+        self.assertEqual(SecurityGroupResolver(list(reversed(GROUPS))).resolve('Proxy'), 'sg-04')
+
+    def test_misses_are_none(self):
+        resolver = SecurityGroupResolver(GROUPS)
+        self.assertIsNone(resolver.resolve('Prox'))
+        self.assertIsNone(resolver.resolve('nosuchtemp'))
+
+
+if __name__ == '__main__':
+    unittest.main()
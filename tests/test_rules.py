@@ -0,0 +1,95 @@
+'''
+Reading the rule sheets: row normalisation, port parsing and skipped rows
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sgautomation.rules import (
+    ALL_PORTS, EgressRule, IngressRule, RowValidationError, RuleSheetReader, parse_ports
+)
+
+INGRESS_HEADER = 'RULE ID,SECURITY GROUP NAME,FROM PORT,TO PORT,PROTOCOL,FROM REFERENCE,FROM TYPE,DESCRIPTION\n'
+
+
+class ParsePortsTest(unittest.TestCase):
+
+    def test_all_and_icmp_cover_every_port(self):
+        self.assertEqual(parse_ports('all', '', 'tcp'), (ALL_PORTS, ALL_PORTS))
+        self.assertEqual(parse_ports('ALL', '443', 'udp'), (ALL_PORTS, ALL_PORTS))
+        self.assertEqual(parse_ports('8', '0', 'icmp'), (ALL_PORTS, ALL_PORTS))
+        self.assertEqual(parse_ports('', '', '-1'), (ALL_PORTS, ALL_PORTS))
+
+    def test_single_ports_and_ranges(self):
+        self.assertEqual(parse_ports(' 443 ', '0', 'tcp'), (443, 443))
+        self.assertEqual(parse_ports('443', '', 'tcp'), (443, 443))
+        self.assertEqual(parse_ports('', '443', 'tcp'), (443, 443))
+        self.assertEqual(parse_ports('1024-2048', '', 'tcp'), (1024, 2048))
+        self.assertEqual(parse_ports('1024', '2048', 'tcp'), (1024, 2048))
+
+    def test_invalid_ports(self):
+        for from_port, to_port in (('', ''), ('http', ''), ('70000', ''), ('2048', '1024')):
+            with self.assertRaises(RowValidationError):
+                parse_ports(from_port, to_port, 'tcp')
+
+
+class RuleSheetReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_sheet(self, text):
+        path = os.path.join(self.directory, 'sheet.csv')
+        with open(path, 'w') as sheet_file:
+            sheet_file.write(text)
+        return path
+
+    def test_rows_are_normalised(self):
+        path = self.write_sheet(
+            INGRESS_HEADER + ' 7 , Mgt_A ,443,0, TCP , Mgt_B ,Group, from B \n'
+            '8,Mgt_A,all,,6,10.0.0.0/8,CIDR\n'
+        )
+        self.assertEqual(list(RuleSheetReader(path, IngressRule).read()), [
+            IngressRule(7, 'Mgt_A', 443, 443, 'tcp', 'Mgt_B', 'Group', 'from B', 2),
+            IngressRule(8, 'Mgt_A', ALL_PORTS, ALL_PORTS, 'tcp', '10.0.0.0/8', 'CIDR', '', 3),
+        ])
+
+    def test_columns_are_found_by_header_name(self):
+        path = self.write_sheet(
+            'to type,Description,to security group,protocol,to port,from port,security group name,rule id\n'
+            'LB_A,to the NLB,ToolingNLB,17,53,53,Mgt_A,1\n'
+        )
+        self.assertEqual(list(RuleSheetReader(path, EgressRule).read()), [
+            EgressRule(1, 'Mgt_A', 53, 53, 'udp', 'ToolingNLB', 'LB_A', 'to the NLB', 2),
+        ])
+
+    def test_invalid_rows_are_skipped_and_recorded(self):
+        path = self.write_sheet(
+            INGRESS_HEADER +
+            'x,Mgt_A,443,443,tcp,Mgt_B,Group\n'
+            ',,,,,,,\n'
+            '2,Mgt_A,443,443,tcp,Mgt_B,LB_A\n'
+            '3,Mgt_A,443,443,tcp,,Group\n'
+            '4,Mgt_A,443,443,tcp,Mgt_B,Group\n'
+        )
+        reader = RuleSheetReader(path, IngressRule)
+        self.assertEqual([rule.rule_id for rule in reader.read()], [4])
+        self.assertEqual([(error.line, error.rule_id, error.message) for error in reader.errors], [
+            (2, 'x', "Invalid rule id 'x'"),
+            (4, '2', "Unknown type 'LB_A'"),
+            (5, '3', 'No Group reference'),
+        ])
+
+    def test_missing_column(self):
+        path = self.write_sheet('RULE ID,SECURITY GROUP NAME\n1,Mgt_A\n')
+        with self.assertRaises(ValueError):
+            list(RuleSheetReader(path, IngressRule).read())
+
+
+if __name__ == '__main__':
+    unittest.main()